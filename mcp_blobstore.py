@@ -0,0 +1,176 @@
+import os, json, re, shutil, time, atexit
+from threading import Lock, Thread
+
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class BlobStore:
+    """Files the server received, addressed by sha256, so content it has seen before (a reverted asset, the same file on
+    another branch) is put in place locally instead of being transferred again.
+
+    Blobs live at <root_dir>/<sha256[:2]>/<sha256> and are added and materialized as hardlinks where the filesystem
+    allows (copies otherwise), so a blob costs no space while a checkout file still shares it.  Received files and git
+    replace checkout files rather than writing into them, but a blob whose size or mtime no longer matches what was
+    recorded when it was added is dropped instead of used.  Beyond max_bytes (0 = unlimited), blobs are removed least
+    recently used first.
+
+    The index is written every flush_interval_s (and at exit) when something changed, not on every add, so syncing a
+    few thousand files does not rewrite it a few thousand times.  A crash loses at most the last interval's entries,
+    whose blobs are then simply unknown and get added again."""
+
+    def __init__(self, root_dir: str, max_bytes: int = 0, flush_interval_s: float = 30.0):
+        self.root_dir = root_dir
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = Lock()
+        self._index_path = os.path.join(root_dir, 'index.json')
+        #sha256 -> [size, mtime_ns, last_used_at]
+        self._blobs: dict[str, list] = {}
+        self._hits = 0
+        self._misses = 0
+        self._dirty = False
+        self.flush_interval_s = max(1.0, float(flush_interval_s))
+        os.makedirs(root_dir, exist_ok=True)
+        try:
+            with open(self._index_path, 'r') as f:
+                self._blobs = json.load(f)
+        except (OSError, ValueError):
+            self._blobs = {}
+        atexit.register(self.flush)
+        Thread(target=self._flush_periodically, daemon=True).start()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root_dir, sha256[:2], sha256)
+
+    def flush(self) -> None:
+        """Writes the index if it changed since the last write."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = f'{self._index_path}.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._blobs, f)
+                os.replace(tmp_path, self._index_path)
+            except OSError as e:
+                print(f'Could not write the blob store index: {e}')
+                return
+            self._dirty = False
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.flush_interval_s)
+            self.flush()
+
+    def holds(self, sha256: str, path: str) -> bool:
+        """True if path is a hardlink of the (still valid) blob for sha256, i.e. it has that content without hashing it."""
+        with self._lock:
+            if not self._valid_locked(sha256):
+                return False
+            try:
+                return os.path.samefile(self.blob_path(sha256), path)
+            except OSError:
+                return False
+
+    def _valid_locked(self, sha256: str) -> bool:
+        entry = self._blobs.get(sha256)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(self.blob_path(sha256))
+        except OSError:
+            stat = None
+        if stat is None or stat.st_size != entry[0] or stat.st_mtime_ns != entry[1]:
+            self._remove_locked(sha256)
+            return False
+        return True
+
+    def _remove_locked(self, sha256: str) -> None:
+        self._blobs.pop(sha256, None)
+        self._dirty = True
+        try:
+            os.remove(self.blob_path(sha256))
+        except OSError:
+            pass
+
+    def add(self, path: str, sha256: str) -> None:
+        """Keeps the file at path, whose content was already verified to hash to sha256, as that hash's blob."""
+        if not SHA256_RE.match(sha256):
+            return
+        with self._lock:
+            if self._valid_locked(sha256):
+                self._blobs[sha256][2] = time.time()
+                self._dirty = True
+                return
+            blob_path = self.blob_path(sha256)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f'{blob_path}.tmp-{time.monotonic_ns()}'
+            try:
+                _link_or_copy(path, tmp_path)
+                os.replace(tmp_path, blob_path)
+                stat = os.stat(blob_path)
+            except OSError as e:
+                print(f'Could not add {path} to the blob store: {e}')
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._blobs[sha256] = [stat.st_size, stat.st_mtime_ns, time.time()]
+            self._dirty = True
+            self._evict_locked()
+
+    def materialize(self, sha256: str, destination_path: str) -> bool:
+        """Puts the blob for sha256 at destination_path (replacing what is there).  False if there is no usable blob.
+        It is staged under its own temp name, never the '.part' path a socket upload of the same file writes to."""
+        with self._lock:
+            if not self._valid_locked(sha256):
+                self._misses += 1
+                return False
+            blob_path = self.blob_path(sha256)
+            tmp_path = f'{destination_path}.blob-{time.monotonic_ns()}'
+            try:
+                #already this very blob (renaming a hardlink onto itself would leave tmp_path behind)
+                if os.path.exists(destination_path) and os.path.samefile(blob_path, destination_path):
+                    self._blobs[sha256][2] = time.time()
+                    self._dirty = True
+                    self._hits += 1
+                    return True
+                os.makedirs(os.path.dirname(destination_path) or '.', exist_ok=True)
+                _link_or_copy(blob_path, tmp_path)
+                os.replace(tmp_path, destination_path)
+            except OSError as e:
+                print(f'Could not materialize blob {sha256} at {destination_path}: {e}')
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                self._misses += 1
+                return False
+            self._blobs[sha256][2] = time.time()
+            self._dirty = True
+            self._hits += 1
+            return True
+
+    def _evict_locked(self) -> None:
+        if not self.max_bytes:
+            return
+        total = sum(entry[0] for entry in self._blobs.values())
+        for sha256, entry in sorted(self._blobs.items(), key=lambda item: item[1][2]):
+            if total <= self.max_bytes:
+                break
+            total -= entry[0]
+            self._remove_locked(sha256)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'blobs': len(self._blobs),
+                'bytes': sum(entry[0] for entry in self._blobs.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
@@ -0,0 +1,117 @@
+import os, json, hashlib, shutil, time
+from threading import Lock
+from typing import Optional
+from mcp_utils import MB
+
+
+class BuildCache:
+    """On-disk cache of finished builds, keyed by everything that determines a build's outcome.
+
+    Each entry is a directory named by its key holding meta.json (status, error, sizes, timestamps), build.log and
+    events.jsonl.  Entries older than max_age_s are dropped on lookup; when the cache grows past max_entries or
+    max_bytes the least recently used entries are evicted."""
+
+    def __init__(self, root_dir: str, max_entries: int = 200, max_bytes: int = 512 * MB, max_age_s: float = 7 * 24 * 3600):
+        self.root_dir = root_dir
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age_s = float(max_age_s)
+        self._lock = Lock()
+        self._entries: dict[str, dict] = {}
+        self._hits = 0
+        self._misses = 0
+        os.makedirs(root_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def compute_key(parts: dict) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def _load(self) -> None:
+        for name in os.listdir(self.root_dir):
+            meta_path = os.path.join(self.root_dir, name, 'meta.json')
+            try:
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                # partially written or foreign directory
+                shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+                continue
+            self._entries[name] = meta
+        with self._lock:
+            self._evict_locked()
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Returns the entry's metadata (with log_path/events_path filled in) or None on a miss."""
+        with self._lock:
+            meta = self._entries.get(key)
+            if meta is not None and time.time() - meta['created_at'] > self.max_age_s:
+                self._remove_locked(key)
+                meta = None
+            if meta is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            meta['last_used_at'] = time.time()
+            entry_dir = self._entry_dir(key)
+            return {**meta, 'log_path': os.path.join(entry_dir, 'build.log'), 'events_path': os.path.join(entry_dir, 'events.jsonl')}
+
+    def store(self, key: str, meta: dict, log_path: str, events_path: Optional[str] = None) -> None:
+        """Copies a finished build's log (and events) into the cache under key."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f'{entry_dir}.tmp-{os.getpid()}-{time.monotonic_ns()}'
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            shutil.copyfile(log_path, os.path.join(tmp_dir, 'build.log'))
+            if events_path and os.path.exists(events_path):
+                shutil.copyfile(events_path, os.path.join(tmp_dir, 'events.jsonl'))
+            else:
+                open(os.path.join(tmp_dir, 'events.jsonl'), 'wb').close()
+            now = time.time()
+            meta = {
+                **meta,
+                'key': key,
+                'created_at': now,
+                'last_used_at': now,
+                'bytes': os.path.getsize(os.path.join(tmp_dir, 'build.log')) + os.path.getsize(os.path.join(tmp_dir, 'events.jsonl')),
+            }
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            with self._lock:
+                if key in self._entries:
+                    self._remove_locked(key)
+                os.replace(tmp_dir, entry_dir)
+                self._entries[key] = meta
+                self._evict_locked()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _remove_locked(self, key: str) -> None:
+        self._entries.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict_locked(self) -> None:
+        now = time.time()
+        for key in [key for key, meta in self._entries.items() if now - meta['created_at'] > self.max_age_s]:
+            self._remove_locked(key)
+        by_last_use = sorted(self._entries.items(), key=lambda item: item[1]['last_used_at'])
+        total_bytes = sum(meta['bytes'] for meta in self._entries.values())
+        while by_last_use and (len(self._entries) > self.max_entries or total_bytes > self.max_bytes):
+            key, meta = by_last_use.pop(0)
+            total_bytes -= meta['bytes']
+            self._remove_locked(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(meta['bytes'] for meta in self._entries.values()),
+                'hits': self._hits,
+                'misses': self._misses,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'max_age_s': self.max_age_s,
+            }
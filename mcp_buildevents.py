@@ -0,0 +1,182 @@
+import json, re, time
+from typing import Callable, Optional
+
+
+COMPILE_STEP_PREFIXES = [
+    'CompileC ', 'CompileSwift ', 'SwiftCompile ', 'CompileSwiftSources ', 'CompileAssetCatalog ',
+    'CompileStoryboard ', 'CompileXIB ', 'CompileMetalFile ', 'ProcessInfoPlistFile ',
+]
+LINK_STEP_PREFIXES = ['Ld ', 'Libtool ']
+
+TARGET_RE = re.compile(r"\(in target '([^']+)'")
+DIAGNOSTIC_RE = re.compile(r'^(?P<file>[^:\s][^:]*):(?P<line>\d+):(?:(?P<column>\d+):)? (?P<severity>error|warning): (?P<message>.*)$')
+BARE_DIAGNOSTIC_RE = re.compile(r'^(?:[\w.-]+: )?(?P<severity>error|warning): (?P<message>.*)$')
+#build event types that mark which phase of the build is under way
+PHASE_EVENT_TYPES = {'compile': 'compile', 'link': 'link', 'test': 'test'}
+TEST_PHASE_START_RE = re.compile(r"^(Testing started|Test Suite '.+' started|Test session results|\S+ Test run started)")
+XCTEST_CASE_RE = re.compile(r"^Test Case '-\[(?P<suite>\S+) (?P<test>[^\]]+)\]' (?P<result>passed|failed|skipped) \((?P<seconds>[\d.]+) seconds\)")
+SWIFT_TESTING_CASE_RE = re.compile(r'^\S+ Test (?P<test>.+?) (?P<result>passed|failed|skipped)(?: after (?P<seconds>[\d.]+) seconds)?')
+RESULT_MARKER_RE = re.compile(r'^\*\* (?P<action>[A-Z ]+?) (?P<result>SUCCEEDED|FAILED|INTERRUPTED) \*\*')
+
+
+class BuildEventParser:
+    """Incremental parser over raw xcodebuild output.  Feed it chunks as they arrive; it splits them into lines and calls
+    emit with a small dict for every line it recognizes (compile/link steps, errors, warnings, test results and the
+    ** BUILD SUCCEEDED/FAILED ** markers).  Every event carries the byte offset of its line in the raw log, so a
+    client can jump from an event to the surrounding output.
+
+    It also times the build's phases: time between chunks is charged to the phase of the last step seen (compile, link
+    or test; 'other' before the first step, e.g. package resolution), and phase_times holds the totals in seconds."""
+
+    def __init__(self, emit: Callable[[dict], None], base_offset: int = 0, max_line_len: int = 16 * 1024):
+        self._emit = emit
+        self._offset = int(base_offset)
+        self._max_line_len = max_line_len
+        self._partial = bytearray()
+        #inside an overlong line whose start was dropped; everything up to its newline is skipped
+        self._skipping_line = False
+        self._seen_diagnostics: set[tuple] = set()
+        self.phase_times: dict[str, float] = {}
+        self._phase = 'other'
+        self._phase_started = time.monotonic()
+        self.counts = {'compile': 0, 'link': 0, 'error': 0, 'warning': 0, 'test_passed': 0, 'test_failed': 0, 'test_skipped': 0}
+
+    def feed(self, chunk: bytes) -> None:
+        start = 0
+        while True:
+            newline = chunk.find(b'\n', start)
+            if newline < 0:
+                if self._skipping_line:
+                    self._offset += len(chunk) - start
+                    return
+                self._partial.extend(chunk[start:])
+                if len(self._partial) > self._max_line_len:
+                    # an absurdly long line (e.g. a dumped compiler invocation) is never a diagnostic we care about
+                    self._offset += len(self._partial)
+                    self._partial = bytearray()
+                    self._skipping_line = True
+                return
+            if self._skipping_line:
+                self._skipping_line = False
+                self._offset += newline + 1 - start
+                start = newline + 1
+                continue
+            line = bytes(self._partial) + chunk[start:newline] if self._partial else chunk[start:newline]
+            self._partial = bytearray()
+            self._parse_line(line, self._offset)
+            self._offset += len(line) + 1
+            start = newline + 1
+
+    def feed_line(self, line: bytes, offset: int, **tags) -> None:
+        """Parses one complete line (without its newline) that sits at offset in the raw log.  For callers that write
+        lines into the log themselves, e.g. merged test shard output; tags are added to the line's event."""
+        self._parse_line(line, offset, tags)
+        self._offset = max(self._offset, offset + len(line) + 1)
+
+    def close(self, emit_summary: bool = True) -> None:
+        """Parses any unterminated last line, closes the current phase's timing and emits a summary event (unless the
+        parser only covers part of a job, e.g. one test shard, whose counts go into the job's parser via add_counts)."""
+        if self._partial:
+            self._parse_line(bytes(self._partial), self._offset)
+            self._offset += len(self._partial)
+            self._partial = bytearray()
+        self.enter_phase(self._phase)
+        if emit_summary:
+            self._emit({'type': 'summary', 'offset': self._offset, **self.counts, 'phase_s': self.phase_times_rounded()})
+
+    def add_counts(self, other: 'BuildEventParser') -> None:
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def enter_phase(self, phase: str) -> None:
+        now = time.monotonic()
+        self.phase_times[self._phase] = self.phase_times.get(self._phase, 0.0) + now - self._phase_started
+        self._phase = phase
+        self._phase_started = now
+
+    def phase_times_rounded(self) -> dict[str, float]:
+        return {phase: round(seconds, 3) for phase, seconds in self.phase_times.items()}
+
+    def _parse_line(self, raw_line: bytes, offset: int, tags: Optional[dict] = None) -> None:
+        line = raw_line.decode('utf-8', errors='replace').rstrip('\r')
+        event = self._match_line(line)
+        if event is None:
+            if TEST_PHASE_START_RE.match(line) and self._phase != 'test':
+                self.enter_phase('test')
+            return
+        phase = PHASE_EVENT_TYPES.get(event['type'])
+        if phase is not None and phase != self._phase:
+            self.enter_phase(phase)
+        event['offset'] = offset
+        if tags:
+            event.update(tags)
+        self._emit(event)
+
+    def _match_line(self, line: str) -> Optional[dict]:
+        if not line:
+            return None
+
+        for prefix in COMPILE_STEP_PREFIXES:
+            if line.startswith(prefix):
+                self.counts['compile'] += 1
+                return {'type': 'compile', 'step': prefix.strip(), 'file': _step_file(line), 'target': _step_target(line)}
+        for prefix in LINK_STEP_PREFIXES:
+            if line.startswith(prefix):
+                self.counts['link'] += 1
+                return {'type': 'link', 'step': prefix.strip(), 'file': _step_file(line), 'target': _step_target(line)}
+
+        match = DIAGNOSTIC_RE.match(line)
+        if match:
+            return self._diagnostic_event(
+                match.group('severity'), match.group('message'),
+                file=match.group('file'), line=int(match.group('line')),
+                column=int(match.group('column')) if match.group('column') else None,
+            )
+        match = BARE_DIAGNOSTIC_RE.match(line)
+        if match:
+            return self._diagnostic_event(match.group('severity'), match.group('message'))
+
+        match = XCTEST_CASE_RE.match(line) or SWIFT_TESTING_CASE_RE.match(line)
+        if match:
+            result = match.group('result')
+            self.counts[f'test_{result}'] += 1
+            groups = match.groupdict()
+            seconds = groups.get('seconds')
+            return {
+                'type': 'test',
+                'suite': groups.get('suite'),
+                'test': groups['test'],
+                'result': result,
+                'seconds': float(seconds) if seconds else None,
+            }
+
+        match = RESULT_MARKER_RE.match(line)
+        if match:
+            return {'type': 'result', 'action': match.group('action').lower(), 'succeeded': match.group('result') == 'SUCCEEDED'}
+        return None
+
+    def _diagnostic_event(self, severity: str, message: str, file: Optional[str] = None, line: Optional[int] = None, column: Optional[int] = None) -> Optional[dict]:
+        # xcodebuild repeats diagnostics in its end-of-build summary; only report each one once
+        key = (severity, file, line, column, message)
+        if key in self._seen_diagnostics:
+            return None
+        self._seen_diagnostics.add(key)
+        self.counts[severity] += 1
+        return {'type': severity, 'file': file, 'line': line, 'column': column, 'message': message}
+
+
+def _step_target(line: str) -> Optional[str]:
+    match = TARGET_RE.search(line)
+    return match.group(1) if match else None
+
+
+def _step_file(line: str) -> Optional[str]:
+    """Best-effort source/output path of a build step line: the last absolute path before the '(in target' suffix."""
+    body = line.split(" (in target '", 1)[0]
+    paths = [token for token in body.split(' ') if token.startswith('/')]
+    return paths[-1] if paths else None
+
+
+def encode_build_event(event: dict) -> bytes:
+    """Events travel as compact JSON lines."""
+    return json.dumps(event, separators=(',', ':')).encode('utf-8') + b'\n'
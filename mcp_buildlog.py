@@ -0,0 +1,223 @@
+import os, time, gzip
+from bisect import bisect_right
+from collections import deque
+from threading import Condition, Lock
+from typing import Optional
+from mcp_utils import KB, MB
+
+
+class BuildLogStore:
+    """Holds a job's output as a bounded in-memory ring of segments backed by its build log file.
+
+    Appends go to memory first.  Once the in-memory tail grows past memory_limit, the oldest segments are spilled
+    (appended) to log_path, so the file always holds bytes [0, memory_start) and memory holds [memory_start, size).
+    Closing the store spills whatever is left, leaving the complete log on disk.  Readers address output by absolute
+    byte offset and never need to know which side of the boundary it lives on."""
+
+    def __init__(self, log_path: str, memory_limit: int = 4 * MB, segment_size: int = 64 * KB):
+        self.log_path = log_path
+        self.memory_limit = max(int(memory_limit), int(segment_size))
+        self.segment_size = int(segment_size)
+        self._cond = Condition()
+        self._segments: deque[bytes] = deque()
+        self._segment_starts: deque[int] = deque()
+        self._tail = bytearray()
+        self._memory_start = 0
+        self._memory_bytes = 0
+        self._size = 0
+        self._closed = False
+        self._spill_file = open(log_path, 'wb')
+        # serializes spills; held while writing to disk so the store lock never waits on file I/O
+        self._spill_lock = Lock()
+        self._subscribers: dict[int, 'BuildLogSubscriber'] = {}
+        self._next_subscriber_id = 0
+
+    @classmethod
+    def open_existing(cls, log_path: str, size: int) -> 'BuildLogStore':
+        """A closed, read-only store over a finished job's log file (plain or gzip-compressed).  A missing file reads as
+        empty."""
+        store = cls.__new__(cls)
+        store.log_path = log_path
+        store.memory_limit = 0
+        store.segment_size = 0
+        store._cond = Condition()
+        store._segments = deque()
+        store._segment_starts = deque()
+        store._tail = bytearray()
+        store._size = int(size) if log_path and os.path.exists(log_path) else 0
+        store._memory_start = store._size
+        store._memory_bytes = 0
+        store._closed = True
+        store._spill_file = None
+        store._spill_lock = Lock()
+        store._subscribers = {}
+        store._next_subscriber_id = 0
+        return store
+
+    @property
+    def size(self) -> int:
+        with self._cond:
+            return self._size
+
+    @property
+    def closed(self) -> bool:
+        with self._cond:
+            return self._closed
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._cond:
+            return len(self._subscribers)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': self._size,
+                'memory_bytes': self._memory_bytes,
+                'spilled_bytes': self._memory_start,
+                'subscribers': len(self._subscribers),
+                'closed': self._closed,
+            }
+
+    def append(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        with self._cond:
+            if self._closed:
+                return
+            self._tail.extend(chunk)
+            self._size += len(chunk)
+            self._memory_bytes += len(chunk)
+            if len(self._tail) >= self.segment_size:
+                self._seal_tail()
+            over_limit = self._memory_bytes > self.memory_limit and len(self._segments) > 0
+            self._cond.notify_all()
+        if over_limit:
+            self._spill(lambda: self._memory_bytes > self.memory_limit)
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._seal_tail()
+        self._spill(lambda: True)
+        with self._cond:
+            self._spill_file.close()
+            self._closed = True
+            self._cond.notify_all()
+
+    def _seal_tail(self) -> None:
+        if not self._tail:
+            return
+        self._segment_starts.append(self._size - len(self._tail))
+        self._segments.append(bytes(self._tail))
+        self._tail = bytearray()
+
+    def _spill(self, should_spill) -> None:
+        """Moves the oldest sealed segments to disk while should_spill() holds.  The segment stays readable from memory
+        until it has been written and flushed, and the file write happens outside the store lock, so neither the
+        appender nor readers ever wait on disk."""
+        with self._spill_lock:
+            while True:
+                with self._cond:
+                    if not self._segments or not should_spill():
+                        return
+                    segment = self._segments[0]
+                self._spill_file.write(segment)
+                self._spill_file.flush()
+                with self._cond:
+                    self._segments.popleft()
+                    self._segment_starts.popleft()
+                    self._memory_start += len(segment)
+                    self._memory_bytes -= len(segment)
+
+    def wait_for(self, offset: int, timeout: Optional[float] = None) -> bool:
+        """Blocks until there is output past offset or the store is closed.  Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while offset >= self._size and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def at_eof(self, offset: int) -> bool:
+        with self._cond:
+            return self._closed and offset >= self._size
+
+    def read_available(self, offset: int, max_bytes: int = 256 * KB) -> bytes:
+        """Returns up to max_bytes starting at offset without blocking (b'' if there is nothing new yet)."""
+        offset = max(0, int(offset))
+        with self._cond:
+            if offset >= self._size:
+                return b''
+            end = min(self._size, offset + max_bytes)
+            if offset >= self._memory_start:
+                return self._read_memory(offset, end)
+            disk_end = min(end, self._memory_start)
+            memory_part = self._read_memory(self._memory_start, end) if end > self._memory_start else b''
+        # spilled bytes are immutable and already flushed, so they can be read without holding the lock
+        with (gzip.open(self.log_path, 'rb') if self.log_path.endswith('.gz') else open(self.log_path, 'rb')) as f:
+            f.seek(offset)
+            disk_part = f.read(disk_end - offset)
+        return disk_part + memory_part
+
+    def _read_memory(self, start: int, end: int) -> bytes:
+        parts = []
+        tail_start = self._size - len(self._tail)
+        i = max(0, bisect_right(self._segment_starts, start) - 1)
+        while i < len(self._segments) and start < end and start < tail_start:
+            seg_start = self._segment_starts[i]
+            segment = self._segments[i]
+            lo = start - seg_start
+            hi = min(len(segment), end - seg_start)
+            if lo < hi:
+                parts.append(segment[lo:hi])
+                start = seg_start + hi
+            i += 1
+        if start < end:
+            parts.append(bytes(self._tail[start - tail_start:end - tail_start]))
+        return b''.join(parts)
+
+    def read(self, offset: int, max_bytes: int = 256 * KB, timeout: Optional[float] = None) -> bytes:
+        """Blocks until there is output past offset, then returns up to max_bytes of it.  Returns b'' on timeout or once
+        the store is closed and offset is at the end; use at_eof to tell the two apart."""
+        if not self.wait_for(offset, timeout):
+            return b''
+        return self.read_available(offset, max_bytes)
+
+    def subscribe(self, offset: int = 0) -> 'BuildLogSubscriber':
+        with self._cond:
+            subscriber_id = self._next_subscriber_id
+            self._next_subscriber_id += 1
+            subscriber = BuildLogSubscriber(self, subscriber_id, offset)
+            self._subscribers[subscriber_id] = subscriber
+        return subscriber
+
+    def _unsubscribe(self, subscriber_id: int) -> None:
+        with self._cond:
+            self._subscribers.pop(subscriber_id, None)
+
+
+class BuildLogSubscriber:
+    """A reader attached to a BuildLogStore at its own offset.  Each subscriber consumes at its own pace: a slow one
+    only falls behind into the spilled part of the log, it never holds up the writer or other subscribers."""
+
+    def __init__(self, store: BuildLogStore, subscriber_id: int, offset: int = 0):
+        self.store = store
+        self.subscriber_id = subscriber_id
+        self.offset = max(0, int(offset))
+        self.attached_at = time.time()
+
+    def read(self, max_bytes: int = 256 * KB, timeout: Optional[float] = None) -> bytes:
+        chunk = self.store.read(self.offset, max_bytes=max_bytes, timeout=timeout)
+        self.offset += len(chunk)
+        return chunk
+
+    @property
+    def at_eof(self) -> bool:
+        return self.store.at_eof(self.offset)
+
+    def close(self) -> None:
+        self.store._unsubscribe(self.subscriber_id)
@@ -1,11 +1,13 @@
-import sys, os, socket, requests, json, urllib, hashlib, struct, ssl, hmac, secrets, base64, time, subprocess, re
+import sys, os, socket, requests, json, urllib, hashlib, struct, ssl, hmac, secrets, base64, time, subprocess, re, codecs, zlib
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 from typing import Optional, Union
 from requests import Response
 from requests.adapters import HTTPAdapter
 from urllib3.poolmanager import PoolManager
 from mcp_utils import *
 from environment_setup import ensure_environment_setup
+from mcp_transfer import RangeAssembler, assign_transfer_streams, is_range
 
 discovery_socket_port = 9346
 allowed_timestamp_skew_s = 120
@@ -15,6 +17,15 @@ discovery_attempts = 3
 DEFAULT_SERVER_PORT = 8751
 DEFAULT_SERVER_SOCKET_PORT = 50271
 DEFAULT_FILE_SOCKET_PORT = 47283
+BUILD_JOB_TERMINAL_STATUSES = ['done', 'error', 'superseded', 'cancelled']
+#files a socket transfer may have in flight before waiting for their FILE_RESULTs (RXS_TRANSFER_WINDOW, 0 = lockstep)
+DEFAULT_FILE_TRANSFER_WINDOW = 64
+#parallel connections per socket file transfer (RXS_TRANSFER_STREAMS); the server may grant fewer
+DEFAULT_FILE_TRANSFER_STREAMS = 4
+#newest file socket frame format this client speaks (2 = binary FILE_CHUNK frames, see _recv_frame)
+FILE_TRANSFER_FRAME_VERSION = 2
+CHUNK_FRAME_MARKER = 0xFFFFFFFF
+CHUNK_FRAME_HEADER = struct.Struct('!III')
 
 SERVER_INFO: dict = {}
 SERVER_CERT_PATH = ''
@@ -477,11 +488,11 @@ def _socket_auth_signature(channel: str, session_id: str, timestamp: str, nonce:
     return hmac.new(_load_hmac_secret().encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
 
 
-def _send_socket_auth(conn: socket.socket, channel: str, session_id: str) -> None:
+def _send_socket_auth(conn: socket.socket, channel: str, session_id: str, extra: Optional[dict] = None) -> dict:
     timestamp = str(int(time.time()))
     nonce = secrets.token_urlsafe(24)
-    _send_frame(
-        conn,
+    header = {} if extra is None else dict(extra)
+    header.update(
         {
             'type': 'AUTH',
             'channel': channel,
@@ -489,11 +500,13 @@ def _send_socket_auth(conn: socket.socket, channel: str, session_id: str) -> Non
             'timestamp': timestamp,
             'nonce': nonce,
             'signature': _socket_auth_signature(channel, session_id, timestamp, nonce),
-        },
+        }
     )
+    _send_frame(conn, header)
     ack, _ = _recv_frame(conn)
     if ack.get('type') != 'AUTH_ACK' or not ack.get('ok', False):
         raise PermissionError(f'Server rejected socket auth for channel {channel}')
+    return ack
 
 
 def retrieve_file(server_addr:tuple[str, int], path) -> bool:
@@ -639,6 +652,10 @@ def discover_server(require_pairing: bool = False, target_ip: Optional[str] = No
     return discovered_server_ip, response_obj
 
 
+def _git_output(args:list[str]) -> str:
+    proc = subprocess.run(['git', *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return proc.stdout.decode('utf-8', errors='replace').strip() if proc.returncode == 0 else ''
+
 def start_build_job(server_addr:tuple[str, int], git_diff_path:str, changed_binary_paths:list[str]=[], args:list[str]=[]) -> str:
     app_name = get_appname()
     url = _build_server_url(server_addr, f'/start-build-job/{app_name}')
@@ -654,6 +671,22 @@ def start_build_job(server_addr:tuple[str, int], git_diff_path:str, changed_bina
         files[f'binaryfile{i}'] = (path, open(path, 'rb'), mimetype, {'Expires': 0})
     print(f'Starting build job by making POST request to {url} sending a diff file located at {git_diff_path}\n')
     args_data = [('xcodebuild_args', xcodebuild_arg) for xcodebuild_arg in args]
+    #the diff is against this commit; a server with a worktree pool checks it out (per branch) before applying the diff
+    args_data += [('branch', _git_output(['rev-parse', '--abbrev-ref', 'HEAD'])), ('base_commit', _git_output(['rev-parse', 'HEAD']))]
+    #RXS_NO_BUILD_CACHE=1 forces a real build even if the server has already built identical inputs
+    if os.environ.get('RXS_NO_BUILD_CACHE', '').strip().lower() in ['1', 'true', 'yes']:
+        args_data.append(('no_cache', '1'))
+    #RXS_TEST_SHARDS=N runs the tests in N concurrent shards, one per destination in RXS_TEST_DESTINATIONS
+    #(';'-separated, since destination specifiers contain commas); RXS_TESTS optionally lists -only-testing ids
+    test_shards = _env_int('RXS_TEST_SHARDS', 0)
+    if test_shards > 0:
+        args_data.append(('test_shards', str(test_shards)))
+        args_data += [('test_destinations', dest.strip()) for dest in os.environ.get('RXS_TEST_DESTINATIONS', '').split(';') if dest.strip()]
+        args_data += [('tests', test_id) for test_id in re.split(r'[,\s]+', os.environ.get('RXS_TESTS', '')) if test_id]
+    #RXS_BUILD_COALESCE=merge|cancel supersedes this project's older queued (and, for cancel, running) builds
+    coalesce = os.environ.get('RXS_BUILD_COALESCE', '').strip().lower()
+    if coalesce:
+        args_data.append(('coalesce', coalesce))
     resp = _secure_request('POST', url, data=args_data, files=files, timeout=300)
     return resp
 
@@ -662,62 +695,217 @@ def check_build_job(server_addr:tuple[str, int], job_id:str, offset:int=0) -> Re
     resp = _secure_request('GET', url)
     return resp
 
-def wait_for_build_completion(server_addr:tuple[str, int], job_id:str, server_socket_port:int, offset=0) -> str:
+def cancel_build_job(server_addr:tuple[str, int], job_id:str) -> dict:
+    """Asks the server to stop a queued or running build.  Returns the server's JSON reply."""
+    url = _build_server_url(server_addr, f'/cancel/{job_id}')
+    resp = _secure_request('POST', url)
+    try:
+        return resp.json()
+    except ValueError:
+        return {'ok': False, 'error': resp.text}
+
+def get_project_metadata(server_addr:tuple[str, int], scheme:str='', configuration:str='', destinations:bool=False, refresh:bool=False) -> dict:
+    """Schemes, targets and configurations of the server's project from its metadata cache; with a scheme, also its
+    build settings (and destinations if asked for).  Returns the server's JSON reply."""
+    url = _build_server_url(server_addr, '/project_metadata')
+    params = {}
+    if scheme:
+        params['scheme'] = scheme
+    if configuration:
+        params['configuration'] = configuration
+    if destinations:
+        params['destinations'] = '1'
+    if refresh:
+        params['refresh'] = '1'
+    resp = _secure_request('GET', url, params=params, timeout=300)
+    try:
+        return resp.json()
+    except ValueError:
+        return {'ok': False, 'error': resp.text}
+
+def get_build_job_status(server_addr:tuple[str, int], job_id:str) -> Optional[dict]:
+    url = _build_server_url(server_addr, f'/status/{job_id}')
+    try:
+        resp = _secure_request('GET', url, timeout=30)
+        resp.raise_for_status()
+        obj = resp.json()
+    except (requests.RequestException, ValueError):
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _build_log_complete(status:Optional[dict], offset:int, size_key:str='log_size') -> bool:
+    if status is None or status.get('status') not in BUILD_JOB_TERMINAL_STATUSES:
+        return False
+    try:
+        return offset >= int(status.get(size_key, 0))
+    except (TypeError, ValueError):
+        return True
+
+
+def _format_build_event(event:dict) -> Optional[str]:
+    event_type = event.get('type')
+    if event_type in ['error', 'warning']:
+        location = ''
+        if event.get('file'):
+            location = f"{event['file']}:{event.get('line')}" + (f":{event['column']}" if event.get('column') else '') + ': '
+        return f"{location}{event_type}: {event.get('message', '')}"
+    if event_type == 'test' and event.get('result') != 'passed':
+        suite = f"{event['suite']}." if event.get('suite') else ''
+        return f"test {event.get('result')}: {suite}{event.get('test')}"
+    if event_type == 'result':
+        return f"** {str(event.get('action', '')).upper()} {'SUCCEEDED' if event.get('succeeded') else 'FAILED'} **"
+    if event_type == 'summary':
+        return (f"{event.get('compile', 0)} compile steps, {event.get('error', 0)} errors, {event.get('warning', 0)} warnings, "
+                f"tests: {event.get('test_passed', 0)} passed / {event.get('test_failed', 0)} failed")
+    return None
+
+
+def wait_for_build_completion(server_addr:tuple[str, int], job_id:str, server_socket_port:int, offset=0, channel:str='build_log') -> str:
+    """Streams the job's build log to stdout.  If the connection drops (or stalls while the server still has unsent
+    output), reconnects and resumes from the last byte received until the job has finished and the log is drained.
+    With channel='build_events' it follows the server's parsed event stream instead of the raw log and prints only
+    diagnostics, failed tests and the final result."""
     ip, _ = server_addr
-    chunk_size = 4096
+    size_key = 'events_size' if channel == 'build_events' else 'log_size'
+    #RXS_LOG_COMPRESSION=none asks for an uncompressed stream
+    requested_compression = [] if os.environ.get('RXS_LOG_COMPRESSION', 'zlib').strip().lower() in ['', 'none', '0'] else ['zlib']
+    pending_event_text = ''
+    chunk_size = 64 * KB
     full_text = ''
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    idle_check_s = _env_float('RXS_LOG_IDLE_CHECK_S', 30.0)
+    reconnect_timeout_s = _env_float('RXS_LOG_RECONNECT_TIMEOUT_S', 900.0)
     tls_ctx = _make_client_tls_context()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as raw_socket:
-        raw_socket.connect((ip, server_socket_port))
-        with tls_ctx.wrap_socket(raw_socket, server_hostname=ip) as s:
-            _send_socket_auth(s, channel='build_log', session_id=str(job_id))
-            while True:
-                new_bytes = s.recv(chunk_size)
-                if not new_bytes:
-                    break
-                new_text = new_bytes.decode('utf-8', errors='replace')
-                print(new_text, end='')
-                full_text += new_text
-
+    disconnected_since = None
+    backoff_s = 0.5
+    while True:
+        try:
+            with socket.create_connection((ip, server_socket_port), timeout=idle_check_s) as raw_socket:
+                with tls_ctx.wrap_socket(raw_socket, server_hostname=ip) as s:
+                    ack = _send_socket_auth(s, channel=channel, session_id=str(job_id), extra={'offset': offset, 'compression': requested_compression})
+                    #each connection is its own compressed stream; offset keeps counting decompressed bytes
+                    decompressor = zlib.decompressobj() if ack.get('compression') == 'zlib' else None
+                    disconnected_since = None
+                    backoff_s = 0.5
+                    while True:
+                        try:
+                            new_bytes = s.recv(chunk_size)
+                        except socket.timeout:
+                            #a quiet build (e.g. a long link step) is fine; only treat the socket as dead if the server
+                            #has output we have not received
+                            status = get_build_job_status(server_addr, job_id)
+                            if status is not None and int(status.get(size_key, 0)) <= offset:
+                                continue
+                            raise ConnectionError('build log stream stalled')
+                        if not new_bytes:
+                            break
+                        if decompressor is not None:
+                            new_bytes = decompressor.decompress(new_bytes)
+                            if not new_bytes:
+                                continue
+                        offset += len(new_bytes)
+                        new_text = decoder.decode(new_bytes)
+                        full_text += new_text
+                        if channel != 'build_events':
+                            print(new_text, end='')
+                            continue
+                        lines = (pending_event_text + new_text).split('\n')
+                        pending_event_text = lines.pop()
+                        for line in lines:
+                            if not line:
+                                continue
+                            try:
+                                event = json.loads(line)
+                            except ValueError:
+                                #offset is already past this line; reconnecting would not get it back
+                                continue
+                            formatted = _format_build_event(event) if isinstance(event, dict) else None
+                            if formatted:
+                                print(formatted)
+        except PermissionError:
+            raise
+        except (OSError, ValueError, zlib.error) as e:
+            print(f'\nBuild log connection lost ({e}); resuming from byte {offset}...', file=sys.stderr)
+
+        status = get_build_job_status(server_addr, job_id)
+        if _build_log_complete(status, offset, size_key):
+            break
+        if disconnected_since is None:
+            disconnected_since = time.monotonic()
+        elif time.monotonic() - disconnected_since > reconnect_timeout_s:
+            raise ConnectionError(f'Unable to resume build log for job {job_id} after {reconnect_timeout_s:.0f}s')
+        time.sleep(backoff_s)
+        backoff_s = min(backoff_s * 2, 10.0)
+
+    full_text += decoder.decode(b'', final=True)
     return full_text
 
 
-def _recv_exact(s: socket.socket, num_bytes: int) -> bytes:
-    data = bytearray()
-    while len(data) < num_bytes:
+def _recv_exact_into(s: socket.socket, view: memoryview) -> None:
+    """Fills view straight from the socket (no per-recv chunks to join and copy)."""
+    received = 0
+    while received < len(view):
         try:
-            chunk = s.recv(num_bytes - len(data))
+            count = s.recv_into(view[received:])
         except socket.timeout as e:
             raise TimeoutError(
-                f'Socket read timed out while waiting for {num_bytes} bytes; received {len(data)} so far'
+                f'Socket read timed out while waiting for {len(view)} bytes; received {received} so far'
             ) from e
-        if not chunk:
+        if not count:
             raise ConnectionError('Socket closed while reading expected bytes')
-        data.extend(chunk)
-    return bytes(data)
+        received += count
+
+
+def _recv_exact(s: socket.socket, num_bytes: int) -> bytearray:
+    data = bytearray(num_bytes)
+    _recv_exact_into(s, memoryview(data))
+    return data
+
+
+def _recv_payload(s: socket.socket, payload_len: int, payload_buffer: Optional[bytearray]) -> Union[bytes, bytearray, memoryview]:
+    if not payload_len:
+        return b''
+    if payload_buffer is None or payload_len > len(payload_buffer):
+        return _recv_exact(s, payload_len)
+    view = memoryview(payload_buffer)[:payload_len]
+    _recv_exact_into(s, view)
+    return view
 
 
 def _send_frame(s: socket.socket, header: dict, payload: bytes = b'') -> None:
+    #one send per frame: separate small writes would each become a TLS record (and, with Nagle, wait on delayed ACKs)
     header_bytes = json.dumps(header).encode('utf-8')
-    s.sendall(struct.pack('!I', len(header_bytes)))
-    s.sendall(header_bytes)
-    s.sendall(struct.pack('!I', len(payload)))
-    if payload:
-        s.sendall(payload)
+    s.sendall(b''.join([struct.pack('!I', len(header_bytes)), header_bytes, struct.pack('!I', len(payload)), payload]))
+
+
+def _send_file_chunk(s: socket.socket, transfer_id: str, rel_path: str, file_index: Optional[int], payload: bytes) -> None:
+    """FILE_CHUNK as a JSON frame, or (frame version 2, file_index set) as a fixed-size binary header naming the file by
+    the index its FILE_START announced."""
+    if file_index is None:
+        _send_frame(s, {'type': 'FILE_CHUNK', 'transfer_id': transfer_id, 'rel_path': rel_path}, payload)
+    else:
+        s.sendall(CHUNK_FRAME_HEADER.pack(CHUNK_FRAME_MARKER, file_index, len(payload)) + payload)
 
 
-def _recv_frame(s: socket.socket) -> tuple[dict, bytes]:
+def _recv_frame(s: socket.socket, payload_buffer: Optional[bytearray] = None) -> tuple[dict, Union[bytes, bytearray, memoryview]]:
+    """With payload_buffer, a payload that fits is read into it and returned as a memoryview that is only valid until the
+    next call, so file chunks are written and hashed without being copied."""
     max_header_len = 64 * KB
     max_payload_len = 8 * MB
     header_len = struct.unpack('!I', _recv_exact(s, 4))[0]
+    if header_len == CHUNK_FRAME_MARKER:
+        file_index, payload_len = struct.unpack('!II', _recv_exact(s, 8))
+        if payload_len > max_payload_len:
+            raise ValueError(f'Invalid frame payload length: {payload_len}')
+        return {'type': 'FILE_CHUNK', 'file_index': file_index}, _recv_payload(s, payload_len, payload_buffer)
     if header_len <= 0 or header_len > max_header_len:
         raise ValueError(f'Invalid frame header length: {header_len}')
     header = json.loads(_recv_exact(s, header_len).decode('utf-8'))
     payload_len = struct.unpack('!I', _recv_exact(s, 4))[0]
     if payload_len < 0 or payload_len > max_payload_len:
         raise ValueError(f'Invalid frame payload length: {payload_len}')
-    payload = _recv_exact(s, payload_len) if payload_len else b''
-    return header, payload
+    return header, _recv_payload(s, payload_len, payload_buffer)
 
 
 def _file_sha256(path: str, chunk_size: int = 256 * KB) -> str:
@@ -764,57 +952,167 @@ def _get_safe_local_project_path(rel_path: str, project_root: str) -> str:
     return dest_abs
 
 
+def _file_start_frame(transfer_id: str, unit: dict, file_index: Optional[int]) -> dict:
+    """FILE_START for a file or, with offset/length, for one range of it (see assign_transfer_streams)."""
+    header = {
+        'type': 'FILE_START',
+        'transfer_id': transfer_id,
+        'rel_path': unit['rel_path'],
+        'size': unit['size'],
+        'sha256': unit['sha256'],
+    }
+    if file_index is not None:
+        header['file_index'] = file_index
+    if is_range(unit):
+        header.update({'offset': unit['offset'], 'length': unit['length']})
+    return header
+
+
+def _send_file_body(s: socket.socket, transfer_id: str, unit: dict, file_index: Optional[int], chunk_size: int) -> int:
+    """Sends the FILE_CHUNKs and FILE_END that follow a FILE_START and returns the number of bytes sent."""
+    rel_path = unit['rel_path']
+    bytes_sent = 0
+    with open(unit['abs_path'], 'rb') as f:
+        f.seek(unit['offset'])
+        while bytes_sent < unit['length']:
+            chunk = f.read(min(chunk_size, unit['length'] - bytes_sent))
+            if not chunk:
+                break
+            _send_file_chunk(s, transfer_id, rel_path, file_index, chunk)
+            bytes_sent += len(chunk)
+    _send_frame(s, {'type': 'FILE_END', 'transfer_id': transfer_id, 'rel_path': rel_path})
+    return bytes_sent
+
+
 def _send_file_over_socket(
     s: socket.socket,
-    abs_path: str,
-    rel_path: str,
-    expected_size: int,
-    expected_sha256: str,
+    unit: dict,
     transfer_id: str,
     chunk_size: int = 64 * KB,
+    file_index: Optional[int] = None,
 ) -> bool:
-    _send_frame(
-        s,
-        {
-            'type': 'FILE_START',
-            'transfer_id': transfer_id,
-            'rel_path': rel_path,
-            'size': expected_size,
-            'sha256': expected_sha256,
-        },
-    )
+    rel_path = unit['rel_path']
+    _send_frame(s, _file_start_frame(transfer_id, unit, file_index))
     ack_header, _ = _recv_frame(s)
     if ack_header.get('type') != 'ACK_FILE_START' or not ack_header.get('ok', False):
         print(f'FILE_START rejected for {rel_path}: {ack_header}')
         return False
 
-    total_bytes_sent = 0
-    with open(abs_path, 'rb') as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            _send_frame(s, {'type': 'FILE_CHUNK', 'transfer_id': transfer_id, 'rel_path': rel_path}, chunk)
-            total_bytes_sent += len(chunk)
-
-    _send_frame(s, {'type': 'FILE_END', 'transfer_id': transfer_id, 'rel_path': rel_path})
+    total_bytes_sent = _send_file_body(s, transfer_id, unit, file_index, chunk_size)
     file_result_header, _ = _recv_frame(s)
     if file_result_header.get('type') != 'FILE_RESULT' or not file_result_header.get('ok', False):
         print(f'FILE_RESULT failed for {rel_path}: {file_result_header}')
         return False
-    if total_bytes_sent != expected_size:
-        print(f'Unexpected bytes sent for {rel_path}. Expected {expected_size}, sent {total_bytes_sent}')
+    if total_bytes_sent != unit['length']:
+        print(f"Unexpected bytes sent for {rel_path}. Expected {unit['length']}, sent {total_bytes_sent}")
         return False
     return True
 
 
+def _send_files_pipelined(
+    s: socket.socket,
+    units: list[dict],
+    transfer_id: str,
+    window: int,
+    chunk_size: int = 64 * KB,
+    binary_chunks: bool = False,
+) -> list[str]:
+    """Streams FILE_START/FILE_CHUNK/FILE_END for every file back to back, reading FILE_RESULTs only to keep at most
+    window files unconfirmed (and the rest at the end).  Returns the rel_paths the server did not verify."""
+    #(rel_path, offset) -> [length, bytes sent], for files and ranges whose FILE_RESULT has not been read yet
+    unconfirmed: dict[tuple[str, int], list[int]] = {}
+    failed: list[str] = []
+
+    def confirm_file() -> None:
+        file_result, _ = _recv_frame(s)
+        rel_path = file_result.get('rel_path', '')
+        sent = unconfirmed.pop((rel_path, int(file_result.get('offset', 0) or 0)), None)
+        if file_result.get('type') != 'FILE_RESULT' or sent is None:
+            raise ValueError(f'Unexpected frame while waiting for file results: {file_result}')
+        if not file_result.get('ok', False):
+            print(f'FILE_RESULT failed for {rel_path}: {file_result}')
+            failed.append(rel_path)
+        elif sent[0] != sent[1]:
+            print(f'Unexpected bytes sent for {rel_path}. Expected {sent[0]}, sent {sent[1]}')
+            failed.append(rel_path)
+
+    for index, unit in enumerate(units):
+        file_index = index if binary_chunks else None
+        _send_frame(s, _file_start_frame(transfer_id, unit, file_index))
+        bytes_sent = _send_file_body(s, transfer_id, unit, file_index, chunk_size)
+        unconfirmed[(unit['rel_path'], unit['offset'])] = [unit['length'], bytes_sent]
+        while len(unconfirmed) >= window:
+            confirm_file()
+    while unconfirmed:
+        confirm_file()
+    return failed
+
+
+def _send_transfer_stream(
+    server_addr: tuple[str, int],
+    transfer_id: str,
+    stream: int,
+    units: list[dict],
+    window: int,
+    binary_chunks: bool,
+    chunk_size: int,
+) -> bool:
+    """Sends one stream of an upload over its own connection, ending with TRANSFER_END."""
+    ip, sock_port = server_addr
+    tls_ctx = _make_client_tls_context()
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as raw_socket:
+        raw_socket.connect((ip, sock_port))
+        with tls_ctx.wrap_socket(raw_socket, server_hostname=ip) as s:
+            s.settimeout(60)
+            _send_socket_auth(s, channel='file_upload', session_id=transfer_id, extra={'stream': stream})
+            if window:
+                failed_paths = _send_files_pipelined(s, units, transfer_id, window, chunk_size=chunk_size, binary_chunks=binary_chunks)
+                if failed_paths:
+                    print(f'Failed to send {len(failed_paths)} file(s) over socket: {failed_paths}')
+                    return False
+            else:
+                for index, unit in enumerate(units):
+                    sent_successfully = _send_file_over_socket(
+                        s=s,
+                        unit=unit,
+                        transfer_id=transfer_id,
+                        chunk_size=chunk_size,
+                        file_index=index if binary_chunks else None,
+                    )
+                    if not sent_successfully:
+                        print(f"Failed to send file over socket: {unit['rel_path']}")
+                        return False
+            _send_frame(s, {'type': 'TRANSFER_END', 'transfer_id': transfer_id})
+            transfer_ack, _ = _recv_frame(s)
+            if transfer_ack.get('type') != 'TRANSFER_RECEIVED' or not transfer_ack.get('ok', False):
+                print(f'Server did not accept transfer end: {transfer_ack}')
+                return False
+    return True
+
+
+def _run_transfer_streams(streams: int, receive_or_send_stream) -> bool:
+    """Runs receive_or_send_stream(stream) for every stream at once; True only if all of them succeeded."""
+    if streams <= 1:
+        return receive_or_send_stream(0)
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        results = list(pool.map(receive_or_send_stream, range(streams)))
+    return all(results)
+
+
 def receive_files_from_server(server_addr: tuple[str, int], paths: list[str], chunk_size: int = 64 * KB) -> bool:
     ip, _ = server_addr
     app_name = get_appname()
     rel_paths = [unix_path(path) for path in paths]
     transfer_id = str(uuid4())
     init_url = _build_server_url(server_addr, f'/sendfilesfromserver/init/{app_name}')
-    init_payload = {'transfer_id': transfer_id, 'paths': rel_paths, 'chunk_size': chunk_size}
+    init_payload = {
+        'transfer_id': transfer_id,
+        'paths': rel_paths,
+        'chunk_size': chunk_size,
+        'window': max(0, _env_int('RXS_TRANSFER_WINDOW', DEFAULT_FILE_TRANSFER_WINDOW)),
+        'frame_version': FILE_TRANSFER_FRAME_VERSION,
+        'streams': max(1, _env_int('RXS_TRANSFER_STREAMS', DEFAULT_FILE_TRANSFER_STREAMS)),
+    }
     try:
         init_resp = _secure_request('POST', init_url, json_data=init_payload, timeout=120)
         init_resp.raise_for_status()
@@ -833,118 +1131,195 @@ def receive_files_from_server(server_addr: tuple[str, int], paths: list[str], ch
         return False
 
     project_root = get_project_root_path(os.getcwd())
+    #shared by all streams: files verified so far, and files whose ranges arrive over several of them
     received_verified: set[str] = set()
-    current_file = None
+    received_lock = Lock()
+    assembler = RangeAssembler()
+    #in pipelined mode the server does not wait for ACK_FILE_START; a rejected file gets a failed FILE_RESULT right away
+    #and its chunks are skipped
+    pipelined = int(init_obj.get('window', 0) or 0) > 0
+    binary_chunks = int(init_obj.get('frame_version', 1) or 1) >= 2
+    #servers that predate multi-stream transfers send everything over one connection
+    streams = max(1, int(init_obj.get('streams', 1) or 1))
+    finished_streams = [0]
     sock_port = int(init_obj['file_socket_port'])
-    tls_ctx = _make_client_tls_context()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as raw_socket:
-        raw_socket.connect((ip, sock_port))
-        with tls_ctx.wrap_socket(raw_socket, server_hostname=ip) as s:
-            s.settimeout(60)
-            _send_socket_auth(s, channel='file_download', session_id=transfer_id)
-            try:
-                while True:
-                    header, payload = _recv_frame(s)
-                    msg_type = header.get('type', '')
-                    incoming_transfer_id = header.get('transfer_id', '')
-                    if incoming_transfer_id != transfer_id:
-                        _send_frame(s, {'type': 'ERROR', 'ok': False, 'error': 'transfer_id mismatch'})
-                        return False
-
-                    if msg_type == 'FILE_START':
-                        rel_path = header.get('rel_path', '')
-                        if rel_path not in expected_map:
-                            _send_frame(s, {'type': 'ACK_FILE_START', 'ok': False, 'rel_path': rel_path})
-                            continue
-                        try:
-                            destination_path = _get_safe_local_project_path(rel_path, project_root)
-                        except ValueError as e:
-                            print(f'Invalid destination path for {rel_path}: {e}')
-                            _send_frame(s, {'type': 'ACK_FILE_START', 'ok': False, 'rel_path': rel_path})
-                            continue
 
-                        parent = os.path.dirname(destination_path)
-                        if parent and not os.path.exists(parent):
-                            os.makedirs(parent, exist_ok=True)
-                        temp_path = destination_path + '.part'
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                        current_file = {
-                            'rel_path': rel_path,
-                            'destination_path': destination_path,
-                            'temp_path': temp_path,
-                            'expected_size': int(expected_map[rel_path]['size']),
-                            'expected_sha256': expected_map[rel_path]['sha256'],
-                            'bytes_received': 0,
-                            'hash': hashlib.sha256(),
-                            'handle': open(temp_path, 'wb'),
-                        }
-                        _send_frame(s, {'type': 'ACK_FILE_START', 'ok': True, 'rel_path': rel_path})
-
-                    elif msg_type == 'FILE_CHUNK':
-                        if not current_file:
-                            continue
-                        current_file['handle'].write(payload)
-                        current_file['hash'].update(payload)
-                        current_file['bytes_received'] += len(payload)
-
-                    elif msg_type == 'FILE_END':
-                        rel_path = header.get('rel_path', '')
-                        if not current_file or rel_path != current_file['rel_path']:
-                            _send_frame(s, {'type': 'FILE_RESULT', 'ok': False, 'rel_path': rel_path})
-                            continue
-                        current_file['handle'].close()
-                        actual_size = current_file['bytes_received']
-                        actual_sha256 = current_file['hash'].hexdigest()
-                        verified = (
-                            actual_size == current_file['expected_size']
-                            and actual_sha256 == current_file['expected_sha256']
-                        )
-                        if verified:
-                            os.replace(current_file['temp_path'], current_file['destination_path'])
-                            received_verified.add(rel_path)
+    def reject_file_start(s: socket.socket, rel_path: str, offset: Optional[int]) -> None:
+        if pipelined:
+            result = {'type': 'FILE_RESULT', 'ok': False, 'rel_path': rel_path}
+            if offset is not None:
+                result['offset'] = offset
+            _send_frame(s, result)
+        else:
+            _send_frame(s, {'type': 'ACK_FILE_START', 'ok': False, 'rel_path': rel_path})
+
+    def finish_file(current_file: dict, actual_size: int, actual_sha256: str) -> bool:
+        verified = actual_size == current_file['expected_size'] and actual_sha256 == current_file['expected_sha256']
+        if verified:
+            os.replace(current_file['temp_path'], current_file['destination_path'])
+            with received_lock:
+                received_verified.add(current_file['rel_path'])
+        elif os.path.exists(current_file['temp_path']):
+            os.remove(current_file['temp_path'])
+        return verified
+
+    def receive_stream(stream: int) -> bool:
+        current_file = None
+        skipped_rel_path = None
+        #rel_paths whose file or range failed on this stream
+        failed_paths: set[str] = set()
+        tls_ctx = _make_client_tls_context()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as raw_socket:
+            raw_socket.connect((ip, sock_port))
+            with tls_ctx.wrap_socket(raw_socket, server_hostname=ip) as s:
+                s.settimeout(60)
+                _send_socket_auth(s, channel='file_download', session_id=transfer_id, extra={'stream': stream})
+                try:
+                    payload_buffer = bytearray(chunk_size)
+                    while True:
+                        header, payload = _recv_frame(s, payload_buffer)
+                        msg_type = header.get('type', '')
+                        incoming_transfer_id = header.get('transfer_id', '')
+                        #binary chunks carry no transfer_id; the socket handshake already tied the connection to this transfer
+                        if incoming_transfer_id != transfer_id and not (binary_chunks and msg_type == 'FILE_CHUNK' and 'file_index' in header):
+                            _send_frame(s, {'type': 'ERROR', 'ok': False, 'error': 'transfer_id mismatch'})
+                            return False
+
+                        if msg_type == 'FILE_START':
+                            rel_path = header.get('rel_path', '')
+                            skipped_rel_path = None
+                            #a FILE_START with offset/length carries one range of the file rather than all of it
+                            offset = header.get('offset')
+                            if rel_path not in expected_map:
+                                reject_file_start(s, rel_path, offset)
+                                failed_paths.add(rel_path)
+                                skipped_rel_path = rel_path
+                                continue
+                            try:
+                                destination_path = _get_safe_local_project_path(rel_path, project_root)
+                            except ValueError as e:
+                                print(f'Invalid destination path for {rel_path}: {e}')
+                                reject_file_start(s, rel_path, offset)
+                                failed_paths.add(rel_path)
+                                skipped_rel_path = rel_path
+                                continue
+                            expected_size = int(expected_map[rel_path]['size'])
+                            length = expected_size
+                            if offset is not None:
+                                offset, length = int(offset), int(header.get('length', -1))
+                                if offset < 0 or length < 0 or offset + length > expected_size:
+                                    print(f'Invalid range for {rel_path}: {header}')
+                                    reject_file_start(s, rel_path, offset)
+                                    failed_paths.add(rel_path)
+                                    skipped_rel_path = rel_path
+                                    continue
+
+                            parent = os.path.dirname(destination_path)
+                            if parent and not os.path.exists(parent):
+                                os.makedirs(parent, exist_ok=True)
+                            temp_path = destination_path + '.part'
+                            if offset is None:
+                                if os.path.exists(temp_path):
+                                    os.remove(temp_path)
+                                handle = open(temp_path, 'wb')
+                            else:
+                                handle = assembler.open_range(temp_path, expected_size, offset)
+                            current_file = {
+                                'rel_path': rel_path,
+                                'offset': offset,
+                                'length': length,
+                                'destination_path': destination_path,
+                                'temp_path': temp_path,
+                                'expected_size': expected_size,
+                                'expected_sha256': expected_map[rel_path]['sha256'],
+                                'bytes_received': 0,
+                                'hash': hashlib.sha256(),
+                                'handle': handle,
+                                'file_index': header.get('file_index'),
+                            }
+                            if not pipelined:
+                                _send_frame(s, {'type': 'ACK_FILE_START', 'ok': True, 'rel_path': rel_path})
+
+                        elif msg_type == 'FILE_CHUNK':
+                            if not current_file:
+                                continue
+                            if 'file_index' in header and header['file_index'] != current_file['file_index']:
+                                print(f"Ignoring FILE_CHUNK for file index {header['file_index']} during {current_file['rel_path']}")
+                                continue
+                            current_file['handle'].write(payload)
+                            if current_file['offset'] is None:
+                                current_file['hash'].update(payload)
+                            current_file['bytes_received'] += len(payload)
+
+                        elif msg_type == 'FILE_END':
+                            rel_path = header.get('rel_path', '')
+                            if pipelined and not current_file and rel_path == skipped_rel_path:
+                                skipped_rel_path = None
+                                continue
+                            if not current_file or rel_path != current_file['rel_path']:
+                                failed_paths.add(rel_path)
+                                _send_frame(s, {'type': 'FILE_RESULT', 'ok': False, 'rel_path': rel_path})
+                                continue
+                            current_file['handle'].close()
+                            result = {'type': 'FILE_RESULT', 'rel_path': rel_path}
+                            if current_file['offset'] is None:
+                                ok = finish_file(current_file, current_file['bytes_received'], current_file['hash'].hexdigest())
+                            else:
+                                #the file's hash can only be checked once its last range is in
+                                result['offset'] = current_file['offset']
+                                ok = current_file['bytes_received'] == current_file['length']
+                                if ok and assembler.finish_range(current_file['temp_path'], current_file['length'], current_file['expected_size']):
+                                    temp_path = current_file['temp_path']
+                                    ok = finish_file(current_file, os.path.getsize(temp_path), _file_sha256(temp_path))
+                            if not ok:
+                                failed_paths.add(rel_path)
+                            result['ok'] = ok
+                            _send_frame(s, result)
+                            current_file = None
+
+                        elif msg_type == 'TRANSFER_END':
+                            with received_lock:
+                                finished_streams[0] += 1
+                                last_stream = finished_streams[0] >= streams
+                                #only the last stream to finish knows which files never arrived
+                                missing_paths = sorted(expected_paths - received_verified) if last_stream else sorted(failed_paths)
+                            if last_stream:
+                                assembler.discard_all()
+                            ok = len(missing_paths) == 0
+                            _send_frame(
+                                s,
+                                {
+                                    'type': 'TRANSFER_RECEIVED',
+                                    'ok': ok,
+                                    'transfer_id': transfer_id,
+                                    'missing': missing_paths,
+                                },
+                            )
+                            return True
                         else:
-                            if os.path.exists(current_file['temp_path']):
-                                os.remove(current_file['temp_path'])
-                        _send_frame(s, {'type': 'FILE_RESULT', 'ok': verified, 'rel_path': rel_path})
-                        current_file = None
-
-                    elif msg_type == 'TRANSFER_END':
-                        missing_paths = sorted(expected_paths - received_verified)
-                        ok = len(missing_paths) == 0
-                        _send_frame(
-                            s,
-                            {
-                                'type': 'TRANSFER_RECEIVED',
-                                'ok': ok,
-                                'transfer_id': transfer_id,
-                                'missing': missing_paths,
-                            },
-                        )
-                        break
+                            print(f'Unknown frame type from server: {msg_type}')
+                            return False
+                except TimeoutError as e:
+                    active_rel_path = current_file.get('rel_path', '') if isinstance(current_file, dict) else ''
+                    if active_rel_path:
+                        print(f'Timed out receiving server file transfer while handling {active_rel_path}: {e}')
                     else:
-                        print(f'Unknown frame type from server: {msg_type}')
-                        return False
-            except TimeoutError as e:
-                active_rel_path = current_file.get('rel_path', '') if isinstance(current_file, dict) else ''
-                if active_rel_path:
-                    print(f'Timed out receiving server file transfer while handling {active_rel_path}: {e}')
-                else:
-                    print(f'Timed out receiving server file transfer: {e}')
-                return False
-            except (ConnectionError, ValueError, json.JSONDecodeError) as e:
-                print(f'Protocol/connection error while receiving files from server: {e}')
-                return False
-            finally:
-                handle = None
-                temp_path = ''
-                if isinstance(current_file, dict):
-                    handle = current_file.get('handle', None)
-                    temp_path = current_file.get('temp_path', '')
-                if handle is not None and hasattr(handle, 'closed') and not handle.closed:
-                    handle.close()
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
+                        print(f'Timed out receiving server file transfer: {e}')
+                    return False
+                except (ConnectionError, ValueError, json.JSONDecodeError) as e:
+                    print(f'Protocol/connection error while receiving files from server: {e}')
+                    return False
+                finally:
+                    if isinstance(current_file, dict):
+                        handle = current_file.get('handle', None)
+                        if handle is not None and not handle.closed:
+                            handle.close()
+                        if current_file['offset'] is None and os.path.exists(current_file['temp_path']):
+                            os.remove(current_file['temp_path'])
+
+    if not _run_transfer_streams(streams, receive_stream):
+        assembler.discard_all()
+        return False
 
     complete_url = _build_server_url(server_addr, f'/sendfilesfromserver/complete/{app_name}')
     try:
@@ -960,6 +1335,26 @@ def receive_files_from_server(server_addr: tuple[str, int], paths: list[str], ch
     return True
 
 
+def _files_server_wants(server_addr: tuple[str, int], app_name: str, file_entries: list[dict]) -> list[dict]:
+    """Sends the manifest to the server, which puts in place every file whose content it already has (in the checkout or
+    its blob store), and returns the entries it still wants.  Servers without a blob store want everything."""
+    url = _build_server_url(server_addr, f'/sendfiles/have/{app_name}')
+    manifest = [{'rel_path': entry['rel_path'], 'size': entry['size'], 'sha256': entry['sha256']} for entry in file_entries]
+    try:
+        resp = _secure_request('POST', url, json_data={'files': manifest}, timeout=120)
+        resp.raise_for_status()
+        result = resp.json()
+    except (requests.RequestException, ValueError):
+        return file_entries
+    if not result.get('ok', False):
+        return file_entries
+    skipped = len(result.get('present', [])) + len(result.get('materialized', []))
+    if skipped:
+        print(f'Server already had {skipped} of {len(file_entries)} file(s)')
+    wanted = set(result.get('want', []))
+    return [entry for entry in file_entries if entry['rel_path'] in wanted]
+
+
 def send_files(server_addr:tuple[str, int], paths:list[str], filesize_threshold:int=20*MB, total_threshold=50*MB) -> bool:
     app_name = get_appname()
     project_root = get_project_root_path(os.getcwd())
@@ -970,6 +1365,9 @@ def send_files(server_addr:tuple[str, int], paths:list[str], filesize_threshold:
         size = os.path.getsize(abs_path)
         sha256 = _file_sha256(abs_path)
         file_entries.append({'abs_path': abs_path, 'rel_path': rel_path, 'size': size, 'sha256': sha256})
+    file_entries = _files_server_wants(server_addr, app_name, file_entries)
+    if not file_entries:
+        return True
 
     file_sizes = [entry['size'] for entry in file_entries]
     if all(size < filesize_threshold for size in file_sizes) and (sum(file_sizes) < total_threshold):
@@ -1006,9 +1404,14 @@ def send_files(server_addr:tuple[str, int], paths:list[str], filesize_threshold:
 
     transfer_id = str(uuid4())
     url = _build_server_url(server_addr, f'/sendfilessocket/init/{app_name}')
+    requested_streams = max(1, _env_int('RXS_TRANSFER_STREAMS', DEFAULT_FILE_TRANSFER_STREAMS))
     init_payload = {
         'transfer_id': transfer_id,
         'chunk_size': 64 * KB,
+        'window': max(0, _env_int('RXS_TRANSFER_WINDOW', DEFAULT_FILE_TRANSFER_WINDOW)),
+        'frame_version': FILE_TRANSFER_FRAME_VERSION,
+        #no more connections than there are files and ranges to spread over them
+        'streams': len([units for units in assign_transfer_streams(file_entries, requested_streams) if units]),
         'files': [
             {'rel_path': entry['rel_path'], 'size': entry['size'], 'sha256': entry['sha256']}
             for entry in file_entries
@@ -1031,32 +1434,21 @@ def send_files(server_addr:tuple[str, int], paths:list[str], filesize_threshold:
         print(f"Server rejected init for transfer {transfer_id}: {init_obj.get('errors', [])}")
         return False
 
-    sock_port = int(init_obj['file_socket_port'])
-    ip, _ = server_addr
-    tls_ctx = _make_client_tls_context()
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as raw_socket:
-        raw_socket.connect((ip, sock_port))
-        with tls_ctx.wrap_socket(raw_socket, server_hostname=ip) as s:
-            s.settimeout(60)
-            _send_socket_auth(s, channel='file_upload', session_id=transfer_id)
-            for entry in file_entries:
-                sent_successfully = _send_file_over_socket(
-                    s=s,
-                    abs_path=entry['abs_path'],
-                    rel_path=entry['rel_path'],
-                    expected_size=entry['size'],
-                    expected_sha256=entry['sha256'],
-                    transfer_id=transfer_id,
-                    chunk_size=init_payload['chunk_size'],
-                )
-                if not sent_successfully:
-                    print(f"Failed to send file over socket: {entry['rel_path']}")
-                    return False
-            _send_frame(s, {'type': 'TRANSFER_END', 'transfer_id': transfer_id})
-            transfer_ack, _ = _recv_frame(s)
-            if transfer_ack.get('type') != 'TRANSFER_RECEIVED' or not transfer_ack.get('ok', False):
-                print(f'Server did not accept transfer end: {transfer_ack}')
-                return False
+    #servers that predate pipelining do not answer with a window and get the lockstep protocol, and ones that predate
+    #multi-stream transfers get a single connection
+    window = int(init_obj.get('window', 0) or 0)
+    binary_chunks = int(init_obj.get('frame_version', 1) or 1) >= 2
+    streams = max(1, int(init_obj.get('streams', 1) or 1))
+    stream_units = assign_transfer_streams(file_entries, streams)
+    socket_addr = (server_addr[0], int(init_obj['file_socket_port']))
+
+    def send_stream(stream: int) -> bool:
+        return _send_transfer_stream(
+            socket_addr, transfer_id, stream, stream_units[stream], window, binary_chunks, init_payload['chunk_size']
+        )
+
+    if not _run_transfer_streams(streams, send_stream):
+        return False
 
     complete_url = _build_server_url(server_addr, f'/sendfilessocket/complete/{app_name}')
     complete_resp = _secure_request('POST', complete_url, json_data={'transfer_id': transfer_id})
@@ -2064,9 +2456,18 @@ if __name__ == '__main__':
         json_obj = json.loads(resp.text)
         print(json_obj)
         job_id = json_obj['job_id']
-        build_log_str = wait_for_build_completion(server_addr, job_id, server_socket_port)
+        log_channel = 'build_events' if os.environ.get('RXS_BUILD_EVENTS', '').strip() in ['1', 'true', 'yes'] else 'build_log'
+        build_log_str = wait_for_build_completion(server_addr, job_id, server_socket_port, channel=log_channel)
         # print('final build log')
         # print(build_log_str)
+    elif arg == 'cancel':
+        if len(sys.argv) < 3:
+            print('Usage: cancel <job_id>')
+        else:
+            print(cancel_build_job(server_addr, sys.argv[2]))
+    elif arg == 'metadata':
+        scheme = sys.argv[2] if len(sys.argv) > 2 else ''
+        print(json.dumps(get_project_metadata(server_addr, scheme=scheme, destinations=bool(scheme)), indent=2))
     elif 'sendchanges' in arg:
         resp:Response = send_current_changes(server_addr)
         print(resp)
@@ -0,0 +1,240 @@
+import os, json, sqlite3, gzip, shutil, time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+from mcp_buildlog import BuildLogStore
+from mcp_utils import MB
+
+
+#job record keys that only make sense in the running process
+NON_PERSISTED_JOB_KEYS = ['output', 'events', 'staged_files', 'processes']
+
+
+class JobStore:
+    """Build job records, persisted in sqlite with an in-memory LRU of hot jobs.
+
+    Behaves like the JOBS dict it replaces: JOBS[job_id] = job inserts (and persists) a record, JOBS.get(job_id) returns
+    the live record for hot jobs or rebuilds one from the database (with read-only log stores over its files) for older
+    ones.  Jobs are only evicted from memory once their finished record has been saved.  Call save(job) after a job's
+    record changes in a way that should survive a restart (the server does this when a job finishes)."""
+
+    def __init__(self, db_path: str, hot_limit: int = 64, max_records: int = 10000, log_max_bytes: int = 2048 * MB,
+                 log_max_age_s: float = 30 * 24 * 3600, log_compress_after_s: float = 24 * 3600):
+        self.db_path = db_path
+        self.hot_limit = max(1, int(hot_limit))
+        self.max_records = max(1, int(max_records))
+        self.log_max_bytes = int(log_max_bytes)
+        self.log_max_age_s = float(log_max_age_s)
+        self.log_compress_after_s = float(log_compress_after_s)
+        self._lock = Lock()
+        self._hot: OrderedDict[str, dict] = OrderedDict()
+        #hot jobs whose record was saved after they finished, i.e. the ones it is safe to evict
+        self._saved_finished: set[str] = set()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            '''CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT,
+                created_at REAL,
+                finished_at REAL,
+                log_path TEXT,
+                log_size INTEGER,
+                events_path TEXT,
+                events_size INTEGER,
+                logs_state TEXT,
+                record TEXT
+            )'''
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)')
+        self._db.commit()
+        self._fail_interrupted_jobs()
+
+    def _fail_interrupted_jobs(self) -> None:
+        """Jobs that were pending or running when the server last stopped can never finish; close them out as errors."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute('SELECT job_id, record FROM jobs WHERE finished_at IS NULL').fetchall()
+            for job_id, record_json in rows:
+                record = json.loads(record_json)
+                record['status'] = 'error'
+                record['error'] = 'server restarted before the job finished'
+                record['finished_at'] = now
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, finished_at = ?, record = ? WHERE job_id = ?',
+                    (record['status'], now, json.dumps(record, default=str), job_id),
+                )
+            self._db.commit()
+
+    def __setitem__(self, job_id: str, job: dict) -> None:
+        with self._lock:
+            self._hot[job_id] = job
+            self._hot.move_to_end(job_id)
+        self.save(job)
+        self._evict()
+
+    def __getitem__(self, job_id: str) -> dict:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    def get(self, job_id: str, default=None) -> Optional[dict]:
+        with self._lock:
+            job = self._hot.get(job_id)
+            if job is not None:
+                self._hot.move_to_end(job_id)
+                return job
+            row = self._db.execute(
+                'SELECT record, log_path, log_size, events_path, events_size, logs_state FROM jobs WHERE job_id = ?', (job_id,)
+            ).fetchone()
+            if row is None:
+                return default
+            record_json, log_path, log_size, events_path, events_size, logs_state = row
+            job = json.loads(record_json)
+            job['output'] = BuildLogStore.open_existing(log_path, log_size or 0)
+            job['events'] = BuildLogStore.open_existing(events_path, events_size or 0)
+            job['logs_state'] = logs_state
+            self._hot[job_id] = job
+            if job.get('finished_at') is not None:
+                self._saved_finished.add(job_id)
+        self._evict()
+        return job
+
+    def save(self, job: dict) -> None:
+        job_id = job['job_id']
+        with self._lock:
+            record = {key: value for key, value in job.items() if key not in NON_PERSISTED_JOB_KEYS}
+            output: BuildLogStore = job['output']
+            events: BuildLogStore = job['events']
+            self._db.execute(
+                '''INSERT OR REPLACE INTO jobs
+                   (job_id, status, created_at, finished_at, log_path, log_size, events_path, events_size, logs_state, record)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (
+                    job_id, job['status'], job.get('created_at'), job.get('finished_at'),
+                    output.log_path, output.size, events.log_path, events.size, job.get('logs_state', 'live'),
+                    json.dumps(record, default=str),
+                ),
+            )
+            self._db.commit()
+            if job.get('finished_at') is not None and self._hot.get(job_id) is job:
+                self._saved_finished.add(job_id)
+
+    def _evict(self) -> None:
+        with self._lock:
+            for job_id in list(self._hot.keys()):
+                if len(self._hot) <= self.hot_limit:
+                    break
+                if job_id not in self._saved_finished:
+                    continue
+                del self._hot[job_id]
+                self._saved_finished.discard(job_id)
+
+    def prune(self) -> dict:
+        """Applies retention: drops the oldest records past max_records, deletes logs past log_max_age_s or beyond
+        log_max_bytes in total (oldest first), and gzips logs older than log_compress_after_s.  Jobs that are hot in
+        memory are left alone, since their clients may still be reading the log files."""
+        now = time.time()
+        deleted_records = compressed = deleted_logs = 0
+        with self._lock:
+            hot_ids = set(self._hot.keys())
+            rows = self._db.execute(
+                '''SELECT job_id, finished_at, log_path, events_path, logs_state FROM jobs
+                   WHERE finished_at IS NOT NULL ORDER BY finished_at'''
+            ).fetchall()
+        excess_records = max(0, len(rows) - self.max_records)
+
+        kept = []
+        for job_id, finished_at, log_path, events_path, logs_state in rows:
+            if job_id in hot_ids:
+                continue
+            if excess_records > 0:
+                _remove_files(log_path, events_path)
+                with self._lock:
+                    self._db.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+                excess_records -= 1
+                deleted_records += 1
+                continue
+            if logs_state == 'deleted':
+                continue
+            if now - finished_at > self.log_max_age_s:
+                self._delete_logs(job_id, log_path, events_path)
+                deleted_logs += 1
+                continue
+            if logs_state == 'live' and self.log_compress_after_s > 0 and now - finished_at > self.log_compress_after_s:
+                log_path, events_path = self._compress_logs(job_id, log_path, events_path)
+                compressed += 1
+            kept.append((job_id, log_path, events_path))
+
+        total_bytes = sum(_file_size(log_path) + _file_size(events_path) for _, log_path, events_path in kept)
+        for job_id, log_path, events_path in kept:
+            if total_bytes <= self.log_max_bytes:
+                break
+            total_bytes -= _file_size(log_path) + _file_size(events_path)
+            self._delete_logs(job_id, log_path, events_path)
+            deleted_logs += 1
+
+        with self._lock:
+            self._db.commit()
+        return {'deleted_records': deleted_records, 'deleted_logs': deleted_logs, 'compressed_logs': compressed}
+
+    def _delete_logs(self, job_id: str, log_path: Optional[str], events_path: Optional[str]) -> None:
+        _remove_files(log_path, events_path)
+        with self._lock:
+            self._db.execute("UPDATE jobs SET logs_state = 'deleted' WHERE job_id = ?", (job_id,))
+
+    def _compress_logs(self, job_id: str, log_path: Optional[str], events_path: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+        log_path = _gzip_file(log_path)
+        events_path = _gzip_file(events_path)
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET logs_state = 'compressed', log_path = ?, events_path = ? WHERE job_id = ?",
+                (log_path, events_path, job_id),
+            )
+        return log_path, events_path
+
+    def recent_records(self, limit: int = 200) -> list[dict]:
+        """Persisted records of the most recently finished jobs, newest first."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT record FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?', (int(limit),)
+            ).fetchall()
+        return [json.loads(record_json) for record_json, in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total, finished = self._db.execute('SELECT COUNT(*), COUNT(finished_at) FROM jobs').fetchone()
+            by_state = dict(self._db.execute('SELECT logs_state, COUNT(*) FROM jobs GROUP BY logs_state').fetchall())
+            return {
+                'records': total,
+                'finished': finished,
+                'hot': len(self._hot),
+                'logs_live': by_state.get('live', 0),
+                'logs_compressed': by_state.get('compressed', 0),
+                'logs_deleted': by_state.get('deleted', 0),
+            }
+
+
+def _file_size(path: Optional[str]) -> int:
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def _remove_files(*paths: Optional[str]) -> None:
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def _gzip_file(path: Optional[str]) -> Optional[str]:
+    """Compresses path to path.gz and removes the original.  Returns the new path (unchanged if there is nothing to do)."""
+    if not path or path.endswith('.gz') or not os.path.exists(path):
+        return path
+    gz_path = f'{path}.gz'
+    with open(path, 'rb') as src, gzip.open(f'{gz_path}.tmp', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(f'{gz_path}.tmp', gz_path)
+    os.remove(path)
+    return gz_path
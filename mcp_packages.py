@@ -0,0 +1,213 @@
+import os, hashlib, shutil, signal, subprocess, time
+from threading import Lock, Thread
+from typing import Callable, Optional
+from mcp_projectmeta import PROJECT_METADATA_SKIP_DIRS
+
+
+PACKAGE_FILE_NAMES = ['Package.resolved', 'Package.swift']
+#written into a packages dir once xcodebuild -resolvePackageDependencies succeeded there
+RESOLVED_MARKER_NAME = '.rxs-resolved'
+
+
+def print_prefetch_result(label: str, resolved: bool, output: str) -> None:
+    """Logs how a background package resolution for label went."""
+    if resolved:
+        print(f'Prefetched Swift packages for {label}')
+    elif output:
+        print(output.strip().splitlines()[-1])
+
+
+class PackageCache:
+    """Swift Package checkouts shared between builds, for xcodebuild's -clonedSourcePackagesDirPath.
+
+    There is one directory per package state, keyed by a hash of every Package.resolved and Package.swift in the project,
+    so builds of different package states never resolve into the same directory, while builds of the same state find
+    their packages already cloned.  A new directory starts as a copy of the most recently used one so resolution only
+    fetches what changed.  ensure() resolves a state at most once at a time (later callers for the same key wait for the
+    first); directories beyond max_dirs are removed least recently used first, unless a build is using them.  A directory
+    whose resolution failed is removed as soon as no build is using it."""
+
+    def __init__(self, root_dir: str, max_dirs: int = 4, resolve_timeout_s: float = 1800):
+        self.root_dir = root_dir
+        self.max_dirs = max(1, int(max_dirs))
+        self.resolve_timeout_s = resolve_timeout_s
+        self._lock = Lock()
+        self._key_locks: dict[str, Lock] = {}
+        #key -> {'last_used_at', 'users', 'ready'}
+        self._dirs: dict[str, dict] = {}
+        self._resolves = 0
+        self._reuses = 0
+        #container/scheme args of the last build, for prefetches triggered by synced changes
+        self.last_resolve_args: list[str] = []
+        os.makedirs(root_dir, exist_ok=True)
+        for name in os.listdir(root_dir):
+            path = os.path.join(root_dir, name)
+            if not os.path.exists(os.path.join(path, RESOLVED_MARKER_NAME)):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            self._dirs[name] = {'last_used_at': os.path.getmtime(os.path.join(path, RESOLVED_MARKER_NAME)), 'users': 0, 'ready': True}
+
+    def package_key(self, project_dir: str) -> Optional[str]:
+        """Hash of the project's package manifests and pins, or None if it does not use Swift packages."""
+        digest = hashlib.sha256()
+        found = False
+        for dir_path, dir_names, file_names in os.walk(project_dir):
+            dir_names[:] = sorted(name for name in dir_names if not name.startswith('.') and name not in PROJECT_METADATA_SKIP_DIRS)
+            for file_name in sorted(file_names):
+                if file_name not in PACKAGE_FILE_NAMES:
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                except OSError:
+                    continue
+                found = True
+                digest.update(f'{os.path.relpath(path, project_dir)}\0'.encode('utf-8'))
+                digest.update(hashlib.sha256(content).digest())
+        return digest.hexdigest()[:32] if found else None
+
+    def packages_dir(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def is_ready(self, key: str) -> bool:
+        with self._lock:
+            return self._dirs.get(key, {}).get('ready', False)
+
+    def acquire(self, key: str) -> str:
+        """Marks a packages dir as in use by a build (so it is not evicted) and returns its path."""
+        with self._lock:
+            entry = self._dirs.setdefault(key, {'last_used_at': time.time(), 'users': 0, 'ready': False})
+            entry['users'] += 1
+            entry['last_used_at'] = time.time()
+        return self.packages_dir(key)
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            entry = self._dirs.get(key)
+            if entry is not None:
+                entry['users'] = max(0, entry['users'] - 1)
+                entry['last_used_at'] = time.time()
+            self._evict_locked()
+        if entry is not None and not entry['ready']:
+            self._discard_unresolved(key)
+
+    def _discard_unresolved(self, key: str, resolving: bool = False) -> None:
+        """Removes a packages dir whose resolution failed, unless a build still uses it or (for callers that are not
+        themselves resolving it) a resolve into it is under way; whoever finishes last removes it."""
+        with self._lock:
+            entry = self._dirs.get(key)
+            if entry is not None and (entry['ready'] or entry['users']):
+                return
+            key_lock = self._key_locks.get(key)
+            if not resolving and key_lock is not None and key_lock.locked():
+                return
+            self._dirs.pop(key, None)
+        shutil.rmtree(self.packages_dir(key), ignore_errors=True)
+
+    def ensure(self, project_dir: str, key: str, resolve_args: list[str],
+               spawn: Optional[Callable[[list[str]], subprocess.Popen]] = None,
+               stopped: Optional[Callable[[], bool]] = None) -> tuple[bool, str]:
+        """Resolves project_dir's packages into the dir for key unless that was done already.  Returns (resolved, output):
+        resolved is False when the dir was ready (or resolution failed, in which case output says why).
+
+        spawn starts the xcodebuild process (in its own process group, with output on a pipe), so a build can register
+        it and have it terminated when the build is stopped; by default it is started here.  A caller for which stopped()
+        turns true gives up waiting for another caller's resolution of the same key."""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, Lock())
+        while not key_lock.acquire(timeout=1.0):
+            if stopped is not None and stopped():
+                return False, 'Package resolution skipped: the build was stopped\n'
+        try:
+            if self.is_ready(key):
+                with self._lock:
+                    self._reuses += 1
+                    if key in self._dirs:
+                        self._dirs[key]['last_used_at'] = time.time()
+                return False, ''
+            if stopped is not None and stopped():
+                return False, 'Package resolution skipped: the build was stopped\n'
+            path = self.packages_dir(key)
+            if not os.path.exists(path):
+                self._seed(path)
+            command = ['xcodebuild', '-resolvePackageDependencies', *resolve_args, '-clonedSourcePackagesDirPath', path]
+            try:
+                if spawn is not None:
+                    proc = spawn(command)
+                else:
+                    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=project_dir,
+                                            start_new_session=True)
+            except OSError as e:
+                self._discard_unresolved(key, resolving=True)
+                return False, f'Package resolution failed: {e}\n'
+            try:
+                stdout, _ = proc.communicate(timeout=self.resolve_timeout_s)
+            except subprocess.TimeoutExpired as e:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    pass
+                proc.communicate()
+                self._discard_unresolved(key, resolving=True)
+                return False, f'Package resolution failed: {e}\n'
+            output = stdout.decode('utf-8', errors='replace')
+            if proc.returncode != 0:
+                self._discard_unresolved(key, resolving=True)
+                return False, f'{output}Package resolution failed with exit code {proc.returncode}\n'
+            open(os.path.join(path, RESOLVED_MARKER_NAME), 'w').close()
+            with self._lock:
+                entry = self._dirs.setdefault(key, {'last_used_at': time.time(), 'users': 0, 'ready': False})
+                entry['ready'] = True
+                entry['last_used_at'] = time.time()
+                self._resolves += 1
+                self._evict_locked()
+            return True, output
+        finally:
+            key_lock.release()
+
+    def prefetch_async(self, project_dir: str, resolve_args: Optional[list[str]] = None) -> None:
+        """Resolves project_dir's current package state in the background, if it has one that is not ready yet."""
+        key = self.package_key(project_dir)
+        if key is None or self.is_ready(key):
+            return
+
+        def run():
+            resolved, output = self.ensure(project_dir, key, self.last_resolve_args if resolve_args is None else resolve_args)
+            print_prefetch_result(key, resolved, output)
+        Thread(target=run, daemon=True).start()
+
+    def _seed(self, path: str) -> None:
+        """Starts a new packages dir from the most recently used ready one, so only changed packages are fetched."""
+        with self._lock:
+            ready = [(entry['last_used_at'], key) for key, entry in self._dirs.items() if entry['ready']]
+        if ready:
+            source = self.packages_dir(max(ready)[1])
+            try:
+                shutil.copytree(source, path, symlinks=True, ignore=shutil.ignore_patterns(RESOLVED_MARKER_NAME))
+                return
+            except (OSError, shutil.Error):
+                shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+    def _evict_locked(self) -> None:
+        by_last_use = sorted(self._dirs.items(), key=lambda item: item[1]['last_used_at'])
+        excess = len(self._dirs) - self.max_dirs
+        for key, entry in by_last_use:
+            if excess <= 0:
+                break
+            if entry['users'] or not entry['ready']:
+                continue
+            del self._dirs[key]
+            self._key_locks.pop(key, None)
+            shutil.rmtree(self.packages_dir(key), ignore_errors=True)
+            excess -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'dirs': {key: dict(entry) for key, entry in self._dirs.items()},
+                'max_dirs': self.max_dirs,
+                'resolves': self._resolves,
+                'reuses': self._reuses,
+            }
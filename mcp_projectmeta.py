@@ -0,0 +1,246 @@
+import os, json, hashlib, subprocess, time
+from threading import Condition
+from typing import Callable, Optional
+
+
+#files whose contents decide a project's schemes, targets, configurations and build settings
+PROJECT_METADATA_FILE_NAMES = ['project.pbxproj', 'contents.xcworkspacedata', 'Package.swift']
+PROJECT_METADATA_FILE_SUFFIXES = ['.xcscheme', '.xcconfig']
+#directories that never hold project definitions (build products, dependency checkouts, hidden tool state)
+PROJECT_METADATA_SKIP_DIRS = ['DerivedData', 'build', 'node_modules']
+
+
+class ProjectMetadataError(Exception):
+    pass
+
+
+class ProjectMetadataCache:
+    """Results of `xcodebuild -list`, `-showBuildSettings` and `-showdestinations` for the projects under project dirs,
+    keyed by a fingerprint of the files that define them (project.pbxproj, *.xcscheme, *.xcconfig, workspace contents
+    and Package.swift).
+
+    xcodebuild only runs when the fingerprint changes (or refresh is asked for); until then answers come from memory or
+    the JSON file at cache_path.  Files are only rehashed when their size or mtime changes, so a fingerprint costs one
+    directory walk.  Destinations also depend on the installed simulators and runtimes, so they expire after
+    destinations_max_age_s even when the project does not change.
+
+    Fingerprints and xcodebuild calls run outside the cache lock, so a slow call only holds up callers asking for the
+    same answer (who wait for it rather than running xcodebuild again).  At most max_entries projects are kept, least
+    recently used dropped first."""
+
+    def __init__(self, cache_path: str, command_timeout_s: float = 120, destinations_max_age_s: float = 3600, max_entries: int = 32):
+        self.cache_path = cache_path
+        self.command_timeout_s = command_timeout_s
+        self.destinations_max_age_s = destinations_max_age_s
+        self.max_entries = max(1, int(max_entries))
+        self._cond = Condition()
+        #(path -> [size, mtime_ns, sha256]) so unchanged files are not reread
+        self._file_hashes: dict[str, list] = {}
+        self._entries: dict[str, dict] = {}
+        #(entry key, fingerprint, what) of the xcodebuild calls under way
+        self._in_flight: set[tuple] = set()
+        self._hits = 0
+        self._misses = 0
+        try:
+            with open(cache_path, 'r') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save_locked(self) -> None:
+        tmp_path = f'{self.cache_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def fingerprint(self, project_dir: str) -> str:
+        digest = hashlib.sha256()
+        for dir_path, dir_names, file_names in os.walk(project_dir):
+            dir_names[:] = sorted(name for name in dir_names if not name.startswith('.') and name not in PROJECT_METADATA_SKIP_DIRS)
+            for file_name in sorted(file_names):
+                if file_name not in PROJECT_METADATA_FILE_NAMES and not file_name.endswith(tuple(PROJECT_METADATA_FILE_SUFFIXES)):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                file_hash = self._file_hash(path)
+                if file_hash is not None:
+                    digest.update(f'{os.path.relpath(path, project_dir)}\0{file_hash}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _file_hash(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        self._file_hashes[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def _entry_locked(self, key: str, fingerprint: str, refresh: bool) -> dict:
+        """The cache entry for key, emptied if the fingerprint moved on."""
+        entry = self._entries.get(key)
+        if entry is None or entry['fingerprint'] != fingerprint or refresh:
+            entry = {'fingerprint': fingerprint, 'list': None, 'build_settings': {}, 'destinations': {}}
+            self._entries[key] = entry
+        entry['last_used_at'] = time.time()
+        by_last_use = sorted(self._entries, key=lambda other: self._entries[other].get('last_used_at', 0.0))
+        for stale_key in by_last_use[:len(by_last_use) - self.max_entries]:
+            del self._entries[stale_key]
+        return entry
+
+    def _cached(self, project_dir: str, container_args: list[str], refresh: bool, what: str,
+                read: Callable[[dict], object], fetch: Callable[[], object], store: Callable[[dict, object], None]) -> object:
+        """read(entry) returns the cached answer or None; on a miss fetch() runs xcodebuild (once, however many callers
+        ask at the same time), store(entry, value) keeps its answer and read() returns it."""
+        key = json.dumps([project_dir, container_args], separators=(',', ':'))
+        fingerprint = self.fingerprint(project_dir)
+        flight = (key, fingerprint, what)
+        with self._cond:
+            while True:
+                entry = self._entry_locked(key, fingerprint, refresh)
+                value = read(entry)
+                if value is not None:
+                    self._hits += 1
+                    return value
+                if flight not in self._in_flight:
+                    break
+                self._cond.wait()
+                #whoever we waited for just fetched a fresh answer
+                refresh = False
+            self._in_flight.add(flight)
+            self._misses += 1
+        try:
+            value = fetch()
+        except Exception:
+            with self._cond:
+                self._in_flight.discard(flight)
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            entry = self._entry_locked(key, fingerprint, False)
+            store(entry, value)
+            self._save_locked()
+            self._in_flight.discard(flight)
+            self._cond.notify_all()
+            cached = read(entry)
+        return cached if cached is not None else value
+
+    def _run_xcodebuild(self, project_dir: str, args: list[str]) -> str:
+        try:
+            proc = subprocess.run(['xcodebuild', *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=project_dir,
+                                  timeout=self.command_timeout_s)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise ProjectMetadataError(f"xcodebuild {' '.join(args)} failed: {e}")
+        if proc.returncode != 0:
+            message = proc.stderr.decode('utf-8', errors='replace').strip() or f'exit code {proc.returncode}'
+            raise ProjectMetadataError(f"xcodebuild {' '.join(args)} failed: {message}")
+        return proc.stdout.decode('utf-8', errors='replace')
+
+    def _run_xcodebuild_json(self, project_dir: str, args: list[str]) -> object:
+        output = self._run_xcodebuild(project_dir, [*args, '-json'])
+        try:
+            return json.loads(output)
+        except ValueError:
+            raise ProjectMetadataError(f"xcodebuild {' '.join(args)} did not print JSON")
+
+    def project_list(self, project_dir: str, container_args: Optional[list[str]] = None, refresh: bool = False) -> dict:
+        """{'fingerprint', 'kind' ('project' or 'workspace'), 'name', 'schemes', 'targets', 'configurations'}."""
+        container_args = list(container_args or [])
+
+        def fetch() -> dict:
+            listing = self._run_xcodebuild_json(project_dir, ['-list', *container_args])
+            if not isinstance(listing, dict):
+                raise ProjectMetadataError('unexpected xcodebuild -list output')
+            kind = 'workspace' if 'workspace' in listing else 'project'
+            info = listing.get(kind) or {}
+            return {
+                'kind': kind,
+                'name': info.get('name'),
+                'schemes': info.get('schemes', []),
+                'targets': info.get('targets', []),
+                'configurations': info.get('configurations', []),
+            }
+
+        def read(entry: dict) -> Optional[dict]:
+            return {'fingerprint': entry['fingerprint'], **entry['list']} if entry['list'] is not None else None
+
+        def store(entry: dict, listing: dict) -> None:
+            entry['list'] = listing
+
+        return self._cached(project_dir, container_args, refresh, 'list', read, fetch, store)
+
+    def build_settings(self, project_dir: str, scheme: str, configuration: Optional[str] = None,
+                       container_args: Optional[list[str]] = None, refresh: bool = False) -> dict:
+        """Build settings per target for a scheme (and configuration): {target: {setting: value}}."""
+        container_args = list(container_args or [])
+        settings_key = json.dumps([scheme, configuration], separators=(',', ':'))
+
+        def fetch() -> dict:
+            args = ['-showBuildSettings', *container_args, '-scheme', scheme]
+            if configuration:
+                args.extend(['-configuration', configuration])
+            targets = self._run_xcodebuild_json(project_dir, args)
+            return {
+                target.get('target', ''): target.get('buildSettings', {})
+                for target in (targets if isinstance(targets, list) else []) if isinstance(target, dict)
+            }
+
+        def store(entry: dict, settings: dict) -> None:
+            entry['build_settings'][settings_key] = settings
+
+        return self._cached(project_dir, container_args, refresh, f'build_settings {settings_key}',
+                            lambda entry: entry['build_settings'].get(settings_key), fetch, store)
+
+    def destinations(self, project_dir: str, scheme: str, container_args: Optional[list[str]] = None, refresh: bool = False) -> list[dict]:
+        """The scheme's available destinations as dicts of their `xcodebuild -showdestinations` fields."""
+        container_args = list(container_args or [])
+
+        def read(entry: dict) -> Optional[list[dict]]:
+            cached = entry['destinations'].get(scheme)
+            if cached is not None and time.time() - cached['fetched_at'] <= self.destinations_max_age_s:
+                return cached['destinations']
+            return None
+
+        def store(entry: dict, destinations: list[dict]) -> None:
+            entry['destinations'][scheme] = {'fetched_at': time.time(), 'destinations': destinations}
+
+        return self._cached(project_dir, container_args, refresh, f'destinations {scheme}', read,
+                            lambda: parse_show_destinations(self._run_xcodebuild(project_dir, ['-showdestinations', *container_args, '-scheme', scheme])),
+                            store)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {'entries': len(self._entries), 'hits': self._hits, 'misses': self._misses}
+
+
+def parse_show_destinations(output: str) -> list[dict]:
+    """Parses the "Available destinations" block of `xcodebuild -showdestinations`, whose lines look like
+    `{ platform:iOS Simulator, id:..., OS:17.2, name:iPhone 15 }`."""
+    destinations = []
+    in_available = False
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('Available destinations'):
+            in_available = True
+            continue
+        if line.startswith('Ineligible destinations'):
+            in_available = False
+            continue
+        if not in_available or not (line.startswith('{') and line.endswith('}')):
+            continue
+        destination = {}
+        for field in line[1:-1].split(', '):
+            name, sep, value = field.strip().partition(':')
+            if sep:
+                destination[name] = value
+        if destination:
+            destinations.append(destination)
+    return destinations
@@ -0,0 +1,160 @@
+import time
+from bisect import insort
+from collections import deque
+from threading import Lock
+from typing import Callable, Optional
+
+
+class BuildScheduler:
+    """Bounded build scheduler.  Jobs wait in a priority queue (FIFO within the same priority) until a build slot is free
+    and no other job holds the same project key, so two builds never mutate the same worktree at once.
+
+    start_job is called (outside the scheduler lock) with the job_id of each job that is handed a slot, and must
+    eventually be followed by finish(job_id)."""
+
+    def __init__(self, slots: int, start_job: Callable[[str], None], wait_history_len: int = 200):
+        self.slots = max(1, int(slots))
+        self._start_job = start_job
+        self._lock = Lock()
+        self._seq = 0
+        # sorted list of (-priority, seq, job_id); lowest tuple runs first
+        self._pending: list[tuple[int, int, str]] = []
+        self._pending_meta: dict[str, dict] = {}
+        self._running: dict[str, dict] = {}
+        self._busy_projects: set[str] = set()
+        self._wait_times: deque[float] = deque(maxlen=wait_history_len)
+        self._total_submitted = 0
+        self._total_started = 0
+        self._max_queue_depth = 0
+
+    def submit(self, job_id: str, project_key: str, priority: int = 0) -> None:
+        with self._lock:
+            self._seq += 1
+            entry = (-int(priority), self._seq, job_id)
+            insort(self._pending, entry)
+            self._pending_meta[job_id] = {
+                'job_id': job_id,
+                'project_key': project_key,
+                'priority': int(priority),
+                'queued_at': time.time(),
+                'entry': entry,
+            }
+            self._total_submitted += 1
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+        self._dispatch()
+
+    def remove(self, job_id: str) -> bool:
+        """Drops a job that has not started yet.  Returns False if the job is not queued."""
+        with self._lock:
+            meta = self._pending_meta.pop(job_id, None)
+            if meta is None:
+                return False
+            self._pending.remove(meta['entry'])
+        return True
+
+    def replace(self, old_job_id: str, new_job_id: str, priority: int = 0) -> bool:
+        """Hands a queued job's place in line to new_job_id (keeping the higher of the two priorities).  A different job
+        waits from now on, not from when old_job_id was queued.  Returns False if old_job_id is no longer queued."""
+        with self._lock:
+            meta = self._pending_meta.pop(old_job_id, None)
+            if meta is None:
+                return False
+            self._pending.remove(meta['entry'])
+            new_priority = max(meta['priority'], int(priority))
+            entry = (-new_priority, meta['entry'][1], new_job_id)
+            insort(self._pending, entry)
+            queued_at = meta['queued_at'] if new_job_id == old_job_id else time.time()
+            self._pending_meta[new_job_id] = {
+                **meta, 'job_id': new_job_id, 'priority': new_priority, 'queued_at': queued_at, 'entry': entry,
+            }
+            self._total_submitted += 1
+        self._dispatch()
+        return True
+
+    def project_jobs(self, project_key: str) -> tuple[list[str], list[str]]:
+        """Returns (queued job_ids in queue order, running job_ids) for a project."""
+        with self._lock:
+            pending = [job_id for _, _, job_id in self._pending if self._pending_meta[job_id]['project_key'] == project_key]
+            running = [job_id for job_id, meta in self._running.items() if meta['project_key'] == project_key]
+        return pending, running
+
+    def finish(self, job_id: str) -> None:
+        with self._lock:
+            meta = self._running.pop(job_id, None)
+            if meta is not None:
+                self._busy_projects.discard(meta['project_key'])
+        self._dispatch()
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """1-based position among queued jobs, or None if the job is not queued."""
+        with self._lock:
+            for i, (_, _, pending_id) in enumerate(self._pending):
+                if pending_id == job_id:
+                    return i + 1
+        return None
+
+    def is_running(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._running
+
+    def _dispatch(self) -> None:
+        to_start: list[str] = []
+        with self._lock:
+            i = 0
+            while i < len(self._pending) and len(self._running) < self.slots:
+                _, _, job_id = self._pending[i]
+                meta = self._pending_meta[job_id]
+                if meta['project_key'] in self._busy_projects:
+                    i += 1
+                    continue
+                self._pending.pop(i)
+                self._pending_meta.pop(job_id)
+                meta['started_at'] = time.time()
+                self._wait_times.append(meta['started_at'] - meta['queued_at'])
+                self._running[job_id] = meta
+                self._busy_projects.add(meta['project_key'])
+                self._total_started += 1
+                to_start.append(job_id)
+        for job_id in to_start:
+            try:
+                self._start_job(job_id)
+            except Exception as e:
+                print(f'Failed to start scheduled job {job_id}: {e}')
+                self.finish(job_id)
+
+    def snapshot(self) -> dict:
+        """Queue contents and metrics, JSON-serializable."""
+        now = time.time()
+        with self._lock:
+            pending = []
+            for position, (_, _, job_id) in enumerate(self._pending, start=1):
+                meta = self._pending_meta[job_id]
+                pending.append({
+                    'job_id': job_id,
+                    'position': position,
+                    'project_key': meta['project_key'],
+                    'priority': meta['priority'],
+                    'waiting_s': round(now - meta['queued_at'], 3),
+                })
+            running = [
+                {
+                    'job_id': job_id,
+                    'project_key': meta['project_key'],
+                    'priority': meta['priority'],
+                    'running_s': round(now - meta['started_at'], 3),
+                }
+                for job_id, meta in self._running.items()
+            ]
+            wait_times = list(self._wait_times)
+            metrics = {
+                'slots': self.slots,
+                'running': len(self._running),
+                'queue_depth': len(self._pending),
+                'max_queue_depth': self._max_queue_depth,
+                'total_submitted': self._total_submitted,
+                'total_started': self._total_started,
+                'wait_s_avg': round(sum(wait_times) / len(wait_times), 3) if wait_times else 0.0,
+                'wait_s_max': round(max(wait_times), 3) if wait_times else 0.0,
+                'wait_s_last': round(wait_times[-1], 3) if wait_times else 0.0,
+            }
+        return {'metrics': metrics, 'pending': pending, 'running': running}
@@ -1,12 +1,34 @@
-import os, subprocess, socket, json, struct, hashlib, time, re, datetime, secrets, ssl, hmac
+import os, sys, subprocess, socket, json, struct, hashlib, time, re, datetime, secrets, ssl, hmac, shutil, zlib, signal
 from flask import Flask, request, send_file, send_from_directory, jsonify, Request, Response
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, Timer
 from functools import wraps
-from typing import Optional
+from typing import Optional, Union
 from werkzeug.utils import secure_filename
 from mcp_utils import *
+from mcp_scheduler import BuildScheduler
+from mcp_buildlog import BuildLogStore
+from mcp_buildevents import BuildEventParser, encode_build_event
+from mcp_buildcache import BuildCache
+from mcp_jobstore import JobStore
+from mcp_worktrees import WorktreePool, WorktreeError
+from mcp_testshards import TestDurationHistory, split_into_shards, test_id_from_event, parse_enumerated_tests
+from mcp_projectmeta import ProjectMetadataCache, ProjectMetadataError
+from mcp_speculative import checkout_tree_id, request_tree_id
+from mcp_packages import PackageCache, PACKAGE_FILE_NAMES, print_prefetch_result
+from mcp_transfer import RangeAssembler, assign_transfer_streams, is_range
+from mcp_blobstore import BlobStore
 # from requests import Request
 
+def _env_int(name: str, default: int) -> int:
+    raw = str(os.environ.get(name, '')).strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        return default
+
+
 server_port = 8751
 server_socket_port = 50271
 discovery_socket_port = 9346
@@ -14,6 +36,73 @@ file_socket_port = 47283
 pairing_duration_s = 60
 allowed_timestamp_skew_s = 120
 nonce_ttl_s = 300
+build_log_listen_backlog = 16
+build_slots = _env_int('RXS_BUILD_SLOTS', 2)
+build_log_memory_limit = _env_int('RXS_BUILD_LOG_MEMORY_KB', 4096) * KB
+build_pipe_read_size = 64 * KB
+build_events_memory_limit = 256 * KB
+build_log_send_max_bytes = 1 * MB
+#streaming compressions the build log sockets can negotiate, in server preference order
+build_log_compressions = ['zlib']
+build_log_compression_level = _env_int('RXS_BUILD_LOG_COMPRESSION_LEVEL', 6)
+build_log_send_timeout_s = _env_int('RXS_BUILD_LOG_SEND_TIMEOUT_S', 120)
+build_cache_enabled = os.environ.get('RXS_BUILD_CACHE', '1').strip().lower() not in ['0', 'false', 'no', 'off']
+build_cache_max_entries = _env_int('RXS_BUILD_CACHE_MAX_ENTRIES', 200)
+build_cache_max_bytes = _env_int('RXS_BUILD_CACHE_MAX_MB', 512) * MB
+build_cache_max_age_s = _env_int('RXS_BUILD_CACHE_MAX_AGE_H', 7 * 24) * 3600
+#what a new build does to older builds of the same project: 'none', 'merge' (take over a queued build's place in line)
+#or 'cancel' (merge, and also stop a running build).  Clients can override it per request with the coalesce form field
+build_coalesce_modes = ['none', 'merge', 'cancel']
+build_coalesce_default = os.environ.get('RXS_BUILD_COALESCE', 'none').strip().lower()
+build_kill_grace_s = 10
+job_cache_size = _env_int('RXS_JOB_CACHE_SIZE', 64)
+job_max_records = _env_int('RXS_JOB_MAX_RECORDS', 10000)
+job_log_max_bytes = _env_int('RXS_BUILD_LOG_MAX_MB', 2048) * MB
+job_log_max_age_s = _env_int('RXS_BUILD_LOG_MAX_AGE_D', 30) * 24 * 3600
+job_log_compress_after_s = _env_int('RXS_BUILD_LOG_COMPRESS_AFTER_H', 24) * 3600
+job_prune_interval_s = 10 * 60
+#RXS_WORKTREE_POOL=1 builds each job in a leased git worktree (per branch, own DerivedData) instead of the server checkout
+worktree_pool_enabled = os.environ.get('RXS_WORKTREE_POOL', '0').strip().lower() in ['1', 'true', 'yes', 'on']
+worktree_pool_size = _env_int('RXS_WORKTREE_POOL_SIZE', build_slots)
+#disk budget for the DerivedData of all pooled worktrees; the coldest is deleted first (0 = unlimited)
+worktree_derived_data_max_bytes = _env_int('RXS_DERIVED_DATA_MAX_MB', 50 * 1024) * MB
+#RXS_SPECULATIVE_BUILDS=1 starts a low-priority build of the server checkout whenever synced changes land, repeating
+#the last build request's args; a matching build request then attaches to it instead of starting over
+speculative_builds_enabled = os.environ.get('RXS_SPECULATIVE_BUILDS', '0').strip().lower() in ['1', 'true', 'yes', 'on']
+#a sync lands in several requests (patch, then binary files); wait for this much quiet before building
+speculative_build_delay_s = _env_int('RXS_SPECULATIVE_DELAY_S', 2)
+speculative_build_priority = -100
+#Swift packages are resolved ahead of builds (after syncs, and for queued jobs whose diff touches Package.swift or
+#Package.resolved) into shared per-package-state dirs that builds get as -clonedSourcePackagesDirPath
+package_prefetch_enabled = os.environ.get('RXS_PACKAGE_PREFETCH', '0').strip().lower() in ['1', 'true', 'yes', 'on']
+package_cache_max_dirs = _env_int('RXS_PACKAGE_CACHE_MAX_DIRS', 4)
+package_resolve_timeout_s = 30 * 60
+#received files are kept by sha256 so later syncs of content the server has seen skip the transfer (see /sendfiles/have)
+blob_store_enabled = os.environ.get('RXS_BLOB_STORE', '1').strip().lower() not in ['0', 'false', 'no', 'off']
+blob_store_max_bytes = _env_int('RXS_BLOB_STORE_MAX_MB', 10 * 1024) * MB
+test_max_shards = _env_int('RXS_TEST_MAX_SHARDS', 8)
+test_default_duration_s = 1.0
+test_enumeration_timeout_s = 120
+project_metadata_timeout_s = 120
+#destinations also change when simulators or runtimes are installed, so they are re-queried after this long
+project_metadata_destinations_max_age_s = _env_int('RXS_DESTINATIONS_MAX_AGE_S', 3600)
+tail_default_max_bytes = 256 * KB
+tail_max_bytes_limit = 4 * MB
+tail_max_wait_s = 60.0
+socket_handshake_timeout_s = 30
+#largest number of files a pipelined file transfer may have in flight (sent, FILE_RESULT not yet read).  Results are
+#small frames, so the peer's unread results always fit in the socket buffers and neither side blocks the other
+file_transfer_max_window = 256
+#most parallel connections (streams) one file transfer may use; the file socket accepts this many per transfer at once
+file_transfer_max_streams = 8
+#largest chunk a file transfer may use; the receive buffer is allocated at this size, and _recv_frame rejects bigger
+#frame payloads anyway
+file_transfer_max_chunk_size = 8 * MB
+#file socket frame formats: 1 = JSON header on every frame, 2 = FILE_CHUNK as a fixed-size binary header (see _recv_frame)
+FILE_TRANSFER_FRAME_VERSION = 2
+#a JSON frame's header length can never be this large, so it marks a binary FILE_CHUNK: marker, file index, payload length
+CHUNK_FRAME_MARKER = 0xFFFFFFFF
+CHUNK_FRAME_HEADER = struct.Struct('!III')
 
 # establish several filesystem level global variables
 cwd = unix_path(os.getcwd())
@@ -210,7 +299,9 @@ def _build_socket_auth_payload(channel: str, session_id: str, timestamp: str, no
     return '\n'.join([channel, session_id, timestamp, nonce])
 
 
-def _verify_socket_handshake(conn: socket.socket, expected_channel: str, expected_session_id: str) -> None:
+def _authenticate_socket_handshake(conn: socket.socket, expected_channels: list[str]) -> dict:
+    """Reads and verifies the AUTH frame on a freshly accepted socket, returning its header.  The caller decides whether
+    the requested session_id is acceptable and sends the AUTH_ACK."""
     header, _ = _recv_frame(conn)
     if header.get('type') != 'AUTH':
         raise PermissionError('missing auth handshake')
@@ -219,7 +310,7 @@ def _verify_socket_handshake(conn: socket.socket, expected_channel: str, expecte
     timestamp = str(header.get('timestamp', ''))
     nonce = str(header.get('nonce', ''))
     signature = str(header.get('signature', ''))
-    if channel != expected_channel or session_id != expected_session_id:
+    if channel not in expected_channels:
         raise PermissionError('invalid auth handshake target')
     try:
         ts = int(timestamp)
@@ -239,7 +330,7 @@ def _verify_socket_handshake(conn: socket.socket, expected_channel: str, expecte
     expected = hmac.new(get_hmac_secret().encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()
     if not hmac.compare_digest(expected, signature):
         raise PermissionError('invalid auth handshake signature')
-    _send_frame(conn, {'type': 'AUTH_ACK', 'ok': True})
+    return header
 
 
 def _wrap_server_tls_socket(conn: socket.socket) -> ssl.SSLSocket:
@@ -302,10 +393,10 @@ bootstrap_security_state()
 # set up sockets for streaming xcode commands (server) and sending/receiving files (filesocket)
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 server.bind(('0.0.0.0', server_socket_port))
-server.listen(1)
+server.listen(build_log_listen_backlog)
 filesocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 filesocket.bind(('0.0.0.0', file_socket_port))
-filesocket.listen(1)
+filesocket.listen(file_transfer_max_streams * 2)
 
 # launch thread that reports back to client on server discovery broadcast requests
 discovery_thread = Thread(target=start_discovery_listener, args=[], daemon=True)
@@ -334,13 +425,25 @@ if project_info_filename not in os.listdir(server_dir_path): #this means this is
 
 
 UPLOAD_FOLDER = unix_path(os.path.join(cwd, server_dir_name))
-JOBS = {}
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+#job records live in sqlite so history survives restarts; only recent and unfinished jobs are kept in memory
+JOBS = JobStore(
+    os.path.join(UPLOAD_FOLDER, 'jobs.sqlite3'),
+    hot_limit=job_cache_size,
+    max_records=job_max_records,
+    log_max_bytes=job_log_max_bytes,
+    log_max_age_s=job_log_max_age_s,
+    log_compress_after_s=job_log_compress_after_s,
+)
+BUILD_CONTROL_LOCK = Lock()
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 TRANSFER_SESSIONS: dict[str, dict] = {}
 OUTBOUND_TRANSFER_SESSIONS: dict[str, dict] = {}
 SESSION_LOCK = Lock()
 SESSION_TTL_SECONDS = 30 * 60
+#/sendfiles/have requests putting files in place right now (guarded by SESSION_LOCK); they count as active transfers
+HAVE_FILES_STATE = {'active': 0}
 
 
 @app.before_request
@@ -408,42 +511,87 @@ def _cleanup_transfer_sessions() -> None:
 
 def _has_active_file_transfer() -> bool:
     with SESSION_LOCK:
-        inbound_active = any(
-            session.get('status') in ['initialized', 'awaiting_socket', 'receiving']
-            for session in TRANSFER_SESSIONS.values()
-        )
-        outbound_active = any(
-            session.get('status') in ['initialized', 'awaiting_socket', 'sending']
-            for session in OUTBOUND_TRANSFER_SESSIONS.values()
-        )
-    return inbound_active or outbound_active
+        return _has_active_file_transfer_locked()
 
 
-def _recv_exact(conn: socket.socket, num_bytes: int) -> bytes:
-    data = bytearray()
-    while len(data) < num_bytes:
-        chunk = conn.recv(num_bytes - len(data))
-        if not chunk:
+def _has_active_file_transfer_locked() -> bool:
+    """Whether a socket transfer or a /sendfiles/have request is under way.  Callers that go on to start one check and
+    register it under the same SESSION_LOCK hold, so two never start at once."""
+    inbound_active = any(
+        session.get('status') in ['initialized', 'receiving']
+        for session in TRANSFER_SESSIONS.values()
+    )
+    outbound_active = any(
+        session.get('status') in ['initialized', 'sending']
+        for session in OUTBOUND_TRANSFER_SESSIONS.values()
+    )
+    return inbound_active or outbound_active or HAVE_FILES_STATE['active'] > 0
+
+
+def _recv_exact_into(conn: socket.socket, view: memoryview) -> None:
+    """Fills view straight from the socket (no per-recv chunks to join and copy)."""
+    received = 0
+    while received < len(view):
+        count = conn.recv_into(view[received:])
+        if not count:
             raise ConnectionError('Socket closed while reading frame')
-        data.extend(chunk)
-    return bytes(data)
+        received += count
+
+
+def _recv_exact(conn: socket.socket, num_bytes: int) -> bytearray:
+    data = bytearray(num_bytes)
+    _recv_exact_into(conn, memoryview(data))
+    return data
+
+
+def _recv_payload(conn: socket.socket, payload_len: int, payload_buffer: Optional[bytearray]) -> Union[bytes, bytearray, memoryview]:
+    if not payload_len:
+        return b''
+    if payload_buffer is None or payload_len > len(payload_buffer):
+        return _recv_exact(conn, payload_len)
+    view = memoryview(payload_buffer)[:payload_len]
+    _recv_exact_into(conn, view)
+    return view
 
 
 def _send_frame(conn: socket.socket, header: dict, payload: bytes = b'') -> None:
+    #one send per frame: separate small writes would each become a TLS record (and, with Nagle, wait on delayed ACKs)
     header_bytes = json.dumps(header).encode('utf-8')
-    conn.sendall(struct.pack('!I', len(header_bytes)))
-    conn.sendall(header_bytes)
-    conn.sendall(struct.pack('!I', len(payload)))
-    if payload:
-        conn.sendall(payload)
+    conn.sendall(b''.join([struct.pack('!I', len(header_bytes)), header_bytes, struct.pack('!I', len(payload)), payload]))
+
 
+def _send_chunk_frame(conn: socket.socket, file_index: int, payload: bytes) -> None:
+    """FILE_CHUNK in frame version 2: no per-chunk JSON, and the file is the one whose FILE_START carried file_index."""
+    conn.sendall(CHUNK_FRAME_HEADER.pack(CHUNK_FRAME_MARKER, file_index, len(payload)) + payload)
 
-def _recv_frame(conn: socket.socket) -> tuple[dict, bytes]:
+
+def _send_file_chunk(conn: socket.socket, transfer_id: str, rel_path: str, file_index: Optional[int], payload: bytes) -> None:
+    """Sends a FILE_CHUNK as a binary frame when the transfer negotiated frame version 2 (file_index set)."""
+    if file_index is None:
+        _send_frame(conn, {'type': 'FILE_CHUNK', 'transfer_id': transfer_id, 'rel_path': rel_path}, payload)
+    else:
+        _send_chunk_frame(conn, file_index, payload)
+
+
+def _recv_frame(conn: socket.socket, payload_buffer: Optional[bytearray] = None) -> tuple[dict, Union[bytes, bytearray, memoryview]]:
+    """Reads a JSON frame, or a binary FILE_CHUNK, which is returned as {'type': 'FILE_CHUNK', 'file_index': ...}.
+    With payload_buffer, a payload that fits is read into it and returned as a memoryview that is only valid until the
+    next call, so file chunks are written and hashed without being copied."""
+    max_header_len = 64 * KB
+    max_payload_len = 8 * MB
     header_len = struct.unpack('!I', _recv_exact(conn, 4))[0]
+    if header_len == CHUNK_FRAME_MARKER:
+        file_index, payload_len = struct.unpack('!II', _recv_exact(conn, 8))
+        if payload_len > max_payload_len:
+            raise ValueError(f'Invalid frame payload length: {payload_len}')
+        return {'type': 'FILE_CHUNK', 'file_index': file_index}, _recv_payload(conn, payload_len, payload_buffer)
+    if header_len <= 0 or header_len > max_header_len:
+        raise ValueError(f'Invalid frame header length: {header_len}')
     header = json.loads(_recv_exact(conn, header_len).decode('utf-8'))
     payload_len = struct.unpack('!I', _recv_exact(conn, 4))[0]
-    payload = _recv_exact(conn, payload_len) if payload_len else b''
-    return header, payload
+    if payload_len > max_payload_len:
+        raise ValueError(f'Invalid frame payload length: {payload_len}')
+    return header, _recv_payload(conn, payload_len, payload_buffer)
 
 
 def _update_session(transfer_id: str, **updates) -> None:
@@ -486,120 +634,236 @@ def _file_sha256(path: str, chunk_size: int = 256 * KB) -> str:
     return digest.hexdigest()
 
 
-def _handle_file_transfer_session(transfer_id: str) -> None:
+def _negotiate_transfer_window(requested) -> int:
+    """In-flight file window for a transfer: what the client asked for, capped by the server.  0 means the lockstep
+    protocol (ACK_FILE_START before and FILE_RESULT after every file before the next one starts)."""
+    try:
+        return min(max(0, int(requested or 0)), file_transfer_max_window)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _negotiate_transfer_chunk_size(requested) -> int:
+    """Chunk size for a transfer: what the client asked for (64 KB if it did not say), kept within 1 byte and
+    file_transfer_max_chunk_size."""
+    try:
+        return min(max(1, int(requested if requested is not None else 64 * KB)), file_transfer_max_chunk_size)
+    except (TypeError, ValueError):
+        return 64 * KB
+
+
+def _negotiate_transfer_streams(requested) -> int:
+    """Parallel connections for a transfer: what the client asked for, capped by the server.  Old clients get 1."""
+    try:
+        return min(max(1, int(requested or 1)), file_transfer_max_streams)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _negotiate_frame_version(requested) -> int:
+    """Frame format for a transfer: the newest both sides speak.  Clients that do not ask get version 1 (JSON only)."""
+    try:
+        return min(max(1, int(requested or 1)), FILE_TRANSFER_FRAME_VERSION)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _handle_file_transfer_session(transfer_id: str, conn: ssl.SSLSocket) -> None:
+    """Receives one stream of an upload on a connection _route_file_socket_connection authenticated.  In pipelined mode
+    (the session's window > 0) the client streams files back to back without waiting for ACK_FILE_START, so a rejected
+    FILE_START is answered with a failed FILE_RESULT right away and that file's chunks are skipped; every file (or range
+    of one) still gets exactly one FILE_RESULT.  A file's ranges may arrive on different streams; it is verified once
+    the last of them is in."""
     current_file = None
-    conn = None
+    skipped_rel_path = None
+    #rel_paths whose file or range failed on this stream
+    failed_paths: set[str] = set()
+    assembler = None
     try:
-        _update_session(transfer_id, status='awaiting_socket')
-        raw_conn, _ = filesocket.accept()
-        conn = _wrap_server_tls_socket(raw_conn)
-        conn.settimeout(60)
-        _verify_socket_handshake(conn, expected_channel='file_upload', expected_session_id=transfer_id)
-        _update_session(transfer_id, status='receiving')
+        with SESSION_LOCK:
+            session = TRANSFER_SESSIONS.get(transfer_id, {})
+            pipelined = session.get('window', 0) > 0
+            binary_chunks = session.get('frame_version', 1) >= 2
+            payload_buffer = bytearray(session.get('chunk_size', 64 * KB))
+            assembler = session.get('assembler') or RangeAssembler()
+
+        def reject_file_start(rel_path: str, error: str, offset: Optional[int]) -> None:
+            _append_session_error(transfer_id, error)
+            failed_paths.add(rel_path)
+            if pipelined:
+                result = {'type': 'FILE_RESULT', 'ok': False, 'rel_path': rel_path, 'error': error}
+                if offset is not None:
+                    result['offset'] = offset
+                _send_frame(conn, result)
+            else:
+                _send_frame(conn, {'type': 'ACK_FILE_START', 'ok': False, 'rel_path': rel_path})
+
+        def finish_file(rel_path: str, actual_size: int, actual_sha256: str) -> bool:
+            """Moves a fully received file into place if it matches the manifest, and records it in the session."""
+            expected_size = current_file['expected_size']
+            expected_sha256 = current_file['expected_sha256']
+            verified = actual_size == expected_size and actual_sha256 == expected_sha256
+            if verified:
+                os.replace(current_file['temp_path'], current_file['destination_path'])
+                if BLOB_STORE is not None:
+                    BLOB_STORE.add(current_file['destination_path'], actual_sha256)
+            else:
+                if os.path.exists(current_file['temp_path']):
+                    os.remove(current_file['temp_path'])
+                _append_session_error(
+                    transfer_id,
+                    f'Integrity check failed for {rel_path}. expected_size={expected_size}, '
+                    f'actual_size={actual_size}, expected_sha256={expected_sha256}, actual_sha256={actual_sha256}',
+                )
+            with SESSION_LOCK:
+                session = TRANSFER_SESSIONS.get(transfer_id)
+                if session is not None:
+                    session['received'][rel_path] = {
+                        'rel_path': rel_path,
+                        'size': actual_size,
+                        'sha256': actual_sha256,
+                        'verified': verified,
+                    }
+                    session['last_updated'] = time.time()
+            return verified
 
         while True:
-            header, payload = _recv_frame(conn)
+            header, payload = _recv_frame(conn, payload_buffer)
             msg_type = header.get('type', '')
             incoming_transfer_id = header.get('transfer_id', '')
 
-            if incoming_transfer_id != transfer_id:
+            #binary chunks carry no transfer_id; the socket handshake already tied the connection to this transfer
+            if incoming_transfer_id != transfer_id and not (binary_chunks and msg_type == 'FILE_CHUNK' and 'file_index' in header):
                 _append_session_error(transfer_id, f'Unexpected transfer_id: {incoming_transfer_id}')
                 _send_frame(conn, {'type': 'ERROR', 'ok': False, 'error': 'transfer_id mismatch'})
                 return
 
             if msg_type == 'FILE_START':
                 rel_path = header.get('rel_path', '')
+                skipped_rel_path = None
+                #a FILE_START with offset/length carries one range of the file rather than all of it
+                offset = header.get('offset')
                 with SESSION_LOCK:
                     session = TRANSFER_SESSIONS.get(transfer_id, {})
                     expected_map = session.get('expected', {})
                     expected_meta = expected_map.get(rel_path)
                 if not expected_meta:
-                    _append_session_error(transfer_id, f'FILE_START for unknown path: {rel_path}')
-                    _send_frame(conn, {'type': 'ACK_FILE_START', 'ok': False, 'rel_path': rel_path})
+                    reject_file_start(rel_path, f'FILE_START for unknown path: {rel_path}', offset)
+                    skipped_rel_path = rel_path
                     continue
 
                 try:
                     destination_path = get_safe_project_path(rel_path)
                 except ValueError as e:
-                    _append_session_error(transfer_id, f'Invalid path for FILE_START {rel_path}: {e}')
-                    _send_frame(conn, {'type': 'ACK_FILE_START', 'ok': False, 'rel_path': rel_path})
+                    reject_file_start(rel_path, f'Invalid path for FILE_START {rel_path}: {e}', offset)
+                    skipped_rel_path = rel_path
                     continue
 
+                expected_size = int(expected_meta['size'])
+                length = expected_size
+                if offset is not None:
+                    try:
+                        offset, length = int(offset), int(header.get('length'))
+                    except (TypeError, ValueError):
+                        offset, length = -1, -1
+                    if offset < 0 or length < 0 or offset + length > expected_size:
+                        reject_file_start(rel_path, f'Invalid range for FILE_START {rel_path}: {header}', header.get('offset'))
+                        skipped_rel_path = rel_path
+                        continue
+
                 parent_dir = os.path.dirname(destination_path)
                 if parent_dir and not os.path.exists(parent_dir):
                     os.makedirs(parent_dir, exist_ok=True)
                 temp_path = destination_path + '.part'
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+                if offset is None:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    handle = open(temp_path, 'wb')
+                else:
+                    handle = assembler.open_range(temp_path, expected_size, offset)
 
                 current_file = {
                     'rel_path': rel_path,
+                    'file_index': header.get('file_index'),
+                    'offset': offset,
+                    'length': length,
                     'destination_path': destination_path,
                     'temp_path': temp_path,
-                    'expected_size': int(expected_meta['size']),
+                    'expected_size': expected_size,
                     'expected_sha256': expected_meta['sha256'],
                     'bytes_received': 0,
                     'hash': hashlib.sha256(),
-                    'handle': open(temp_path, 'wb'),
+                    'handle': handle,
                 }
-                _send_frame(conn, {'type': 'ACK_FILE_START', 'ok': True, 'rel_path': rel_path})
+                if not pipelined:
+                    _send_frame(conn, {'type': 'ACK_FILE_START', 'ok': True, 'rel_path': rel_path})
 
             elif msg_type == 'FILE_CHUNK':
                 if not current_file:
-                    _append_session_error(transfer_id, 'Received FILE_CHUNK without FILE_START')
+                    if skipped_rel_path is None:
+                        _append_session_error(transfer_id, 'Received FILE_CHUNK without FILE_START')
+                    continue
+                if 'file_index' in header and header['file_index'] != current_file['file_index']:
+                    _append_session_error(transfer_id, f"FILE_CHUNK for file index {header['file_index']} during {current_file['rel_path']}")
                     continue
                 current_file['handle'].write(payload)
-                current_file['hash'].update(payload)
+                if current_file['offset'] is None:
+                    current_file['hash'].update(payload)
                 current_file['bytes_received'] += len(payload)
 
             elif msg_type == 'FILE_END':
                 rel_path = header.get('rel_path', '')
+                if pipelined and current_file is None and rel_path == skipped_rel_path:
+                    #the failed FILE_RESULT already went out when the FILE_START was rejected
+                    skipped_rel_path = None
+                    continue
                 if not current_file or rel_path != current_file['rel_path']:
                     _append_session_error(transfer_id, f'FILE_END mismatch for rel_path={rel_path}')
+                    failed_paths.add(rel_path)
                     _send_frame(conn, {'type': 'FILE_RESULT', 'ok': False, 'rel_path': rel_path})
                     continue
 
                 current_file['handle'].close()
-                actual_size = current_file['bytes_received']
-                actual_sha256 = current_file['hash'].hexdigest()
-                expected_size = current_file['expected_size']
-                expected_sha256 = current_file['expected_sha256']
-                verified = actual_size == expected_size and actual_sha256 == expected_sha256
                 rel_path = current_file['rel_path']
-
-                if verified:
-                    os.replace(current_file['temp_path'], current_file['destination_path'])
+                result = {'type': 'FILE_RESULT', 'rel_path': rel_path}
+                if current_file['offset'] is None:
+                    ok = finish_file(rel_path, current_file['bytes_received'], current_file['hash'].hexdigest())
                 else:
-                    if os.path.exists(current_file['temp_path']):
-                        os.remove(current_file['temp_path'])
-                    _append_session_error(
-                        transfer_id,
-                        f'Integrity check failed for {rel_path}. expected_size={expected_size}, '
-                        f'actual_size={actual_size}, expected_sha256={expected_sha256}, actual_sha256={actual_sha256}',
-                    )
-
-                with SESSION_LOCK:
-                    session = TRANSFER_SESSIONS.get(transfer_id)
-                    if session is not None:
-                        session['received'][rel_path] = {
-                            'rel_path': rel_path,
-                            'size': actual_size,
-                            'sha256': actual_sha256,
-                            'verified': verified,
-                        }
-                        session['last_updated'] = time.time()
-                _send_frame(conn, {'type': 'FILE_RESULT', 'ok': verified, 'rel_path': rel_path})
+                    #a range is fine once all its bytes are in; the file's hash can only be checked after its last range
+                    result['offset'] = current_file['offset']
+                    ok = current_file['bytes_received'] == current_file['length']
+                    if not ok:
+                        _append_session_error(
+                            transfer_id,
+                            f"Range of {rel_path} at {current_file['offset']} incomplete. "
+                            f"expected={current_file['length']}, received={current_file['bytes_received']}",
+                        )
+                    elif assembler.finish_range(current_file['temp_path'], current_file['length'], current_file['expected_size']):
+                        temp_path = current_file['temp_path']
+                        ok = finish_file(rel_path, os.path.getsize(temp_path), _file_sha256(temp_path))
+                if not ok:
+                    failed_paths.add(rel_path)
+                result['ok'] = ok
+                _send_frame(conn, result)
                 current_file = None
 
             elif msg_type == 'TRANSFER_END':
                 with SESSION_LOCK:
                     session = TRANSFER_SESSIONS.get(transfer_id, {})
+                    session['finished_streams'] = session.get('finished_streams', 0) + 1
+                    last_stream = session['finished_streams'] >= session.get('streams', 1)
                     expected_paths = set(session.get('expected', {}).keys())
                     received = session.get('received', {})
                     received_verified_paths = {
                         path for path, meta in received.items() if meta.get('verified', False)
                     }
                     missing_paths = sorted(expected_paths - received_verified_paths)
+                if not last_stream:
+                    #other streams are still running, so only this stream's own failures are known yet
+                    missing_paths = sorted(failed_paths)
+                    _send_frame(conn, {'type': 'TRANSFER_RECEIVED', 'ok': not missing_paths, 'missing': missing_paths})
+                    return
+                assembler.discard_all()
                 if missing_paths:
                     _append_session_error(transfer_id, f'Missing or unverified files: {missing_paths}')
                     _send_frame(conn, {'type': 'TRANSFER_RECEIVED', 'ok': False, 'missing': missing_paths})
@@ -613,89 +877,107 @@ def _handle_file_transfer_session(transfer_id: str) -> None:
 
     except Exception as e:
         _append_session_error(transfer_id, f'Socket transfer exception: {e}')
+        #the transfer failed, so files with ranges on the other streams can never be completed either
+        if assembler is not None:
+            assembler.discard_all()
     finally:
         if current_file and current_file.get('handle') and not current_file['handle'].closed:
             current_file['handle'].close()
-        if current_file and current_file.get('temp_path') and os.path.exists(current_file['temp_path']):
+        if current_file and current_file['offset'] is None and os.path.exists(current_file['temp_path']):
             os.remove(current_file['temp_path'])
-        if conn:
-            conn.close()
 
 
-def send_files_from_server(transfer_id: str) -> None:
-    conn = None
+def send_files_from_server(transfer_id: str, conn: ssl.SSLSocket, stream: int) -> None:
+    """Sends the files (and ranges of large files) that init assigned to stream, on a connection
+    _route_file_socket_connection authenticated.  A file counts as sent once the client confirmed all of its ranges."""
     try:
-        with SESSION_LOCK:
-            session = OUTBOUND_TRANSFER_SESSIONS.get(transfer_id)
-        if not session:
-            return
-
-        with SESSION_LOCK:
-            session['status'] = 'awaiting_socket'
-            session['last_updated'] = time.time()
-
-        raw_conn, _ = filesocket.accept()
-        conn = _wrap_server_tls_socket(raw_conn)
-        conn.settimeout(60)
-        _verify_socket_handshake(conn, expected_channel='file_download', expected_session_id=transfer_id)
         with SESSION_LOCK:
             session = OUTBOUND_TRANSFER_SESSIONS.get(transfer_id)
             if not session:
                 return
-            session['status'] = 'sending'
-            session['last_updated'] = time.time()
             expected = session.get('expected', {})
             chunk_size = int(session.get('chunk_size', 64 * KB))
+            window = int(session.get('window', 0))
+            binary_chunks = int(session.get('frame_version', 1)) >= 2
+            units = session['stream_units'][stream]
 
-        for rel_path, meta in expected.items():
-            full_path = meta['full_path']
-            expected_size = int(meta['size'])
-            expected_sha256 = meta['sha256']
-            _send_frame(
-                conn,
-                {
-                    'type': 'FILE_START',
-                    'transfer_id': transfer_id,
-                    'rel_path': rel_path,
-                    'size': expected_size,
-                    'sha256': expected_sha256,
-                },
-            )
-            ack_header, _ = _recv_frame(conn)
-            if ack_header.get('type') != 'ACK_FILE_START' or not ack_header.get('ok', False):
-                _append_outbound_session_error(transfer_id, f'Client rejected FILE_START for {rel_path}: {ack_header}')
-                return
+        #(rel_path, offset) -> [length, bytes sent], for files and ranges whose FILE_RESULT has not been read yet
+        unconfirmed: dict[tuple[str, int], list[int]] = {}
 
-            bytes_sent = 0
-            with open(full_path, 'rb') as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    _send_frame(conn, {'type': 'FILE_CHUNK', 'transfer_id': transfer_id, 'rel_path': rel_path}, chunk)
-                    bytes_sent += len(chunk)
-            _send_frame(conn, {'type': 'FILE_END', 'transfer_id': transfer_id, 'rel_path': rel_path})
-
-            file_result, _ = _recv_frame(conn)
-            if file_result.get('type') != 'FILE_RESULT' or not file_result.get('ok', False):
+        def confirm_file(file_result: dict) -> bool:
+            rel_path = file_result.get('rel_path', '')
+            sent = unconfirmed.pop((rel_path, int(file_result.get('offset', 0) or 0)), None)
+            if file_result.get('type') != 'FILE_RESULT' or not file_result.get('ok', False) or sent is None:
                 _append_outbound_session_error(transfer_id, f'Client file verify failed for {rel_path}: {file_result}')
-                return
-            if bytes_sent != expected_size:
+                return False
+            length, bytes_sent = sent
+            if bytes_sent != length:
                 _append_outbound_session_error(
                     transfer_id,
-                    f'Bytes sent mismatch for {rel_path}. expected={expected_size}, sent={bytes_sent}',
+                    f'Bytes sent mismatch for {rel_path}. expected={length}, sent={bytes_sent}',
                 )
-                return
+                return False
             with SESSION_LOCK:
                 session = OUTBOUND_TRANSFER_SESSIONS.get(transfer_id)
                 if session is not None:
-                    session['sent'][rel_path] = {
-                        'rel_path': rel_path,
-                        'size': bytes_sent,
-                        'sha256': expected_sha256,
-                        'verified': True,
-                    }
+                    confirmed = session['confirmed_bytes'].get(rel_path, 0) + bytes_sent
+                    session['confirmed_bytes'][rel_path] = confirmed
+                    if confirmed >= int(expected[rel_path]['size']):
+                        session['sent'][rel_path] = {
+                            'rel_path': rel_path,
+                            'size': int(expected[rel_path]['size']),
+                            'sha256': expected[rel_path]['sha256'],
+                            'verified': True,
+                        }
                     session['last_updated'] = time.time()
+            return True
+
+        #lockstep (window 0) waits for ACK_FILE_START and FILE_RESULT around every file and stops at the first failure;
+        #pipelined sends files back to back, reading results only to keep at most window files unconfirmed, and reports
+        #each failed file without stopping the others
+        for index, unit in enumerate(units):
+            rel_path = unit['rel_path']
+            file_index = index if binary_chunks else None
+            file_start = {
+                'type': 'FILE_START',
+                'transfer_id': transfer_id,
+                'rel_path': rel_path,
+                'size': int(unit['size']),
+                'sha256': unit['sha256'],
+            }
+            if file_index is not None:
+                file_start['file_index'] = file_index
+            if is_range(unit):
+                file_start.update({'offset': unit['offset'], 'length': unit['length']})
+            _send_frame(conn, file_start)
+            if not window:
+                ack_header, _ = _recv_frame(conn)
+                if ack_header.get('type') != 'ACK_FILE_START' or not ack_header.get('ok', False):
+                    _append_outbound_session_error(transfer_id, f'Client rejected FILE_START for {rel_path}: {ack_header}')
+                    return
+
+            bytes_sent = 0
+            with open(expected[rel_path]['full_path'], 'rb') as f:
+                f.seek(unit['offset'])
+                while bytes_sent < unit['length']:
+                    chunk = f.read(min(chunk_size, unit['length'] - bytes_sent))
+                    if not chunk:
+                        break
+                    _send_file_chunk(conn, transfer_id, rel_path, file_index, chunk)
+                    bytes_sent += len(chunk)
+            _send_frame(conn, {'type': 'FILE_END', 'transfer_id': transfer_id, 'rel_path': rel_path})
+            unconfirmed[(rel_path, unit['offset'])] = [unit['length'], bytes_sent]
+
+            if not window:
+                file_result, _ = _recv_frame(conn)
+                if not confirm_file(file_result):
+                    return
+            while window and len(unconfirmed) >= window:
+                file_result, _ = _recv_frame(conn)
+                confirm_file(file_result)
+        while unconfirmed:
+            file_result, _ = _recv_frame(conn)
+            confirm_file(file_result)
 
         _send_frame(conn, {'type': 'TRANSFER_END', 'transfer_id': transfer_id})
         transfer_ack, _ = _recv_frame(conn)
@@ -706,13 +988,70 @@ def send_files_from_server(transfer_id: str) -> None:
         with SESSION_LOCK:
             session = OUTBOUND_TRANSFER_SESSIONS.get(transfer_id)
             if session is not None:
-                session['status'] = 'sent'
+                session['finished_streams'] = session.get('finished_streams', 0) + 1
+                if session['finished_streams'] >= session.get('streams', 1) and session['status'] != 'error':
+                    session['status'] = 'sent'
                 session['last_updated'] = time.time()
     except Exception as e:
         _append_outbound_session_error(transfer_id, f'Outbound transfer exception: {e}')
+
+
+def _route_file_socket_connection(raw_conn: socket.socket, addr) -> None:
+    conn = None
+    try:
+        raw_conn.settimeout(socket_handshake_timeout_s)
+        conn = _wrap_server_tls_socket(raw_conn)
+        header = _authenticate_socket_handshake(conn, list(file_socket_channel_sessions.keys()))
+        channel = header['channel']
+        transfer_id = str(header.get('session_id', ''))
+        try:
+            stream = int(header.get('stream', 0))
+        except (TypeError, ValueError):
+            stream = -1
+        error = ''
+        with SESSION_LOCK:
+            session = file_socket_channel_sessions[channel].get(transfer_id)
+            if session is None:
+                error = 'unknown transfer_id'
+            elif not 0 <= stream < session.get('streams', 1) or stream in session['connected_streams']:
+                error = f'invalid stream {stream}'
+            else:
+                session['connected_streams'].append(stream)
+                if session['status'] == 'initialized':
+                    session['status'] = 'receiving' if channel == 'file_upload' else 'sending'
+                session['last_updated'] = time.time()
+        if error:
+            _send_frame(conn, {'type': 'AUTH_ACK', 'ok': False, 'error': error})
+            return
+        _send_frame(conn, {'type': 'AUTH_ACK', 'ok': True})
+        conn.settimeout(60)
+        if channel == 'file_upload':
+            _handle_file_transfer_session(transfer_id, conn)
+        else:
+            send_files_from_server(transfer_id, conn, stream)
+    except Exception as e:
+        print(f'File socket connection from {addr} ended early: {e}')
     finally:
         if conn:
             conn.close()
+        else:
+            raw_conn.close()
+
+
+#socket channel -> the transfer sessions its connections belong to
+file_socket_channel_sessions = {'file_upload': TRANSFER_SESSIONS, 'file_download': OUTBOUND_TRANSFER_SESSIONS}
+
+
+def start_file_socket_dispatcher():
+    """Single acceptor for file_socket_port.  Transfers may use several connections at once (one per stream); each is
+    authenticated on its own thread and handed to the transfer named by its session_id."""
+    while True:
+        try:
+            raw_conn, addr = filesocket.accept()
+        except OSError as e:
+            print(f'File socket accept failed: {e}')
+            continue
+        Thread(target=_route_file_socket_connection, args=(raw_conn, addr), daemon=True).start()
 
 _DRIVE_PATH_RE = re.compile(r"^[A-Za-z]:[\\/].+")
 def _looks_like_path_arg(value: str):
@@ -727,8 +1066,25 @@ def _looks_like_path_arg(value: str):
         or _DRIVE_PATH_RE.match(s) is not None
     )
 
-def _get_invalid_xcodebuild_args(args:list[str]) -> list[str]:
-    '''Returns a list of invalid arguments'''
+def _get_unknown_scheme_args(args:list[str], project_dir:str) -> list[str]:
+    '''Returns the -scheme args naming a scheme the project does not have, according to its cached metadata.  Nothing
+    is reported when the metadata cannot be had (e.g. xcodebuild -list fails), xcodebuild will complain itself then.'''
+    container_args = []
+    for flag in ['-workspace', '-project']:
+        for value in _xcodebuild_arg_values(args, flag):
+            container_args.extend([flag, value])
+    schemes = _xcodebuild_arg_values(args, '-scheme')
+    if not schemes:
+        return []
+    try:
+        known_schemes = PROJECT_METADATA.project_list(project_dir, container_args)['schemes']
+    except ProjectMetadataError as e:
+        print(f'Skipping scheme validation: {e}')
+        return []
+    return [f'-scheme {scheme}' for scheme in schemes if known_schemes and scheme not in known_schemes]
+
+def _get_invalid_xcodebuild_args(args:list[str], project_dir:Optional[str]=None) -> list[str]:
+    '''Returns a list of invalid arguments.  With project_dir, -scheme is also checked against the project's schemes.'''
     project_root = get_project_root_path()
     path_bearing_flags = ['-project', '-workspace', '-xcconfig', '-sdk', '-derivedDataPath', '-resultBundlePath', '-resultStreamPath',
                           '-archivePath', '-exportPath', '-exportOptionsPlist', '-localizationPath', '-xctestrun', '-testProductsPath',
@@ -776,57 +1132,979 @@ def _get_invalid_xcodebuild_args(args:list[str]) -> list[str]:
                 #but it's likely enough that I felt like I should create this else statement and leave this comment here at least
                 pass
 
+    if project_dir and not invalid_args:
+        invalid_args.extend(_get_unknown_scheme_args(args, project_dir))
     return invalid_args
 
 
+def _invalid_args_message(invalid_args: list[str]) -> str:
+    msg = f'Error (invalid args): '
+    for arg in invalid_args[:-1]:
+        msg += f'"{arg}", '
+    msg += invalid_args[-1]
+    return msg
+
+
+def _make_event_emitter(job: dict, test_durations: dict[str, float]):
+    """Event callback for a job's parser: writes events to the job's event stream and collects test durations."""
+    events: BuildLogStore = job['events']
+
+    def emit(event: dict) -> None:
+        if event['type'] == 'test' and event.get('seconds') is not None:
+            test_id = test_id_from_event(event)
+            if test_id:
+                test_durations[test_id] = event['seconds']
+        events.append(encode_build_event(event))
+    return emit
+
+
+def _spawn_job_process(job: dict, command: list[str], stdout=subprocess.PIPE) -> subprocess.Popen:
+    """Starts a process for a job in its own process group and registers it, so stopping the job stops it and everything
+    it spawned.  A job that was stopped meanwhile has the new process terminated right away."""
+    proc = subprocess.Popen(command, stdout=stdout, stderr=subprocess.STDOUT, bufsize=0, shell=False, start_new_session=True,
+                            cwd=job.get('workdir'))
+    with BUILD_CONTROL_LOCK:
+        job.setdefault('processes', []).append(proc)
+        stop_requested = job.get('stop_status') is not None
+    if stop_requested:
+        _terminate_process_group(proc)
+    return proc
+
+
+def _run_build_process(job: dict, command: list[str], parser: BuildEventParser, metrics: dict, shard: Optional[int] = None,
+                       merge_lock: Optional[Lock] = None) -> int:
+    """Runs one xcodebuild invocation for a job, streaming its output into the job's log and parser, and returns its
+    exit code.  metrics gets the invocation's timings and resource usage.  With shard set, output is merged line by
+    line under merge_lock with a [shard N] prefix, so concurrent shards never interleave mid-line."""
+    output: BuildLogStore = job['output']
+    spawned_at = time.monotonic()
+    proc = _spawn_job_process(job, command)
+    # drain the pipe as fast as xcodebuild writes it; clients read from the log store at their own pace
+    pipe_fd = proc.stdout.fileno()
+    partial_line = b''
+    while True:
+        chunk = os.read(pipe_fd, build_pipe_read_size)
+        if not chunk:
+            break
+        if 'time_to_first_output_s' not in metrics:
+            metrics['time_to_first_output_s'] = round(time.monotonic() - spawned_at, 3)
+        if shard is None:
+            output.append(chunk)
+            parser.feed(chunk)
+        else:
+            lines = (partial_line + chunk).split(b'\n')
+            partial_line = lines.pop()
+            _append_merged_lines(job, parser, lines, merge_lock, shard)
+    if shard is not None and partial_line:
+        _append_merged_lines(job, parser, [partial_line], merge_lock, shard)
+
+    return_code = _wait_for_build_process(proc, metrics)
+    metrics['xcodebuild_wall_s'] = round(time.monotonic() - spawned_at, 3)
+    if metrics.get('cpu_user_s') is not None and metrics['xcodebuild_wall_s'] > 0:
+        metrics['cpu_utilization'] = round((metrics['cpu_user_s'] + metrics['cpu_sys_s']) / metrics['xcodebuild_wall_s'], 3)
+    return return_code
+
+
+def _append_merged_lines(job: dict, parser: BuildEventParser, lines: list[bytes], merge_lock: Lock, shard: Optional[int] = None) -> None:
+    """Appends whole lines to a job log shared by several writers, tagging them (and their events) with their shard."""
+    prefix = f'[shard {shard}] '.encode() if shard is not None else b''
+    tags = {'shard': shard} if shard is not None else {}
+    with merge_lock:
+        offset = job['output'].size
+        blob = bytearray()
+        for line in lines:
+            parser.feed_line(line, offset + len(blob) + len(prefix), **tags)
+            blob.extend(prefix + line + b'\n')
+        job['output'].append(bytes(blob))
+
+
+def _job_build_args(job: dict, xcodebuild_args: list[str]) -> list[str]:
+    """The validated user args plus what the server adds for the job (its worktree's DerivedData and the shared Swift
+    package checkouts, unless the user set them)."""
+    build_args = list(xcodebuild_args)
+    derived_data_path = job.get('derived_data_path')
+    if derived_data_path and not _xcodebuild_arg_values(xcodebuild_args, '-derivedDataPath'):
+        build_args.extend(['-derivedDataPath', derived_data_path])
+    packages_path = job.get('packages_path')
+    if packages_path and not _xcodebuild_arg_values(xcodebuild_args, '-clonedSourcePackagesDirPath'):
+        build_args.extend(['-clonedSourcePackagesDirPath', packages_path])
+    return build_args
+
+
+def _test_history_key(job: dict) -> str:
+    """Test durations are kept per repository and scheme, so every branch (and worktree) of a scheme shares them."""
+    return f"{cwd}#{','.join(_xcodebuild_arg_values(job['xcodebuild_args'], '-scheme'))}"
+
+
 def run_xcodebuild(job_id, xcodebuild_args):
-    conn = None
-    proc = None
-    log_write = None
+    job = JOBS[job_id]
+    output: BuildLogStore = job['output']
+    events: BuildLogStore = job['events']
+    test_durations: dict[str, float] = {}
+    parser = BuildEventParser(_make_event_emitter(job, test_durations), base_offset=output.size)
+    started = False
     try:
-        raw_conn, addr = server.accept()
-        conn = _wrap_server_tls_socket(raw_conn)
-        print(f'Received connection from {addr}')
-        _verify_socket_handshake(conn, expected_channel='build_log', expected_session_id=str(job_id))
-        job = JOBS[job_id]
-        log_write = job['file']
-        invalid_args = _get_invalid_xcodebuild_args(xcodebuild_args)
+        invalid_args = _get_invalid_xcodebuild_args(xcodebuild_args, project_dir=job.get('workdir') or cwd)
         if invalid_args:
-            msg = f'Error (invalid args): '
-            for arg in invalid_args[:-1]:
-                msg += f'"{arg}", '
-            msg += invalid_args[-1]
+            msg = _invalid_args_message(invalid_args)
             job['status'] = 'error'
             job['error'] = msg
-            conn.sendall(msg.encode())
+            output.append(msg.encode())
             return
 
         job['status'] = 'running'
-        xcodebuild_command: list[str] = ['xcodebuild', *xcodebuild_args]
-        proc = subprocess.Popen(xcodebuild_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, shell=False)
-        chunk_size = 4096
-        while True:
-            chunk = proc.stdout.read(chunk_size)
-            if not chunk:
-                break
-            log_write.write(chunk.decode(errors='replace'))
-            conn.sendall(chunk)
-
-        return_code = proc.wait()
+        started = True
+        return_code = _run_build_process(job, ['xcodebuild', *_job_build_args(job, xcodebuild_args)], parser, job.setdefault('metrics', {}))
+        if job.get('stop_status') is not None:
+            _set_job_stopped(job)
+            return
         if return_code == 0:
             job['status'] = 'done'
         else:
             job['status'] = 'error'
             job['error'] = f'xcodebuild exited with return code {return_code}'
+        job['exit_code'] = return_code
+    except Exception as e:
+        job['status'] = 'error'
+        job['error'] = str(e)
+    finally:
+        output.close()
+        parser.close()
+        events.close()
+        if started:
+            job['metrics']['phases_s'] = parser.phase_times_rounded()
+        TEST_DURATIONS.record(_test_history_key(job), test_durations)
+
+
+def _discover_tests(job: dict, xcodebuild_args: list[str], destination: str) -> list[str]:
+    """Asks xcodebuild to enumerate the scheme's tests (Xcode 16+), as one of the job's processes so stopping the job
+    stops it.  Returns [] if enumeration is unavailable or fails."""
+    enumeration_path = os.path.join(UPLOAD_FOLDER, f'test-enumeration-{secrets.token_hex(8)}.json')
+    command = ['xcodebuild', 'test-without-building', *xcodebuild_args, '-destination', destination,
+               '-enumerate-tests', '-test-enumeration-format', 'json', '-test-enumeration-output-path', enumeration_path]
+    try:
+        proc = _spawn_job_process(job, command, stdout=subprocess.DEVNULL)
+        try:
+            return_code = proc.wait(timeout=test_enumeration_timeout_s)
+        except subprocess.TimeoutExpired:
+            _terminate_process_group(proc)
+            proc.wait()
+            return []
+        if return_code != 0 or not os.path.exists(enumeration_path):
+            return []
+        with open(enumeration_path, 'r') as f:
+            return parse_enumerated_tests(json.load(f))
+    except (OSError, ValueError):
+        return []
+    finally:
+        if os.path.exists(enumeration_path):
+            os.remove(enumeration_path)
+
+
+def run_sharded_tests(job_id: str) -> None:
+    """Test mode: one build-for-testing, then the tests split into shards (balanced by historical per-test durations)
+    run concurrently with test-without-building, one destination per shard.  Shard output is merged into the job's log
+    with [shard N] prefixes, followed by a combined result."""
+    job = JOBS[job_id]
+    output: BuildLogStore = job['output']
+    events: BuildLogStore = job['events']
+    test_durations: dict[str, float] = {}
+    parser = BuildEventParser(_make_event_emitter(job, test_durations), base_offset=output.size)
+    merge_lock = Lock()
+    xcodebuild_args = job['xcodebuild_args']
+    destinations = job['test_destinations']
+    started = False
+    try:
+        invalid_args = _get_invalid_xcodebuild_args(xcodebuild_args, project_dir=job.get('workdir') or cwd)
+        if invalid_args:
+            msg = _invalid_args_message(invalid_args)
+            job['status'] = 'error'
+            job['error'] = msg
+            output.append(msg.encode())
+            return
+
+        job['status'] = 'running'
+        started = True
+        xcodebuild_args = _job_build_args(job, xcodebuild_args)
+        metrics = job.setdefault('metrics', {})
+        return_code = _run_build_process(job, ['xcodebuild', 'build-for-testing', *xcodebuild_args], parser, metrics)
+        if job.get('stop_status') is not None:
+            _set_job_stopped(job)
+            return
+        if return_code != 0:
+            job['status'] = 'error'
+            job['error'] = f'xcodebuild build-for-testing exited with return code {return_code}'
+            job['exit_code'] = return_code
+            return
+
+        history_key = _test_history_key(job)
+        tests = job['tests'] or _discover_tests(job, xcodebuild_args, destinations[0]) or TEST_DURATIONS.known_tests(history_key)
+        if job.get('stop_status') is not None:
+            _set_job_stopped(job)
+            return
+        shard_count = min(job['test_shards'], len(destinations))
+        if tests:
+            plan = split_into_shards(tests, shard_count, lambda test_id: TEST_DURATIONS.estimate(history_key, test_id, test_default_duration_s))
+        else:
+            #nothing to split on; run the whole suite as one shard
+            plan = [([], 0.0)]
+        job['shards'] = [
+            {'shard': i, 'destination': destinations[i], 'tests': shard_tests, 'expected_s': expected_s, 'exit_code': None, 'metrics': {}}
+            for i, (shard_tests, expected_s) in enumerate(plan)
+        ]
+        _append_merged_lines(job, parser, [f'Running {len(plan)} test shard(s) across {len(tests)} test identifier(s)'.encode()], merge_lock)
+        #the shards run side by side, so each gets its own parser (and phase timings); only their events are merged
+        parser.enter_phase('test')
+        emit = _make_event_emitter(job, test_durations)
+        shard_parsers = [BuildEventParser(emit, base_offset=output.size) for _ in job['shards']]
+
+        def run_shard(shard: dict) -> None:
+            shard_parser = shard_parsers[shard['shard']]
+            command = ['xcodebuild', 'test-without-building', *xcodebuild_args, '-destination', shard['destination'],
+                       *[f'-only-testing:{test_id}' for test_id in shard['tests']]]
+            try:
+                shard['exit_code'] = _run_build_process(job, command, shard_parser, shard['metrics'], shard=shard['shard'], merge_lock=merge_lock)
+            except Exception as e:
+                _append_merged_lines(job, shard_parser, [f'Shard failed to run: {e}'.encode()], merge_lock, shard['shard'])
+                shard['exit_code'] = -1
+            finally:
+                shard_parser.close(emit_summary=False)
+                shard['metrics']['phases_s'] = shard_parser.phase_times_rounded()
+
+        shard_started = time.monotonic()
+        shard_threads = [Thread(target=run_shard, args=[shard], daemon=True) for shard in job['shards']]
+        for thread in shard_threads:
+            thread.start()
+        for thread in shard_threads:
+            thread.join()
+        metrics['test_shards_wall_s'] = round(time.monotonic() - shard_started, 3)
+        for shard_parser in shard_parsers:
+            parser.add_counts(shard_parser)
+
+        if job.get('stop_status') is not None:
+            _set_job_stopped(job)
+            return
+        failed = [shard['shard'] for shard in job['shards'] if shard['exit_code'] != 0]
+        succeeded = len(job['shards']) - len(failed)
+        _append_merged_lines(job, parser, [
+            f'Test shards: {succeeded}/{len(job["shards"])} succeeded'.encode(),
+            b'** TEST SUCCEEDED **' if not failed else b'** TEST FAILED **',
+        ], merge_lock)
+        if failed:
+            job['status'] = 'error'
+            job['error'] = f'test shards failed: {", ".join(str(i) for i in failed)}'
+            job['exit_code'] = next(shard['exit_code'] for shard in job['shards'] if shard['exit_code'] != 0)
+        else:
+            job['status'] = 'done'
+            job['exit_code'] = 0
+    except Exception as e:
+        job['status'] = 'error'
+        job['error'] = str(e)
+    finally:
+        output.close()
+        parser.close()
+        events.close()
+        if started:
+            job['metrics']['phases_s'] = parser.phase_times_rounded()
+        TEST_DURATIONS.record(_test_history_key(job), test_durations)
+
+
+def _wait_for_build_process(proc: subprocess.Popen, metrics: dict) -> int:
+    """Reaps xcodebuild with os.wait4 so the job gets its resource usage.  The rusage covers xcodebuild and every
+    descendant it waited for (clang, swift-frontend, ld, ...), i.e. the whole build tree."""
+    try:
+        _, wait_status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait()
+    proc.returncode = os.waitstatus_to_exitcode(wait_status)
+    #ru_maxrss is bytes on macOS and kilobytes on Linux
+    rss_scale = 1 if sys.platform == 'darwin' else KB
+    metrics.update({
+        'cpu_user_s': round(rusage.ru_utime, 3),
+        'cpu_sys_s': round(rusage.ru_stime, 3),
+        'peak_rss_bytes': rusage.ru_maxrss * rss_scale,
+        'io_blocks_in': rusage.ru_inblock,
+        'io_blocks_out': rusage.ru_oublock,
+        'voluntary_ctx_switches': rusage.ru_nvcsw,
+        'involuntary_ctx_switches': rusage.ru_nivcsw,
+    })
+    return proc.returncode
+
+
+def _terminate_process_group(proc: subprocess.Popen) -> None:
+    """Sends SIGTERM to a build's process group, and SIGKILL if the build has still not exited after build_kill_grace_s."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        return
+
+    def _kill_after_grace():
+        #the build thread reaps xcodebuild itself (for its rusage), so this only watches, never waits on the process
+        time.sleep(build_kill_grace_s)
+        if proc.returncode is not None:
+            #already reaped, so its pid (and with it the group id) may belong to something else by now
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    Thread(target=_kill_after_grace, daemon=True).start()
+
+
+def _set_job_stopped(job: dict) -> None:
+    """Gives a job that was stopped early (cancelled or superseded) its final status and closing log line."""
+    job['status'] = job['stop_status']
+    job['error'] = job['stop_reason']
+    job['output'].append(f"\nBuild {job['stop_reason']}\n".encode())
+
+
+def _finish_dequeued_job(job: dict) -> None:
+    """Finishes a stopped job that was taken out of the queue before it started."""
+    _set_job_stopped(job)
+    job['output'].close()
+    job['events'].close()
+    job['finished_at'] = time.time()
+    shutil.rmtree(_get_job_staging_dir(job['job_id']), ignore_errors=True)
+    JOBS.save(job)
+
+
+def _stop_job(job: dict, status: str, reason: str, superseded_by: Optional[str] = None) -> bool:
+    """Stops a queued or running job with the given final status ('cancelled' or 'superseded').  A queued job is
+    dropped from the queue and finished right away; a running one has its process groups terminated (xcodebuild, or the
+    package resolution it is waiting on; if it is still applying its changes, it stops before either starts) and
+    finishes, freeing its build slot, once the process exits.  Returns False if the job had already finished."""
+    with BUILD_CONTROL_LOCK:
+        if job['status'] not in ['pending', 'running'] or job.get('stop_status') is not None:
+            return False
+        job['stop_status'] = status
+        job['stop_reason'] = reason
+        if superseded_by is not None:
+            job['superseded_by'] = superseded_by
+        processes = list(job.get('processes', []))
+    if BUILD_SCHEDULER.remove(job['job_id']):
+        _finish_dequeued_job(job)
+    for proc in processes:
+        if proc.returncode is None:
+            _terminate_process_group(proc)
+    return True
+
+
+def _coalesce_project_jobs(job: dict, mode: str) -> tuple[bool, list[str]]:
+    """Applies a coalescing mode for a newly submitted job.  Queued builds of the same project are superseded and the
+    new job takes over the earliest one's place in line; in 'cancel' mode running builds are stopped too.
+    Returns (took_queue_entry, superseded_job_ids)."""
+    superseded = []
+    took_entry = False
+    if mode not in ['merge', 'cancel']:
+        return took_entry, superseded
+    reason = f"superseded by {job['job_id']}"
+    pending_ids, running_ids = BUILD_SCHEDULER.project_jobs(job['project_key'])
+    for old_job_id in pending_ids:
+        old_job = JOBS[old_job_id]
+        if not took_entry and BUILD_SCHEDULER.replace(old_job_id, job['job_id'], job['priority']):
+            took_entry = True
+            #set under BUILD_CONTROL_LOCK as in _stop_job.  A /cancel that got there first keeps its status, but the job
+            #is no longer queued, so it is finished here either way
+            with BUILD_CONTROL_LOCK:
+                superseding = old_job.get('stop_status') is None
+                if superseding:
+                    old_job['superseded_by'] = job['job_id']
+                    old_job['stop_status'] = 'superseded'
+                    old_job['stop_reason'] = reason
+            _finish_dequeued_job(old_job)
+            if not superseding:
+                continue
+        elif not _stop_job(old_job, 'superseded', reason, superseded_by=job['job_id']):
+            continue
+        superseded.append(old_job_id)
+    if mode == 'cancel':
+        for old_job_id in running_ids:
+            if _stop_job(JOBS[old_job_id], 'superseded', reason, superseded_by=job['job_id']):
+                superseded.append(old_job_id)
+    return took_entry, superseded
+
+
+def _get_job_staging_dir(job_id: str) -> str:
+    return os.path.join(UPLOAD_FOLDER, 'jobs', job_id)
+
+
+def _apply_job_changes(job: dict) -> None:
+    """Moves a job's staged binary files into place and applies its diff, in the job's worktree if it leased one
+    (otherwise the server checkout).  A diff the checkout already contains (the client always sends its whole
+    `git diff HEAD`, which an earlier build or sync may have applied to the server checkout) is left as is; raises if
+    the diff neither applies nor is already applied.  Only called while the job holds its project."""
+    output: BuildLogStore = job['output']
+    project_dir = job.get('workdir') or cwd
+    for entry in job.get('staged_files', []):
+        destination_path = entry['destination_path']
+        if project_dir != cwd:
+            destination_path = os.path.join(project_dir, os.path.relpath(destination_path, cwd))
+        if os.path.isdir(destination_path):
+            print(f"Path given for changed or added binary file {entry['rel_path']}: {destination_path}, already exists as a directory")
+            continue
+        parent_dir = os.path.dirname(destination_path)
+        if parent_dir and not os.path.exists(parent_dir):
+            os.makedirs(parent_dir, exist_ok=True)
+        os.replace(entry['staged_path'], destination_path)
+
+    patch_path = job.get('patch_path')
+    if patch_path and os.path.exists(patch_path) and os.path.getsize(patch_path) > 0:
+        already_applied = subprocess.run(
+            ['git', 'apply', '--reverse', '--check', patch_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=project_dir
+        ).returncode == 0
+        if already_applied:
+            output.append(b'Changes already applied\n')
+            return
+        proc = subprocess.run(['git', 'apply', patch_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=project_dir)
+        if proc.stdout:
+            output.append(proc.stdout)
+        if proc.returncode != 0:
+            message = proc.stdout.decode('utf-8', errors='replace').strip()
+            raise RuntimeError(f'git apply exited with code {proc.returncode}: {message}')
+
+
+def _xcodebuild_arg_values(xcodebuild_args: list[str], flag: str) -> list[str]:
+    """Values given for flag, in either "-flag value" or "-flag=value" form."""
+    values = []
+    for i, arg in enumerate(xcodebuild_args):
+        if arg == flag and i + 1 < len(xcodebuild_args):
+            values.append(xcodebuild_args[i + 1])
+        elif arg.startswith(f'{flag}='):
+            values.append(arg.split('=', 1)[1])
+    return values
+
+
+def _job_build_affinity(job: dict) -> str:
+    """What a job's DerivedData is warm for: its branch, scheme, destinations and configuration."""
+    xcodebuild_args = job['xcodebuild_args']
+    destinations = job.get('test_destinations') or _xcodebuild_arg_values(xcodebuild_args, '-destination')
+    return json.dumps([
+        job.get('branch') or 'HEAD',
+        _xcodebuild_arg_values(xcodebuild_args, '-workspace') + _xcodebuild_arg_values(xcodebuild_args, '-project'),
+        _xcodebuild_arg_values(xcodebuild_args, '-scheme'),
+        sorted(destinations),
+        _xcodebuild_arg_values(xcodebuild_args, '-configuration'),
+    ], separators=(',', ':'))
+
+
+def _lease_job_worktree(job: dict) -> dict:
+    """Leases a worktree for the job (preferably one whose DerivedData last built the same branch, scheme, destination
+    and configuration), reset to its base commit (or the server checkout's HEAD if the server does not have that
+    commit), and points the job's build at it."""
+    commit = job.get('base_commit')
+    if not commit or not WORKTREE_POOL.has_commit(commit):
+        commit = _get_git_head(cwd)
+    if not commit:
+        raise WorktreeError('no commit to check out')
+    job['build_affinity'] = _job_build_affinity(job)
+    worktree = WORKTREE_POOL.lease(job.get('branch') or 'HEAD', commit, affinity=job['build_affinity'])
+    job['worktree'] = worktree['name']
+    job['worktree_commit'] = commit
+    job['workdir'] = worktree['project_dir']
+    job['derived_data_path'] = worktree['derived_data_path']
+    job['derived_data_warm'] = worktree['warm']
+    warmth = 'warm' if worktree['warm'] else 'cold'
+    job['output'].append(f"Building in worktree {worktree['name']} at {commit} ({warmth} DerivedData)\n".encode())
+    return worktree
+
+
+def _package_resolve_args(xcodebuild_args: list[str]) -> list[str]:
+    """The -workspace/-project/-scheme args of a build, which is all -resolvePackageDependencies needs."""
+    resolve_args = []
+    for flag in ['-workspace', '-project', '-scheme']:
+        for value in _xcodebuild_arg_values(xcodebuild_args, flag)[:1]:
+            resolve_args.extend([flag, value])
+    return resolve_args
+
+
+def _prepare_job_packages(job: dict) -> None:
+    """Points the job at the shared checkouts for its package state, resolving them first unless a prefetch already
+    did (or is doing) that.  Jobs that pass their own -clonedSourcePackagesDirPath are left alone."""
+    if _xcodebuild_arg_values(job['xcodebuild_args'], '-clonedSourcePackagesDirPath'):
+        return
+    project_dir = job.get('workdir') or cwd
+    key = PACKAGE_CACHE.package_key(project_dir)
+    if key is None:
+        return
+    job['packages_key'] = key
+    job['packages_path'] = PACKAGE_CACHE.acquire(key)
+    resolve_args = _package_resolve_args(job['xcodebuild_args'])
+    PACKAGE_CACHE.last_resolve_args = resolve_args
+    started = time.time()
+    #resolving runs as one of the job's processes, so cancelling or superseding the job stops it too
+    resolved, output = PACKAGE_CACHE.ensure(
+        project_dir, key, resolve_args,
+        spawn=lambda command: _spawn_job_process(job, command),
+        stopped=lambda: job.get('stop_status') is not None,
+    )
+    job['metrics']['packages_s'] = round(time.time() - started, 3)
+    job['packages_prefetched'] = not resolved and not output
+    if output:
+        job['output'].append(output.encode())
+    if job['packages_prefetched']:
+        job['output'].append(f'Swift packages ready ({key})\n'.encode())
+
+
+def _job_touches_packages(patch_path: Optional[str], staged_files: list[dict]) -> bool:
+    """Whether a build request changes a Package.swift or Package.resolved."""
+    if any(os.path.basename(entry['rel_path']) in PACKAGE_FILE_NAMES for entry in staged_files):
+        return True
+    if not patch_path or not os.path.exists(patch_path):
+        return False
+    with open(patch_path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'diff --git ') and any(f'/{name}'.encode() in line for name in PACKAGE_FILE_NAMES):
+                return True
+    return False
+
+
+PACKAGE_SCRATCH_LOCK = Lock()
+#the single scratch checkout in which queued jobs' package changes are resolved ahead of their builds, created on first
+#use (or the reason it could not be)
+PACKAGE_SCRATCH_STATE = {'pool': None, 'error': None}
+
+
+def _package_scratch_pool() -> Optional[WorktreePool]:
+    with PACKAGE_SCRATCH_LOCK:
+        if PACKAGE_SCRATCH_STATE['pool'] is None and PACKAGE_SCRATCH_STATE['error'] is None:
+            try:
+                PACKAGE_SCRATCH_STATE['pool'] = WorktreePool(cwd, os.path.join(UPLOAD_FOLDER, 'package-scratch'), 1)
+            except WorktreeError as e:
+                PACKAGE_SCRATCH_STATE['error'] = str(e)
+                print(f'Package prefetch for queued jobs disabled: {e}')
+        return PACKAGE_SCRATCH_STATE['pool']
+
+
+def prefetch_job_packages(job_id: str) -> None:
+    """Resolves the package state a queued job will build, in a scratch worktree at the job's base commit with its
+    package file changes applied, so the packages are ready by the time the job gets a build slot."""
+    job = JOBS.get(job_id)
+    scratch = _package_scratch_pool() if job is not None else None
+    if scratch is None:
+        return
+    commit = job.get('base_commit')
+    if not commit or not scratch.has_commit(commit):
+        commit = _get_git_head(cwd)
+    try:
+        worktree = scratch.lease('packages', commit)
+    except WorktreeError as e:
+        print(f'Package prefetch for job {job_id} skipped: {e}')
+        return
+    try:
+        project_dir = worktree['project_dir']
+        patch_path = job.get('patch_path')
+        if patch_path and os.path.exists(patch_path) and os.path.getsize(patch_path) > 0:
+            subprocess.run(['git', 'apply', patch_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=project_dir)
+        for entry in job.get('staged_files', []):
+            if os.path.basename(entry['rel_path']) in PACKAGE_FILE_NAMES and os.path.exists(entry['staged_path']):
+                destination_path = os.path.join(project_dir, os.path.relpath(entry['destination_path'], cwd))
+                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+                shutil.copyfile(entry['staged_path'], destination_path)
+        key = PACKAGE_CACHE.package_key(project_dir)
+        if key is not None:
+            resolved, output = PACKAGE_CACHE.ensure(project_dir, key, _package_resolve_args(job['xcodebuild_args']))
+            print_prefetch_result(f'job {job_id} ({key})', resolved, output)
+    finally:
+        scratch.release(worktree, key=None)
+
+
+def run_build_job(job_id: str) -> None:
+    job = JOBS[job_id]
+    job['started_at'] = time.time()
+    metrics = job.setdefault('metrics', {})
+    metrics['queue_wait_s'] = round(job['started_at'] - job['created_at'], 3)
+    worktree = None
+    try:
+        try:
+            #speculative builds build the server checkout itself, which is where synced changes land
+            if WORKTREE_POOL is not None and not job.get('speculative'):
+                worktree = _lease_job_worktree(job)
+            #keyed before the changes are applied, since that moves the staged files away
+            if BUILD_CACHE is not None:
+                job['build_key'] = _compute_build_key(job)
+            #applied even when the build is then replayed, so the checkout always holds what the client asked for
+            _apply_job_changes(job)
+            metrics['apply_s'] = round(time.time() - job['started_at'], 3)
+            if BUILD_CACHE is not None and _replay_job_from_cache(job):
+                return
+            if PACKAGE_CACHE is not None and job.get('stop_status') is None:
+                _prepare_job_packages(job)
+        except Exception as e:
+            job['status'] = 'error'
+            job['error'] = f'Failed to apply job changes: {e}'
+            job['output'].close()
+            job['events'].close()
+            return
+        if job.get('stop_status') is not None:
+            _set_job_stopped(job)
+            job['output'].close()
+            job['events'].close()
+            return
+        if job.get('test_shards'):
+            run_sharded_tests(job_id)
+        else:
+            run_xcodebuild(job_id, job['xcodebuild_args'])
+        _store_build_cache_entry(job)
+    finally:
+        if worktree is not None:
+            WORKTREE_POOL.release(worktree, affinity=job['build_affinity'])
+        if job.get('packages_key'):
+            PACKAGE_CACHE.release(job['packages_key'])
+        job['finished_at'] = time.time()
+        metrics['total_s'] = round(job['finished_at'] - job['created_at'], 3)
+        shutil.rmtree(_get_job_staging_dir(job_id), ignore_errors=True)
+        JOBS.save(job)
+        BUILD_SCHEDULER.finish(job_id)
+
+
+def _get_git_head(path: str) -> Optional[str]:
+    proc = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=path)
+    if proc.returncode != 0:
+        return None
+    return proc.stdout.decode('utf-8', errors='replace').strip() or None
+
+
+def _compute_build_key(job: dict) -> Optional[str]:
+    """Cache key for a job's inputs: the commit it builds on, the uploaded patch (the client's whole `git diff HEAD`),
+    the uploaded binary files and the xcodebuild args.  Speculative builds have no patch and are keyed on the tree they
+    snapshot instead.  Called when the job starts, before its changes are applied.  Returns None (not cached) when the
+    source state is not pinned down by those: no base commit, or, building in the server checkout, a checkout whose
+    HEAD is not the request's base commit."""
+    if job.get('speculative'):
+        source = {'speculative_tree': job.get('speculative_tree')}
+    else:
+        commit = job.get('worktree_commit') or job.get('base_commit')
+        if commit is None or (job.get('workdir') is None and _get_git_head(cwd) != commit):
+            return None
+        source = {'commit': commit}
+    patch_path = job.get('patch_path')
+    parts = {
+        'project': job['project_key'],
+        **source,
+        'patch_sha256': _file_sha256(patch_path) if patch_path and os.path.exists(patch_path) else None,
+        'binary_files': sorted([entry['rel_path'], _file_sha256(entry['staged_path'])] for entry in job['staged_files']),
+        'xcodebuild_args': [str(arg).strip() for arg in job['xcodebuild_args'] if str(arg).strip()],
+        'test_plan': [job.get('test_shards', 0), job.get('test_destinations', []), job.get('tests', [])],
+    }
+    return BuildCache.compute_key(parts)
+
+
+def _store_build_cache_entry(job: dict) -> None:
+    """Caches a build that ran xcodebuild to completion (successful or not).  Jobs that never got that far (bad args,
+    a patch that failed to apply, xcodebuild missing) are not cached."""
+    if BUILD_CACHE is None or not job.get('build_key') or 'exit_code' not in job:
+        return
+    try:
+        BUILD_CACHE.store(
+            job['build_key'],
+            {'status': job['status'], 'error': job['error'], 'exit_code': job['exit_code'], 'source_job_id': job['job_id']},
+            job['output'].log_path,
+            job['events'].log_path,
+        )
+    except OSError as e:
+        print(f"Failed to cache build result for job {job['job_id']}: {e}")
+
+
+def _replay_job_from_cache(job: dict) -> bool:
+    """Finishes a job that was keyed and had its changes applied from the cache entry of an identical build that
+    already ran, unless it asked for no_cache.  Returns True if the job was replayed."""
+    entry = BUILD_CACHE.lookup(job['build_key']) if job['build_key'] and not job.get('no_cache') else None
+    if entry is None:
+        return False
+    print(f"Replaying cached build {entry['source_job_id']} for job {job['job_id']}")
+    _replay_cached_build(job, entry)
+    return True
+
+
+def _replay_cached_build(job: dict, entry: dict) -> None:
+    """Fills a job from a cache entry: the stored log and events are replayed into its stores and it finishes with the
+    cached status instead of building."""
+    for store_key, path_key in [('output', 'log_path'), ('events', 'events_path')]:
+        store: BuildLogStore = job[store_key]
+        if os.path.exists(entry[path_key]):
+            with open(entry[path_key], 'rb') as f:
+                while True:
+                    chunk = f.read(build_pipe_read_size)
+                    if not chunk:
+                        break
+                    store.append(chunk)
+        store.close()
+    job['status'] = entry['status']
+    job['error'] = entry['error']
+    job['exit_code'] = entry['exit_code']
+    job['cached_from'] = entry['source_job_id']
+
+
+SPECULATIVE_LOCK = Lock()
+#the current speculative job, the pending debounce timer and the last real build request's plan (what to build next)
+SPECULATIVE_STATE = {'job_id': None, 'timer': None, 'appname': None, 'plan': None}
+
+
+def _job_build_plan(job: dict) -> dict:
+    """What a build request asks xcodebuild to do, apart from the source state."""
+    return {key: job[key] for key in ['xcodebuild_args', 'test_shards', 'test_destinations', 'tests']}
+
+
+def _remember_speculative_build_plan(appname: str, plan: dict) -> None:
+    with SPECULATIVE_LOCK:
+        SPECULATIVE_STATE['appname'] = appname
+        SPECULATIVE_STATE['plan'] = plan
+
+
+def _note_project_changes_landed(reason: str) -> None:
+    """Called after anything changes the server checkout (patches, uploaded files, git actions).  Starts resolving the
+    checkout's Swift packages if their state is new and, with speculative builds on, (re)arms a timer that starts a
+    speculative build once the changes stop for speculative_build_delay_s."""
+    if PACKAGE_CACHE is not None:
+        PACKAGE_CACHE.prefetch_async(cwd)
+    if not speculative_builds_enabled:
+        return
+    with SPECULATIVE_LOCK:
+        if SPECULATIVE_STATE['timer'] is not None:
+            SPECULATIVE_STATE['timer'].cancel()
+        timer = Timer(speculative_build_delay_s, _start_speculative_build, args=[reason])
+        timer.daemon = True
+        SPECULATIVE_STATE['timer'] = timer
+    timer.start()
+
+
+def _start_speculative_build(reason: str) -> None:
+    """Starts a low-priority build of the server checkout as it is now, with the last build request's args.  Any older
+    speculative build nobody attached to is superseded, since it built a state that no longer exists."""
+    with SPECULATIVE_LOCK:
+        SPECULATIVE_STATE['timer'] = None
+        plan = SPECULATIVE_STATE['plan']
+        appname = SPECULATIVE_STATE['appname']
+        old_job = JOBS.get(SPECULATIVE_STATE['job_id']) if SPECULATIVE_STATE['job_id'] else None
+    if plan is None:
+        return
+    tree = checkout_tree_id(cwd, os.path.join(UPLOAD_FOLDER, 'speculative'))
+    if tree is None:
+        print('Speculative build skipped: could not snapshot the project state')
+        return
+    if old_job is not None and old_job['speculative_tree'] == tree and _job_build_plan(old_job) == plan \
+            and old_job.get('stop_status') is None and old_job['status'] not in ['superseded', 'cancelled']:
+        #nothing actually changed (e.g. a read-only git action)
+        return
+    job_id = str(uuid4())
+    if old_job is not None and not old_job.get('speculative_attached'):
+        _stop_job(old_job, 'superseded', f'project changed again ({reason})', superseded_by=job_id)
+    job = _new_job_record(
+        job_id,
+        appname,
+        plan['xcodebuild_args'],
+        base_commit=_get_git_head(cwd),
+        priority=speculative_build_priority,
+        test_shards=plan['test_shards'],
+        test_destinations=plan['test_destinations'],
+        tests=plan['tests'],
+        speculative=True,
+        speculative_tree=tree,
+        speculative_reason=reason,
+        speculative_attached=False,
+    )
+    with SPECULATIVE_LOCK:
+        SPECULATIVE_STATE['job_id'] = job_id
+    print(f'Started speculative build {job_id} after {reason}')
+    BUILD_SCHEDULER.submit(job_id, project_key=job['project_key'], priority=speculative_build_priority)
+
+
+def _attach_speculative_build(plan: dict, base_commit: Optional[str], patch_path: str, staged_files: list[dict], priority: int) -> Optional[dict]:
+    """Returns the current speculative job if it builds what this request asks for (same plan, and the request's base
+    commit plus patch and binary files give the same tree as the checkout it builds), raising it to the request's
+    priority.  Otherwise a speculative job that is still queued or running is superseded and None is returned."""
+    with SPECULATIVE_LOCK:
+        job = JOBS.get(SPECULATIVE_STATE['job_id']) if SPECULATIVE_STATE['job_id'] else None
+        SPECULATIVE_STATE['job_id'] = None
+    if job is None or job.get('stop_status') is not None or job['status'] in ['superseded', 'cancelled']:
+        return None
+    request_tree = None
+    if _job_build_plan(job) == plan:
+        commit = base_commit or job['base_commit']
+        request_tree = request_tree_id(
+            cwd,
+            os.path.join(UPLOAD_FOLDER, 'speculative'),
+            commit,
+            patch_path,
+            [(entry['rel_path'], entry['staged_path']) for entry in staged_files],
+        ) if commit else None
+    if request_tree is None or request_tree != job['speculative_tree']:
+        _stop_job(job, 'superseded', 'the next build request did not match the speculative build')
+        return None
+    job['speculative_attached'] = True
+    if priority > job['priority']:
+        job['priority'] = priority
+        BUILD_SCHEDULER.replace(job['job_id'], job['job_id'], priority)
+    return job
+
+
+def _start_scheduled_job(job_id: str) -> None:
+    Thread(target=run_build_job, args=([job_id]), daemon=True).start()
+
+
+def _negotiate_build_log_compression(requested) -> Optional[str]:
+    """Picks the first compression the client listed that the server supports (None for an uncompressed stream)."""
+    if not isinstance(requested, list):
+        return None
+    for name in requested:
+        if name in build_log_compressions:
+            return name
+    return None
+
+
+def stream_build_log(conn: ssl.SSLSocket, store: BuildLogStore, offset: int = 0, compression: Optional[str] = None) -> None:
+    """Streams a job's raw output (or its event stream) to an authenticated socket, starting at byte offset (0 for a
+    fresh client, or the number of bytes already received when a client reconnects).  Each connection is its own
+    subscriber on the store, so any number of clients can follow one build and a slow one never holds up the build or the others.
+
+    With compression='zlib' the bytes go out as one zlib stream, sync-flushed after every send so the client can
+    decompress everything it has received without waiting for more, and finished once the log is complete.  offset
+    always counts uncompressed log bytes."""
+    subscriber = store.subscribe(offset)
+    compressor = zlib.compressobj(build_log_compression_level) if compression == 'zlib' else None
+    try:
+        while True:
+            # everything buffered past the subscriber's offset goes out in one send
+            chunk = subscriber.read(max_bytes=build_log_send_max_bytes)
+            if not chunk:
+                break
+            if compressor is not None:
+                chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            conn.sendall(chunk)
+        if compressor is not None:
+            conn.sendall(compressor.flush(zlib.Z_FINISH))
+    finally:
+        subscriber.close()
+
+
+def _route_build_log_connection(raw_conn: socket.socket, addr) -> None:
+    conn = None
+    try:
+        raw_conn.settimeout(socket_handshake_timeout_s)
+        conn = _wrap_server_tls_socket(raw_conn)
+        header = _authenticate_socket_handshake(conn, list(build_log_channel_stores.keys()))
+        job_id = str(header.get('session_id', ''))
+        job = JOBS.get(job_id)
+        if job is None:
+            _send_frame(conn, {'type': 'AUTH_ACK', 'ok': False, 'error': 'unknown job_id'})
+            return
+        try:
+            offset = max(0, int(header.get('offset', 0)))
+        except (TypeError, ValueError):
+            offset = 0
+        compression = _negotiate_build_log_compression(header.get('compression'))
+        _send_frame(conn, {'type': 'AUTH_ACK', 'ok': True, 'offset': offset, 'compression': compression})
+        # a client that stops reading is dropped after this long; it can reconnect from its offset
+        conn.settimeout(build_log_send_timeout_s)
+        channel = header['channel']
+        print(f'Received {channel} connection from {addr} for job {job_id} (offset {offset}, compression {compression})')
+        stream_build_log(conn, job[build_log_channel_stores[channel]], offset, compression)
     except Exception as e:
-        JOBS[job_id]['status'] = 'error'
-        JOBS[job_id]['error'] = str(e)
+        print(f'Build log connection from {addr} ended early: {e}')
     finally:
-        if log_write and not log_write.closed:
-            log_write.close()
         if conn:
             conn.close()
-        
+        else:
+            raw_conn.close()
+
+
+#socket channel -> the job store it streams
+build_log_channel_stores = {'build_log': 'output', 'build_events': 'events'}
+
+
+def start_build_log_dispatcher():
+    """Single acceptor for server_socket_port.  Each connection is authenticated on its own thread (so a slow TLS
+    handshake can't stall the others) and handed to the job named by its session_id."""
+    while True:
+        try:
+            raw_conn, addr = server.accept()
+        except OSError as e:
+            print(f'Build log accept failed: {e}')
+            continue
+        Thread(target=_route_build_log_connection, args=(raw_conn, addr), daemon=True).start()
+
+
+def _job_public_view(job: dict) -> dict:
+    """Returns the JSON-serializable part of a job record."""
+    view = {key: value for key, value in job.items() if key not in ['output', 'events', 'staged_files', 'processes']}
+    output = job.get('output')
+    if output is not None:
+        log_stats = output.stats()
+        view['log_size'] = log_stats['size']
+        view['log_subscribers'] = log_stats['subscribers']
+    events = job.get('events')
+    if events is not None:
+        view['events_size'] = events.size
+    view['queue_position'] = BUILD_SCHEDULER.queue_position(job['job_id'])
+    return view
+
+
+def prune_job_history():
+    """Applies job record and build log retention every job_prune_interval_s."""
+    while True:
+        try:
+            result = JOBS.prune()
+            if any(result.values()):
+                print(f'Pruned job history: {result}')
+        except Exception as e:
+            print(f'Job history pruning failed: {e}')
+        time.sleep(job_prune_interval_s)
+
+
+def warm_project_caches() -> None:
+    """Fills the metadata cache for the server checkout and resolves its Swift packages at startup, so the first query
+    or build does not wait on xcodebuild."""
+    if PACKAGE_CACHE is not None:
+        PACKAGE_CACHE.prefetch_async(cwd)
+    try:
+        PROJECT_METADATA.project_list(cwd)
+    except ProjectMetadataError as e:
+        print(f'Project metadata unavailable: {e}')
+
+
+BUILD_SCHEDULER = BuildScheduler(build_slots, start_job=_start_scheduled_job)
+WORKTREE_POOL = None
+if worktree_pool_enabled:
+    try:
+        WORKTREE_POOL = WorktreePool(
+            cwd,
+            os.path.join(UPLOAD_FOLDER, 'worktrees'),
+            worktree_pool_size,
+            derived_data_max_bytes=worktree_derived_data_max_bytes,
+        )
+    except WorktreeError as e:
+        print(f'Worktree pool disabled: {e}')
+PACKAGE_CACHE = PackageCache(
+    os.path.join(UPLOAD_FOLDER, 'packages'),
+    max_dirs=package_cache_max_dirs,
+    resolve_timeout_s=package_resolve_timeout_s,
+) if package_prefetch_enabled else None
+BLOB_STORE = BlobStore(os.path.join(UPLOAD_FOLDER, 'blobs'), max_bytes=blob_store_max_bytes) if blob_store_enabled else None
+PROJECT_METADATA = ProjectMetadataCache(
+    os.path.join(UPLOAD_FOLDER, 'project-metadata.json'),
+    command_timeout_s=project_metadata_timeout_s,
+    destinations_max_age_s=project_metadata_destinations_max_age_s,
+)
+TEST_DURATIONS = TestDurationHistory(os.path.join(UPLOAD_FOLDER, 'test-durations.json'))
+BUILD_CACHE = BuildCache(
+    os.path.join(UPLOAD_FOLDER, 'build-cache'),
+    max_entries=build_cache_max_entries,
+    max_bytes=build_cache_max_bytes,
+    max_age_s=build_cache_max_age_s,
+) if build_cache_enabled else None
+
+job_prune_thread = Thread(target=prune_job_history, args=[], daemon=True)
+job_prune_thread.start()
+project_caches_thread = Thread(target=warm_project_caches, args=[], daemon=True)
+project_caches_thread.start()
+
+# launch the single acceptor that routes build log sockets to their jobs
+build_log_dispatcher_thread = Thread(target=start_build_log_dispatcher, args=[], daemon=True)
+build_log_dispatcher_thread.start()
+# and the one that routes file transfer sockets to their transfer sessions
+file_socket_dispatcher_thread = Thread(target=start_file_socket_dispatcher, args=[], daemon=True)
+file_socket_dispatcher_thread.start()
+
 
 @app.route('/enable_pairing')
 def enable_pairing():
@@ -942,6 +2220,8 @@ def run_git_action(appname:str):
     result = execute_git_action(action, action_args, cwd=get_project_root_path())
     if 'command' not in result and not result.get('success', False):
         return jsonify(result), 400
+    if result.get('success', False):
+        _note_project_changes_landed(f'git {action}')
     return jsonify(result)
 
 
@@ -984,6 +2264,7 @@ def apply_patch_server(appname):
         print('Error: No patch path received from client')
         return 'Error: no patch path received from the client'
     apply_patch(patch_path)
+    _note_project_changes_landed('apply-patch-server')
     return 'successfully applied patch'
     
 
@@ -995,6 +2276,7 @@ def receive_changes(appname):
         git_apply_command = f'git apply {patch_path}'
         #run the git apply command
         os.system(git_apply_command)
+        _note_project_changes_landed('sendchanges')
     else:
         print('No diff file or empty diff file')
         return 'No diff file or empty diff file'
@@ -1002,6 +2284,63 @@ def receive_changes(appname):
 
 
 
+@app.route('/sendfiles/have/<appname>', methods=['POST'])
+def have_files(appname: str):
+    """First step of send_files: takes its manifest ({'files': [{'rel_path', 'size', 'sha256'}]}) and answers with the
+    rel_paths the server still wants.  Files already identical in the checkout are `present`; files whose content is in
+    the blob store are put in place from it (`materialized`).  Refused with 409 while a file transfer is active, and
+    counts as one itself until it is done, since materializing could replace a file a transfer is writing."""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('files'), list):
+        return jsonify({'ok': False, 'errors': ['Expected JSON object with a "files" list']}), 400
+    with SESSION_LOCK:
+        if _has_active_file_transfer_locked():
+            return jsonify({'ok': False, 'errors': ['Another file transfer is currently active']}), 409
+        HAVE_FILES_STATE['active'] += 1
+    try:
+        present, materialized, want, errors = _put_known_files_in_place(payload['files'])
+    finally:
+        with SESSION_LOCK:
+            HAVE_FILES_STATE['active'] -= 1
+    if materialized:
+        _note_project_changes_landed('sendfiles-have')
+    ok = len(errors) == 0
+    return jsonify({'ok': ok, 'present': present, 'materialized': materialized, 'want': want, 'errors': errors}), (200 if ok else 400)
+
+
+def _put_known_files_in_place(files: list) -> tuple[list[str], list[str], list[str], list[str]]:
+    """The work of /sendfiles/have, done while it counts as an active transfer.  Returns (present, materialized, want,
+    errors)."""
+    present = []
+    materialized = []
+    want = []
+    errors = []
+    for entry in files:
+        if not isinstance(entry, dict):
+            errors.append(f'Invalid manifest entry: {entry}')
+            continue
+        rel_path = unix_path(str(entry.get('rel_path', '')))
+        sha256 = str(entry.get('sha256', ''))
+        try:
+            destination_path = get_safe_project_path(rel_path)
+        except ValueError as e:
+            errors.append(f'Invalid rel_path "{rel_path}": {e}')
+            continue
+        #a checkout file still hardlinked to its blob is known to have that content without hashing it again
+        if BLOB_STORE is not None and os.path.isfile(destination_path) and BLOB_STORE.holds(sha256, destination_path):
+            BLOB_STORE.add(destination_path, sha256)
+            present.append(rel_path)
+        elif os.path.isfile(destination_path) and os.path.getsize(destination_path) == entry.get('size') and _file_sha256(destination_path) == sha256:
+            if BLOB_STORE is not None:
+                BLOB_STORE.add(destination_path, sha256)
+            present.append(rel_path)
+        elif BLOB_STORE is not None and not os.path.isdir(destination_path) and BLOB_STORE.materialize(sha256, destination_path):
+            materialized.append(rel_path)
+        else:
+            want.append(rel_path)
+    return present, materialized, want, errors
+
+
 @app.route('/sendfileshttp/<appname>', methods=['POST'])
 def receive_files_http(appname:str):
     saved_files = []
@@ -1026,6 +2365,9 @@ def receive_files_http(appname:str):
             errors.append(f'Destination path exists as a directory: {rel_path}')
             continue
 
+        #the old file may share its inode with a blob store entry, so it is replaced rather than overwritten
+        if os.path.isfile(destination_path):
+            os.remove(destination_path)
         file.save(destination_path)
         digest = hashlib.sha256()
         with open(destination_path, 'rb') as f:
@@ -1034,6 +2376,8 @@ def receive_files_http(appname:str):
                 if not chunk:
                     break
                 digest.update(chunk)
+        if BLOB_STORE is not None:
+            BLOB_STORE.add(destination_path, digest.hexdigest())
         saved_files.append(
             {
                 'rel_path': rel_path,
@@ -1044,6 +2388,8 @@ def receive_files_http(appname:str):
         )
     ok = len(errors) == 0
     status = 200 if ok else 400
+    if saved_files:
+        _note_project_changes_landed('sendfileshttp')
     return jsonify({'ok': ok, 'received_files': saved_files, 'errors': errors}), status
 
 
@@ -1056,7 +2402,7 @@ def init_receive_files_socket(appname:str):
 
     transfer_id = payload.get('transfer_id', '')
     files = payload.get('files', [])
-    chunk_size = int(payload.get('chunk_size', 64 * KB))
+    chunk_size = _negotiate_transfer_chunk_size(payload.get('chunk_size'))
     if not isinstance(transfer_id, str) or not transfer_id:
         return jsonify({'ok': False, 'errors': ['Field "transfer_id" is required and must be a string']}), 400
     if not isinstance(files, list) or not files:
@@ -1090,13 +2436,22 @@ def init_receive_files_socket(appname:str):
     if errors:
         return jsonify({'ok': False, 'transfer_id': transfer_id, 'errors': errors}), 400
 
-    if _has_active_file_transfer():
-        return jsonify({'ok': False, 'errors': ['Another file transfer is currently active']}), 409
+    window = _negotiate_transfer_window(payload.get('window'))
+    frame_version = _negotiate_frame_version(payload.get('frame_version'))
+    streams = _negotiate_transfer_streams(payload.get('streams'))
     with SESSION_LOCK:
+        if _has_active_file_transfer_locked():
+            return jsonify({'ok': False, 'errors': ['Another file transfer is currently active']}), 409
         TRANSFER_SESSIONS[transfer_id] = {
             'transfer_id': transfer_id,
             'status': 'initialized',
             'chunk_size': chunk_size,
+            'window': window,
+            'frame_version': frame_version,
+            'streams': streams,
+            'connected_streams': [],
+            'finished_streams': 0,
+            'assembler': RangeAssembler(),
             'expected': expected,
             'received': {},
             'errors': [],
@@ -1104,9 +2459,18 @@ def init_receive_files_socket(appname:str):
             'last_updated': time.time(),
         }
 
-    t = Thread(target=_handle_file_transfer_session, args=(transfer_id,), daemon=True)
-    t.start()
-    return jsonify({'ok': True, 'transfer_id': transfer_id, 'file_socket_port': file_socket_port, 'errors': []})
+    #the client now connects `streams` times to file_socket_port; start_file_socket_dispatcher hands each connection over
+    return jsonify(
+        {
+            'ok': True,
+            'transfer_id': transfer_id,
+            'file_socket_port': file_socket_port,
+            'window': window,
+            'frame_version': frame_version,
+            'streams': streams,
+            'errors': [],
+        }
+    )
 
 
 @app.route('/sendfilesfromserver/init/<appname>', methods=['POST'])
@@ -1118,7 +2482,7 @@ def init_send_files_from_server(appname: str):
 
     transfer_id = payload.get('transfer_id', '')
     paths = payload.get('paths', [])
-    chunk_size = int(payload.get('chunk_size', 64 * KB))
+    chunk_size = _negotiate_transfer_chunk_size(payload.get('chunk_size'))
     if not isinstance(transfer_id, str) or not transfer_id:
         return jsonify({'ok': False, 'errors': ['Field "transfer_id" is required and must be a string']}), 400
     if not isinstance(paths, list) or not paths:
@@ -1149,28 +2513,43 @@ def init_send_files_from_server(appname: str):
     if errors:
         return jsonify({'ok': False, 'transfer_id': transfer_id, 'errors': errors}), 400
 
+    window = _negotiate_transfer_window(payload.get('window'))
+    frame_version = _negotiate_frame_version(payload.get('frame_version'))
+    manifest = [
+        {'rel_path': rel_path, 'size': meta['size'], 'sha256': meta['sha256']}
+        for rel_path, meta in expected.items()
+    ]
+    #streams that would get nothing to send are not opened at all
+    stream_units = [units for units in assign_transfer_streams(manifest, _negotiate_transfer_streams(payload.get('streams'))) if units]
+    streams = len(stream_units)
     with SESSION_LOCK:
+        if _has_active_file_transfer_locked():
+            return jsonify({'ok': False, 'errors': ['Another file transfer is currently active']}), 409
         OUTBOUND_TRANSFER_SESSIONS[transfer_id] = {
             'transfer_id': transfer_id,
             'status': 'initialized',
             'chunk_size': chunk_size,
+            'window': window,
+            'frame_version': frame_version,
+            'streams': streams,
+            'stream_units': stream_units,
+            'connected_streams': [],
+            'finished_streams': 0,
             'expected': expected,
             'sent': {},
+            'confirmed_bytes': {},
             'errors': [],
             'created_at': time.time(),
             'last_updated': time.time(),
         }
-    t = Thread(target=send_files_from_server, args=(transfer_id,), daemon=True)
-    t.start()
-    manifest = [
-        {'rel_path': rel_path, 'size': meta['size'], 'sha256': meta['sha256']}
-        for rel_path, meta in expected.items()
-    ]
     return jsonify(
         {
             'ok': True,
             'transfer_id': transfer_id,
             'file_socket_port': file_socket_port,
+            'window': window,
+            'frame_version': frame_version,
+            'streams': streams,
             'files': manifest,
             'errors': [],
         }
@@ -1250,6 +2629,8 @@ def complete_receive_files_socket(appname:str):
         session['status'] = 'completed' if ok else 'error'
         session['last_updated'] = time.time()
         received_files = list(received_map.values())
+    if ok:
+        _note_project_changes_landed('sendfilessocket')
     status_code = 200 if ok else 400
     return jsonify({'ok': ok, 'received_files': received_files, 'errors': errors}), status_code
 
@@ -1270,6 +2651,41 @@ def receive_files_socket_legacy(appname:str):
     ), 410
 
 
+def _new_job_record(job_id: str, appname: str, xcodebuild_args: list[str], **fields) -> dict:
+    """Creates a pending job in JOBS with its build log and event stores; fields override the defaults.  The output
+    buffer owns the build log file handle and closes it when the build finishes."""
+    JOBS[job_id] = {
+        "job_id": job_id,
+        "status": "pending",
+        "error": None,
+        "output": BuildLogStore(os.path.join(UPLOAD_FOLDER, f'buildlog-{job_id}.txt'), memory_limit=build_log_memory_limit),
+        "events": BuildLogStore(os.path.join(UPLOAD_FOLDER, f'buildevents-{job_id}.jsonl'), memory_limit=build_events_memory_limit),
+        "appname": appname,
+        "xcodebuild_args": xcodebuild_args,
+        "patch_path": None,
+        "staged_files": [],
+        "project_key": cwd,
+        "branch": None,
+        "base_commit": None,
+        "priority": 0,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "build_key": None,
+        "no_cache": False,
+        "cached_from": None,
+        "superseded_by": None,
+        "test_shards": 0,
+        "test_destinations": [],
+        "tests": [],
+        "stop_status": None,
+        "stop_reason": None,
+        "speculative": False,
+        **fields,
+    }
+    return JOBS[job_id]
+
+
 @app.route('/start-build-job/<appname>', methods=['POST'])
 def start_build_job(appname):
     print(f'appname: {appname}')
@@ -1290,10 +2706,44 @@ def start_build_job(appname):
 
         print(f'request.files: {request.files}')
 
+        if not (file and allowed_filename(file.filename)):
+            return 'No file, or disallowed file type was uploaded'
+
+        job_id = str(uuid4())
+        if job_id in JOBS:
+            return f'<p>Already building {appname}, job_id: {job_id}</p>'
+
+        try:
+            priority = int(request.form.get('priority', 0))
+        except ValueError:
+            return jsonify({'ok': False, 'error': 'Field "priority" must be an integer'}), 400
+        no_cache = str(request.form.get('no_cache', '')).strip().lower() in ['1', 'true', 'yes']
+        coalesce = str(request.form.get('coalesce', build_coalesce_default)).strip().lower()
+        if coalesce not in build_coalesce_modes:
+            return jsonify({'ok': False, 'error': f'Field "coalesce" must be one of {build_coalesce_modes}'}), 400
+        #sharded test mode: test_shards > 0, one test_destinations entry per shard, optional tests (-only-testing ids)
+        try:
+            test_shards = min(max(0, int(request.form.get('test_shards', 0))), test_max_shards)
+        except ValueError:
+            return jsonify({'ok': False, 'error': 'Field "test_shards" must be an integer'}), 400
+        test_destinations = [dest for dest in request.form.getlist('test_destinations') if dest.strip()]
+        tests = [test_id.strip() for test_id in request.form.getlist('tests') if test_id.strip()]
+        branch = str(request.form.get('branch', '')).strip() or None
+        base_commit = str(request.form.get('base_commit', '')).strip() or None
+        #with a worktree pool only builds of the same branch share (and so serialize on) a checkout
+        project_key = f'{cwd}#{branch or "HEAD"}' if WORKTREE_POOL is not None else cwd
+        if test_shards and not test_destinations:
+            return jsonify({'ok': False, 'error': 'test_shards needs at least one test_destinations entry'}), 400
+
+        #Nothing touches the worktree here.  The diff and any binary files are staged per job, and only applied once the
+        #scheduler hands the job a build slot, so two builds never apply changes into the same project at the same time
+        staging_dir = _get_job_staging_dir(job_id)
+        os.makedirs(staging_dir, exist_ok=True)
+
         #there are are additional file(s) besides the diff.  This means the client sent binary files
-        #we need to save these files to their paths (path is the first item of the tuple)
-        # for i in range(1, len(request.files.keys())):
-        for file_key in request.files.keys():
+        #we need to stage these files for their paths (path is the first item of the tuple)
+        staged_files = []
+        for i, file_key in enumerate(request.files.keys()):
             if file_key == 'gitdiff':
                 continue
             binary_file = request.files[file_key]
@@ -1301,53 +2751,54 @@ def start_build_job(appname):
             #used as the value in the files dict sent by the requests library (from the client).  And for the binary files, I am
             #passing the path in the 0th index instead of the filename, because I need to save the files in the same relative locations
             rel_path = unix_path(binary_file.filename)
-            binary_file_name = rel_path.split('/')[-1]
             path = get_safe_project_path(rel_path)
-            parent_dir = os.path.dirname(path)
-            if parent_dir and not os.path.exists(parent_dir):
-                os.makedirs(parent_dir, exist_ok=True)
-            if os.path.exists(path):
-                if os.path.isfile(path):
-                    #If the path exists and IS a a file, simply remove it, since FileStorage.save does not overwrite files apparently
-                    os.remove(path)
-                else:
-                    print(f'Path given for changed or added binary file {binary_file_name}: {path}, already exists as a directory')
-                    print("Honestly, that's just really strange.  Idk")
-
-            binary_file.save(path)
-
-
-
-        if file and allowed_filename(file.filename):
-            #create a secure version of the filename
-            filename = secure_filename(file.filename)
-            #save the file with the secure filename in UPLOAD_FOLDER
-            file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-
-            patch_path = f'{app.config["UPLOAD_FOLDER"]}/{filename}'
-            if os.path.getsize(patch_path) > 0:
-                git_apply_command = f'git apply {patch_path}'
-                #run the git apply command
-                os.system(git_apply_command)
-
-
-            job_id = str(uuid4())
-            if job_id in JOBS.keys():
-                return f'<p>Already building {appname}, job_id: {job_id}</p>'
-
-            build_log_name:str = f'buildlog-{job_id}.txt'
-            build_log_path:str = os.path.join(UPLOAD_FOLDER, build_log_name)
-
-            #Create the new job object and put it in job_id in the JOBS dict.
-            #We have to be careful to ensure the file gets closed
-            build_log_file = open(build_log_path, 'w')
-            JOBS[job_id] = {"status": "pending", "result": '', "error": None, "file": build_log_file}
+            staged_path = os.path.join(staging_dir, f'binaryfile{i}')
+            binary_file.save(staged_path)
+            staged_files.append({'rel_path': rel_path, 'staged_path': staged_path, 'destination_path': path})
+
+        #create a secure version of the filename and save the diff with it in the job's staging dir
+        filename = secure_filename(file.filename)
+        patch_path = unix_path(os.path.join(staging_dir, filename))
+        file.save(patch_path)
+
+        build_plan = {'xcodebuild_args': xcodebuild_args, 'test_shards': test_shards, 'test_destinations': test_destinations, 'tests': tests}
+        if speculative_builds_enabled:
+            _remember_speculative_build_plan(appname, build_plan)
+            #a speculative build of exactly this state (already synced to the server checkout) is adopted by the request
+            speculative_job = None if no_cache else _attach_speculative_build(build_plan, base_commit, patch_path, staged_files, priority)
+            if speculative_job is not None:
+                print(f"Attaching build request to speculative job {speculative_job['job_id']}")
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                return jsonify({
+                    "job_id": speculative_job['job_id'],
+                    "queue_position": BUILD_SCHEDULER.queue_position(speculative_job['job_id']),
+                    "speculative": True,
+                }), 202
+
+        job = _new_job_record(
+            job_id,
+            appname,
+            xcodebuild_args,
+            patch_path=patch_path,
+            staged_files=staged_files,
+            project_key=project_key,
+            branch=branch,
+            base_commit=base_commit,
+            priority=priority,
+            test_shards=test_shards,
+            test_destinations=test_destinations,
+            tests=tests,
+            no_cache=no_cache,
+        )
 
-            t = Thread(target=run_xcodebuild, args=([job_id, xcodebuild_args]), daemon=True)
-            t.start()
-            return jsonify({"job_id": job_id}), 202
-        else:
-            return 'No file, or disallowed file type was uploaded'
+        #the job starts as soon as a build slot (and its project) is free; the log socket attaches to the job's output
+        #whenever the client connects
+        if PACKAGE_CACHE is not None and _job_touches_packages(patch_path, staged_files):
+            Thread(target=prefetch_job_packages, args=[job_id], daemon=True).start()
+        took_queue_entry, superseded = _coalesce_project_jobs(job, coalesce)
+        if not took_queue_entry:
+            BUILD_SCHEDULER.submit(job_id, project_key=project_key, priority=priority)
+        return jsonify({"job_id": job_id, "queue_position": BUILD_SCHEDULER.queue_position(job_id), "superseded": superseded}), 202
     else:
         return "Some other method besides POST or GET was used.  Don't do that"
         
@@ -1364,30 +2815,59 @@ def send_changed_file_paths(appname:str, scope:str) -> Response:
 
 @app.route('/checkprogress/<job_id>/<offset>')
 def check_progress(job_id:str, offset:int) -> Response:
-    job = JOBS[job_id]
+    job = JOBS.get(job_id)
+    if job is None:
+        return 'Error: build job does not exist.'
     if job['status'] == 'done':
         return 'Build already Complete'
     elif job['status'] == 'error':
         return f"Job status returned error.  Error message: {job['error']}"
 
-    build_log_path = get_build_log_path(job_id)
-    if not os.path.exists(build_log_path):
-        return 'Error: build job does not exist.'
-    with open(build_log_path, 'r') as f:
-        if f.seekable():
-            f.seek(int(offset), 0)
-        else:
-            f.read(offset)
-        new_text = f.read()
-
-    job['result'] += new_text
-    return jsonify({'job_id': job_id, 'status': 'pending', 'newtext': new_text, 'result': job['result']})
-
-
-
-
-
-
+    #only the bytes past offset are returned; the full log is never accumulated in the job record
+    try:
+        offset = max(0, int(offset))
+    except ValueError:
+        offset = 0
+    new_bytes = job['output'].read_available(offset, max_bytes=tail_max_bytes_limit)
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'newtext': new_bytes.decode('utf-8', errors='replace'),
+        'next_offset': offset + len(new_bytes),
+    })
+
+
+@app.route('/tail/<job_id>')
+def tail_build_log(job_id:str) -> Response:
+    """Incremental build log tail.  Returns the raw log bytes starting at ?offset= (up to ?max_bytes=), holding the
+    request for up to ?wait= seconds until new output arrives.  Position and job state are returned in headers so the
+    body is exactly the log bytes.  ?stream=events tails the job's JSON-lines event stream instead."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        max_bytes = min(max(1, int(request.args.get('max_bytes', tail_default_max_bytes))), tail_max_bytes_limit)
+        wait_s = min(max(0.0, float(request.args.get('wait', 0))), tail_max_wait_s)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'offset, max_bytes and wait must be numbers'}), 400
+    stream = request.args.get('stream', 'log')
+    if stream not in ['log', 'events']:
+        return jsonify({'ok': False, 'error': "stream must be 'log' or 'events'"}), 400
+
+    store: BuildLogStore = job['output'] if stream == 'log' else job['events']
+    if wait_s > 0:
+        store.wait_for(offset, timeout=wait_s)
+    data = store.read_available(offset, max_bytes=max_bytes)
+    next_offset = offset + len(data)
+    headers = {
+        'X-RXS-Offset': str(offset),
+        'X-RXS-Next-Offset': str(next_offset),
+        'X-RXS-Log-Size': str(store.size),
+        'X-RXS-Job-Status': str(job['status']),
+        'X-RXS-Complete': '1' if store.at_eof(next_offset) else '0',
+    }
+    return Response(data, mimetype='application/octet-stream', headers=headers)
 
 
 @app.route('/status/<job_id>')
@@ -1397,12 +2877,125 @@ def job_status(job_id):
     job = JOBS.get(job_id)
     if not job:
         return jsonify("error", "job not found"), 404
-    return jsonify(job)
+    return jsonify(_job_public_view(job))
 
     
 
 
 
+@app.route('/queue')
+def build_queue():
+    return jsonify({'ok': True, **BUILD_SCHEDULER.snapshot()})
+
+
+@app.route('/cancel/<job_id>', methods=['POST'])
+def cancel_build_job(job_id: str) -> Response:
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
+    if not _stop_job(job, 'cancelled', 'cancelled by client'):
+        return jsonify({'ok': False, 'error': f"job already finished with status {job['status']}", 'status': job['status']}), 409
+    return jsonify({'ok': True, 'job_id': job_id, 'status': job['status']})
+
+
+def _summarize_metric(values: list[float]) -> dict:
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'avg': round(sum(values) / len(values), 3),
+        'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+
+@app.route('/stats')
+def build_stats():
+    """Aggregated build metrics over the most recently finished jobs (?limit=, default 200)."""
+    try:
+        limit = min(max(1, int(request.args.get('limit', 200))), 5000)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'limit must be an integer'}), 400
+    records = JOBS.recent_records(limit)
+    status_counts: dict[str, int] = {}
+    metric_values: dict[str, list[float]] = {}
+    for record in records:
+        status_counts[record['status']] = status_counts.get(record['status'], 0) + 1
+        for name, value in (record.get('metrics') or {}).items():
+            if name == 'phases_s':
+                for phase, seconds in value.items():
+                    metric_values.setdefault(f'phase_{phase}_s', []).append(seconds)
+            elif isinstance(value, (int, float)):
+                metric_values.setdefault(name, []).append(value)
+    return jsonify({
+        'ok': True,
+        'jobs': len(records),
+        'statuses': status_counts,
+        'metrics': {name: _summarize_metric(values) for name, values in sorted(metric_values.items())},
+    })
+
+
+@app.route('/jobs')
+def job_history_stats():
+    return jsonify({'ok': True, **JOBS.stats()})
+
+
+@app.route('/worktrees')
+def worktree_pool_status():
+    if WORKTREE_POOL is None:
+        return jsonify({'ok': True, 'enabled': False})
+    return jsonify({'ok': True, 'enabled': True, **WORKTREE_POOL.snapshot()})
+
+
+@app.route('/blobs')
+def blob_store_stats():
+    if BLOB_STORE is None:
+        return jsonify({'ok': True, 'enabled': False})
+    return jsonify({'ok': True, 'enabled': True, **BLOB_STORE.stats()})
+
+
+@app.route('/packages')
+def package_cache_stats():
+    if PACKAGE_CACHE is None:
+        return jsonify({'ok': True, 'enabled': False})
+    return jsonify({'ok': True, 'enabled': True, **PACKAGE_CACHE.stats()})
+
+
+@app.route('/project_metadata')
+def project_metadata():
+    """Schemes, targets and configurations of the server checkout's project (?workspace= or ?project= to pick one),
+    plus build settings (?scheme=, optional ?configuration=) and destinations (?scheme=&destinations=1).  Answers come
+    from the metadata cache unless the project files changed or ?refresh=1."""
+    container_args = []
+    for flag in ['workspace', 'project']:
+        value = str(request.args.get(flag, '')).strip()
+        if value:
+            if not is_subdir(os.path.join(cwd, value), cwd):
+                return jsonify({'ok': False, 'error': f'{flag} must be inside the project'}), 400
+            container_args.extend([f'-{flag}', value])
+    scheme = str(request.args.get('scheme', '')).strip()
+    configuration = str(request.args.get('configuration', '')).strip() or None
+    refresh = str(request.args.get('refresh', '')).strip() in ['1', 'true', 'yes']
+    try:
+        result = PROJECT_METADATA.project_list(cwd, container_args, refresh=refresh)
+        if scheme:
+            result['build_settings'] = PROJECT_METADATA.build_settings(cwd, scheme, configuration, container_args)
+            if str(request.args.get('destinations', '')).strip() in ['1', 'true', 'yes']:
+                result['destinations'] = PROJECT_METADATA.destinations(cwd, scheme, container_args)
+    except ProjectMetadataError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    return jsonify({'ok': True, **result})
+
+
+@app.route('/build_cache')
+def build_cache_stats():
+    if BUILD_CACHE is None:
+        return jsonify({'ok': True, 'enabled': False})
+    return jsonify({'ok': True, 'enabled': True, **BUILD_CACHE.stats()})
+
+
 @app.route('/')
 def hello_world():
     return 'Hello, World!'
@@ -0,0 +1,96 @@
+import os, shutil, subprocess, time
+from typing import Optional
+
+
+#the client never sends .gitignore changes (and both sides rewrite it), so it is left out of every compared tree
+TREE_IGNORED_PATHS = ['.gitignore']
+
+
+def _git(args: list[str], cwd: str, index_path: Optional[str], input_path: Optional[str] = None,
+         object_dirs: Optional[tuple[str, str]] = None) -> Optional[str]:
+    """object_dirs=(scratch_dir, repo_objects_dir) makes git write new objects to scratch_dir while still reading the
+    repository's own objects."""
+    env = {key: value for key, value in os.environ.items() if key not in ['GIT_INDEX_FILE', 'GIT_OBJECT_DIRECTORY', 'GIT_ALTERNATE_OBJECT_DIRECTORIES']}
+    if index_path:
+        env['GIT_INDEX_FILE'] = index_path
+    if object_dirs:
+        env['GIT_OBJECT_DIRECTORY'], env['GIT_ALTERNATE_OBJECT_DIRECTORIES'] = object_dirs
+    stdin = open(input_path, 'rb') if input_path else subprocess.DEVNULL
+    try:
+        proc = subprocess.run(['git', *args], stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=cwd, env=env)
+    finally:
+        if input_path:
+            stdin.close()
+    if proc.returncode != 0:
+        return None
+    return proc.stdout.decode('utf-8', errors='replace').strip()
+
+
+def _write_tree(repo_dir: str, index_path: str, object_dirs: tuple[str, str]) -> Optional[str]:
+    if _git(['rm', '--cached', '-q', '--ignore-unmatch', '--', *TREE_IGNORED_PATHS], repo_dir, index_path, object_dirs=object_dirs) is None:
+        return None
+    return _git(['write-tree'], repo_dir, index_path, object_dirs=object_dirs) or None
+
+
+def _scratch_index_path(scratch_dir: str) -> str:
+    os.makedirs(scratch_dir, exist_ok=True)
+    return os.path.join(scratch_dir, f'index-{os.getpid()}-{time.monotonic_ns()}')
+
+
+def _scratch_object_dirs(repo_dir: str, index_path: str) -> Optional[tuple[str, str]]:
+    """A throwaway object directory next to index_path (removed with it) in front of the repository's own, so the
+    blobs and trees written only to compute a tree id never land in the repository."""
+    repo_objects_dir = _git(['rev-parse', '--git-path', 'objects'], repo_dir, None)
+    if not repo_objects_dir:
+        return None
+    object_dir = f'{index_path}.objects'
+    os.makedirs(object_dir, exist_ok=True)
+    return object_dir, os.path.join(repo_dir, repo_objects_dir)
+
+
+def _remove_scratch(index_path: str) -> None:
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    shutil.rmtree(f'{index_path}.objects', ignore_errors=True)
+
+
+def checkout_tree_id(repo_dir: str, scratch_dir: str) -> Optional[str]:
+    """Git tree id of everything in the checkout at repo_dir (tracked changes and untracked, non-ignored files), written
+    through a scratch index and object directory so the checkout's own index and objects are left alone.  None if git
+    fails."""
+    index_path = _scratch_index_path(scratch_dir)
+    try:
+        object_dirs = _scratch_object_dirs(repo_dir, index_path)
+        if object_dirs is None:
+            return None
+        #starting from a copy of the real index lets git skip rehashing files whose stat info has not changed
+        real_index_path = _git(['rev-parse', '--git-path', 'index'], repo_dir, None)
+        if real_index_path:
+            real_index_path = os.path.join(repo_dir, real_index_path)
+            if os.path.exists(real_index_path):
+                shutil.copyfile(real_index_path, index_path)
+        if _git(['add', '-A', '--', ':/'], repo_dir, index_path, object_dirs=object_dirs) is None:
+            return None
+        return _write_tree(repo_dir, index_path, object_dirs)
+    finally:
+        _remove_scratch(index_path)
+
+
+def request_tree_id(repo_dir: str, scratch_dir: str, base_commit: str, patch_path: Optional[str], binary_files: list[tuple[str, str]]) -> Optional[str]:
+    """Git tree id of base_commit with a build request's patch applied and its binary files ([(rel_path, local_path)])
+    added, computed entirely in a scratch index and object directory.  None if the patch does not apply or git fails."""
+    index_path = _scratch_index_path(scratch_dir)
+    try:
+        object_dirs = _scratch_object_dirs(repo_dir, index_path)
+        if object_dirs is None or _git(['read-tree', base_commit], repo_dir, index_path, object_dirs=object_dirs) is None:
+            return None
+        if patch_path and os.path.exists(patch_path) and os.path.getsize(patch_path) > 0:
+            if _git(['apply', '--cached', patch_path], repo_dir, index_path, object_dirs=object_dirs) is None:
+                return None
+        for rel_path, local_path in binary_files:
+            blob_id = _git(['hash-object', '-w', '--stdin'], repo_dir, index_path, input_path=local_path, object_dirs=object_dirs)
+            if not blob_id or _git(['update-index', '--add', '--cacheinfo', f'100644,{blob_id},{rel_path}'], repo_dir, index_path, object_dirs=object_dirs) is None:
+                return None
+        return _write_tree(repo_dir, index_path, object_dirs)
+    finally:
+        _remove_scratch(index_path)
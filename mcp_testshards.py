@@ -0,0 +1,92 @@
+import os, json, heapq
+from threading import Lock
+from typing import Optional
+
+
+class TestDurationHistory:
+    """Per-project test durations (seconds, exponentially averaged over runs), persisted as JSON.  Keys are
+    -only-testing identifiers: Target/Class/method."""
+
+    def __init__(self, path: str, smoothing: float = 0.5):
+        self.path = path
+        self.smoothing = smoothing
+        self._lock = Lock()
+        self._durations: dict[str, dict[str, float]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self._durations = json.load(f)
+            except (OSError, ValueError):
+                self._durations = {}
+
+    def known_tests(self, project_key: str) -> list[str]:
+        with self._lock:
+            return sorted(self._durations.get(project_key, {}).keys())
+
+    def estimate(self, project_key: str, test_id: str, default_s: float) -> float:
+        """Expected duration of a test, or of every known test under a Target or Target/Class identifier."""
+        with self._lock:
+            durations = self._durations.get(project_key, {})
+            if test_id in durations:
+                return durations[test_id]
+            prefix = f'{test_id}/'
+            matching = [seconds for known_id, seconds in durations.items() if known_id.startswith(prefix)]
+        return sum(matching) if matching else default_s
+
+    def record(self, project_key: str, test_durations: dict[str, float]) -> None:
+        if not test_durations:
+            return
+        with self._lock:
+            durations = self._durations.setdefault(project_key, {})
+            for test_id, seconds in test_durations.items():
+                previous = durations.get(test_id)
+                durations[test_id] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._durations, f)
+            os.replace(tmp_path, self.path)
+
+
+def split_into_shards(test_ids: list[str], shard_count: int, estimate) -> list[tuple[list[str], float]]:
+    """Greedy longest-first split: each test goes to the shard with the least expected time so far.  estimate(test_id)
+    returns a test's expected seconds.  Returns [(test_ids, expected_s)] with empty shards dropped."""
+    shard_count = max(1, min(int(shard_count), len(test_ids)))
+    weighted = sorted(((estimate(test_id), test_id) for test_id in test_ids), reverse=True)
+    heap = [(0.0, i) for i in range(shard_count)]
+    shards: list[list[str]] = [[] for _ in range(shard_count)]
+    totals = [0.0] * shard_count
+    for seconds, test_id in weighted:
+        total, i = heapq.heappop(heap)
+        shards[i].append(test_id)
+        totals[i] = total + seconds
+        heapq.heappush(heap, (totals[i], i))
+    return [(shard, round(totals[i], 3)) for i, shard in enumerate(shards) if shard]
+
+
+def test_id_from_event(event: dict) -> Optional[str]:
+    """-only-testing identifier for an XCTest case event ('DemoTests.DemoTests' + 'testFoo' -> 'DemoTests/DemoTests/testFoo')."""
+    suite = event.get('suite')
+    if not suite or not event.get('test'):
+        return None
+    return f"{suite.replace('.', '/')}/{event['test']}"
+
+
+def parse_enumerated_tests(enumeration: object) -> list[str]:
+    """Best-effort walk of `xcodebuild -enumerate-tests -test-enumeration-format json` output: collects the identifiers
+    of leaf nodes that look like Target/Class/method."""
+    found: list[str] = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for child in node:
+                walk(child)
+        elif isinstance(node, dict):
+            children = node.get('children')
+            identifier = node.get('identifier')
+            if not children and isinstance(identifier, str) and identifier.count('/') >= 2:
+                found.append(identifier)
+            for value in node.values():
+                if isinstance(value, (list, dict)):
+                    walk(value)
+    walk(enumeration)
+    return sorted(set(found))
@@ -0,0 +1,71 @@
+import os, heapq
+from threading import Lock
+from typing import BinaryIO
+
+
+#files are only cut into ranges when every range gets at least this many bytes
+TRANSFER_RANGE_MIN_BYTES = 32 * 1024 * 1024
+
+
+def assign_transfer_streams(files: list[dict], streams: int, range_min_bytes: int = TRANSFER_RANGE_MIN_BYTES) -> list[list[dict]]:
+    """Spreads files (dicts with 'rel_path' and 'size') over streams so that each stream carries about the same number of
+    bytes, largest first.  Every unit is a copy of its file dict with 'offset' and 'length'; a file with room for several
+    ranges of range_min_bytes is cut into up to `streams` of them, so one large file keeps every connection busy."""
+    streams = max(1, int(streams))
+    units = []
+    for entry in files:
+        size = int(entry['size'])
+        parts = max(1, min(streams, size // range_min_bytes)) if range_min_bytes > 0 else 1
+        for part in range(parts):
+            offset = size * part // parts
+            units.append({**entry, 'offset': offset, 'length': size * (part + 1) // parts - offset})
+    assigned: list[list[dict]] = [[] for _ in range(streams)]
+    #(bytes, units, stream): empty streams are filled before any stream gets a second unit, even of zero-size files
+    loads = [(0, 0, stream) for stream in range(streams)]
+    for unit in sorted(units, key=lambda unit: unit['length'], reverse=True):
+        load, count, stream = heapq.heappop(loads)
+        assigned[stream].append(unit)
+        heapq.heappush(loads, (load + unit['length'], count + 1, stream))
+    return assigned
+
+
+def is_range(unit: dict) -> bool:
+    return unit['length'] != unit['size']
+
+
+class RangeAssembler:
+    """Files that arrive as byte ranges, possibly over several connections at once.  Each range is written at its offset
+    into the file's temp path; finish_range() says when every byte of a file is in, so the caller can hash and move it."""
+
+    def __init__(self):
+        self._lock = Lock()
+        #temp_path -> bytes received so far
+        self._received: dict[str, int] = {}
+
+    def open_range(self, temp_path: str, size: int, offset: int) -> BinaryIO:
+        with self._lock:
+            if temp_path not in self._received:
+                with open(temp_path, 'wb') as f:
+                    f.truncate(size)
+                self._received[temp_path] = 0
+        handle = open(temp_path, 'r+b')
+        handle.seek(offset)
+        return handle
+
+    def finish_range(self, temp_path: str, length: int, size: int) -> bool:
+        with self._lock:
+            received = self._received.get(temp_path, 0) + length
+            if received < size:
+                self._received[temp_path] = received
+                return False
+            self._received.pop(temp_path, None)
+            return True
+
+    def discard_all(self) -> None:
+        """Removes the temp files of files that never completed (a range failed or never arrived)."""
+        with self._lock:
+            temp_paths = list(self._received)
+            self._received.clear()
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,223 @@
+import os, json, shutil, subprocess, time
+from threading import Condition, Thread
+from typing import Optional
+
+
+class WorktreeError(Exception):
+    pass
+
+
+class WorktreePool:
+    """A pool of `git worktree` checkouts of one repository, each with its own DerivedData, so builds for different
+    branches never share a working tree.
+
+    lease(key, commit, affinity) hands out an idle worktree, creating one while the pool is below max_worktrees and
+    blocking when every worktree is leased.  It prefers the worktree whose DerivedData last built the same affinity
+    (branch, scheme, destination and configuration), then the one last used for the same key (branch), so incremental
+    build products stay warm.  The worktree is hard-reset to commit and cleaned of untracked files before it is
+    returned.  release() puts it back and records the affinity.
+
+    When the DerivedData of all worktrees grows past derived_data_max_bytes, the DerivedData of the least recently used
+    idle worktrees is deleted (and their affinities forgotten).  Affinities and last keys are kept in state.json so they
+    survive a restart."""
+
+    def __init__(self, repo_dir: str, pool_dir: str, max_worktrees: int, derived_data_max_bytes: int = 0):
+        self.repo_dir = repo_dir
+        self.pool_dir = pool_dir
+        self.max_worktrees = max(1, int(max_worktrees))
+        self.derived_data_max_bytes = max(0, int(derived_data_max_bytes))
+        self.state_path = os.path.join(pool_dir, 'state.json')
+        self._cond = Condition()
+        self._worktrees: dict[str, dict] = {}
+        #affinity -> {'worktree': name, 'last_used_at': seconds}
+        self._affinities: dict[str, dict] = {}
+        self._evicted_bytes = 0
+        os.makedirs(pool_dir, exist_ok=True)
+        self._git(['worktree', 'prune'], cwd=repo_dir)
+        #the project may live in a subdirectory of the repository; builds run in the same subdirectory of each worktree
+        self.project_prefix = self._git(['rev-parse', '--show-prefix'], cwd=repo_dir).strip()
+        for name in sorted(os.listdir(pool_dir)):
+            path = os.path.join(pool_dir, name, 'checkout')
+            if os.path.exists(os.path.join(path, '.git')):
+                self._worktrees[name] = self._new_record(name, path)
+        self._load_state()
+
+    def _load_state(self) -> None:
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        for name, saved in state.get('worktrees', {}).items():
+            worktree = self._worktrees.get(name)
+            if worktree is not None:
+                worktree['last_key'] = saved.get('last_key')
+                worktree['last_used_at'] = saved.get('last_used_at', 0.0)
+        self._affinities = {
+            affinity: entry for affinity, entry in state.get('affinities', {}).items() if entry.get('worktree') in self._worktrees
+        }
+        for worktree in self._worktrees.values():
+            worktree['derived_data_bytes'] = _dir_size(worktree['derived_data_path'])
+
+    def _save_state_locked(self) -> None:
+        state = {
+            'worktrees': {
+                name: {'last_key': worktree['last_key'], 'last_used_at': worktree['last_used_at']}
+                for name, worktree in self._worktrees.items()
+            },
+            'affinities': self._affinities,
+        }
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _new_record(self, name: str, path: str) -> dict:
+        return {
+            'name': name,
+            'path': path,
+            'project_dir': os.path.join(path, self.project_prefix) if self.project_prefix else path,
+            'derived_data_path': os.path.join(self.pool_dir, name, 'DerivedData'),
+            'leased': False,
+            'last_key': None,
+            'last_used_at': 0.0,
+            'derived_data_bytes': 0,
+            'warm': False,
+        }
+
+    def _git(self, args: list[str], cwd: str) -> str:
+        proc = subprocess.run(['git', *args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+        if proc.returncode != 0:
+            raise WorktreeError(f"git {' '.join(args)} failed: {proc.stdout.decode('utf-8', errors='replace').strip()}")
+        return proc.stdout.decode('utf-8', errors='replace')
+
+    def has_commit(self, commit: str) -> bool:
+        proc = subprocess.run(['git', 'cat-file', '-e', f'{commit}^{{commit}}'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=self.repo_dir)
+        return proc.returncode == 0
+
+    def _pick_locked(self, key: str, affinity: Optional[str]) -> Optional[dict]:
+        idle = [worktree for worktree in self._worktrees.values() if not worktree['leased']]
+        warm = self._affinities.get(affinity) if affinity else None
+        if warm is not None:
+            worktree = self._worktrees.get(warm['worktree'])
+            if worktree is not None and not worktree['leased']:
+                return worktree
+        for worktree in idle:
+            if worktree['last_key'] == key:
+                return worktree
+        if len(self._worktrees) < self.max_worktrees:
+            name = f'wt-{len(self._worktrees)}'
+            while name in self._worktrees:
+                name = f'{name}-'
+            worktree = self._new_record(name, os.path.join(self.pool_dir, name, 'checkout'))
+            self._worktrees[name] = worktree
+            return worktree
+        if idle:
+            return min(idle, key=lambda worktree: worktree['last_used_at'])
+        return None
+
+    def lease(self, key: str, commit: str, affinity: Optional[str] = None) -> dict:
+        with self._cond:
+            while True:
+                worktree = self._pick_locked(key, affinity)
+                if worktree is not None:
+                    break
+                self._cond.wait()
+            worktree['leased'] = True
+            worktree['warm'] = bool(affinity) and self._affinities.get(affinity, {}).get('worktree') == worktree['name']
+        try:
+            if not os.path.exists(os.path.join(worktree['path'], '.git')):
+                os.makedirs(os.path.dirname(worktree['path']), exist_ok=True)
+                self._git(['worktree', 'add', '--detach', '--force', worktree['path'], commit], cwd=self.repo_dir)
+            else:
+                self._git(['reset', '--hard', '--quiet', commit], cwd=worktree['path'])
+                self._git(['clean', '-fd', '--quiet'], cwd=worktree['path'])
+            os.makedirs(worktree['derived_data_path'], exist_ok=True)
+        except Exception:
+            self.release(worktree, key=None)
+            raise
+        worktree['last_key'] = key
+        return worktree
+
+    def release(self, worktree: dict, key: Optional[str] = '', affinity: Optional[str] = None) -> None:
+        """Returns a leased worktree.  key=None forgets which branch it last held (e.g. after a failed reset); affinity
+        records that the worktree's DerivedData is now warm for it (and no longer for whatever it built before).  The
+        worktree is free again right away; its DerivedData is measured (and the pool's disk budget enforced) on a
+        background thread, since walking a large DerivedData takes a while."""
+        with self._cond:
+            worktree['leased'] = False
+            worktree['last_used_at'] = time.time()
+            if key is None:
+                worktree['last_key'] = None
+            if affinity:
+                self._affinities = {
+                    other: entry for other, entry in self._affinities.items() if entry['worktree'] != worktree['name']
+                }
+                self._affinities[affinity] = {'worktree': worktree['name'], 'last_used_at': worktree['last_used_at']}
+            self._save_state_locked()
+            self._cond.notify_all()
+        Thread(target=self._account_derived_data, args=[worktree], daemon=True).start()
+
+    def _account_derived_data(self, worktree: dict) -> None:
+        derived_data_bytes = _dir_size(worktree['derived_data_path'])
+        with self._cond:
+            worktree['derived_data_bytes'] = derived_data_bytes
+            cold = self._cold_worktrees_locked(keep=worktree)
+            for cold_worktree in cold:
+                #hold the worktree while its DerivedData is deleted so nobody builds into it meanwhile
+                cold_worktree['leased'] = True
+        for cold_worktree in cold:
+            self._evict_derived_data(cold_worktree)
+
+    def _cold_worktrees_locked(self, keep: dict) -> list[dict]:
+        """Least recently used idle worktrees (other than keep, the one just built in) whose DerivedData has to go to
+        bring the pool under its disk budget."""
+        if not self.derived_data_max_bytes:
+            return []
+        total_bytes = sum(worktree['derived_data_bytes'] for worktree in self._worktrees.values())
+        cold = []
+        for worktree in sorted(self._worktrees.values(), key=lambda worktree: worktree['last_used_at']):
+            if total_bytes <= self.derived_data_max_bytes:
+                break
+            if worktree is keep or worktree['leased'] or not worktree['derived_data_bytes']:
+                continue
+            total_bytes -= worktree['derived_data_bytes']
+            cold.append(worktree)
+        return cold
+
+    def _evict_derived_data(self, worktree: dict) -> None:
+        shutil.rmtree(worktree['derived_data_path'], ignore_errors=True)
+        with self._cond:
+            self._evicted_bytes += worktree['derived_data_bytes']
+            worktree['derived_data_bytes'] = 0
+            worktree['leased'] = False
+            self._affinities = {
+                affinity: entry for affinity, entry in self._affinities.items() if entry['worktree'] != worktree['name']
+            }
+            self._save_state_locked()
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                'max_worktrees': self.max_worktrees,
+                'derived_data_max_bytes': self.derived_data_max_bytes,
+                'derived_data_bytes': sum(worktree['derived_data_bytes'] for worktree in self._worktrees.values()),
+                'derived_data_evicted_bytes': self._evicted_bytes,
+                'worktrees': [
+                    {key: worktree[key] for key in ['name', 'path', 'leased', 'last_key', 'last_used_at', 'derived_data_bytes']}
+                    for worktree in self._worktrees.values()
+                ],
+                'affinities': dict(self._affinities),
+            }
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except OSError:
+                pass
+    return total